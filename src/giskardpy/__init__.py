@@ -8,4 +8,5 @@ MAP = u'map'
 import casadi_wrapper as cas_wrapper
 
 
+# pybullet or numpy, see numpy_world
 WORLD_IMPLEMENTATION = u'pybullet'
\ No newline at end of file
@@ -0,0 +1,183 @@
+import numpy as np
+import urdf_parser_py.urdf as up
+from tf.transformations import euler_matrix
+
+from giskardpy import logging
+from giskardpy.collision_geometry import get_bounding_spheres
+from giskardpy.utils import resolve_ros_iris
+
+# a capsule is a row with the start point of its segment, the end point of its segment and its radius
+CAPSULE_WIDTH = 7
+EPSILON = 1e-12
+
+
+def sphere_to_capsules(radius):
+    return np.array([[0, 0, 0, 0, 0, 0, radius]], dtype=float)
+
+
+def cylinder_to_capsules(radius, length):
+    """
+    The capsule contains the cylinder, its caps stick out by radius at both ends.
+    """
+    return np.array([[0, 0, -length / 2., 0, 0, length / 2., radius]], dtype=float)
+
+
+def box_to_capsules(size):
+    """
+    Splits the box into strips along its longest axis, each strip is covered by one capsule, whose radius is the half
+    diagonal of the strip's cross section.
+    :param size: x, y, z length of the box
+    :type size: list
+    :rtype: np.ndarray
+    """
+    half_size = np.array(size, dtype=float) / 2
+    long_axis, middle_axis, short_axis = np.argsort(half_size)[::-1]
+    number_of_strips = max(int(np.ceil(half_size[middle_axis] / max(half_size[short_axis], EPSILON))), 1)
+    strip_half_width = half_size[middle_axis] / number_of_strips
+    radius = np.sqrt(strip_half_width ** 2 + half_size[short_axis] ** 2)
+    capsules = np.zeros((number_of_strips, CAPSULE_WIDTH))
+    offsets = -half_size[middle_axis] + strip_half_width * (2 * np.arange(number_of_strips) + 1)
+    capsules[:, middle_axis] = offsets
+    capsules[:, 3 + middle_axis] = offsets
+    capsules[:, long_axis] = -half_size[long_axis]
+    capsules[:, 3 + long_axis] = half_size[long_axis]
+    capsules[:, 6] = radius
+    return capsules
+
+
+def mesh_to_capsules(filename, scale, number_of_spheres, cache_folder):
+    """
+    Meshes are covered by the spheres of collision_geometry.get_bounding_spheres.
+    :type number_of_spheres: int
+    :param cache_folder: where the spheres are saved
+    :type cache_folder: str
+    :rtype: np.ndarray
+    """
+    spheres = get_bounding_spheres(resolve_ros_iris(filename), scale, number_of_spheres, cache_folder)
+    capsules = np.zeros((len(spheres), CAPSULE_WIDTH))
+    capsules[:, :3] = spheres[:, :3]
+    capsules[:, 3:6] = spheres[:, :3]
+    capsules[:, 6] = spheres[:, 3]
+    return capsules
+
+
+def transform_capsules(T, capsules):
+    """
+    :param T: 4x4 matrix or array with shape (number of capsules, 4, 4)
+    :type T: np.ndarray
+    :type capsules: np.ndarray
+    :return: capsules in the frame of T
+    :rtype: np.ndarray
+    """
+    result = np.empty(capsules.shape)
+    if T.ndim == 2:
+        result[:, :3] = np.dot(capsules[:, :3], T[:3, :3].T) + T[:3, 3]
+        result[:, 3:6] = np.dot(capsules[:, 3:6], T[:3, :3].T) + T[:3, 3]
+    else:
+        result[:, :3] = np.einsum(u'nij,nj->ni', T[:, :3, :3], capsules[:, :3]) + T[:, :3, 3]
+        result[:, 3:6] = np.einsum(u'nij,nj->ni', T[:, :3, :3], capsules[:, 3:6]) + T[:, :3, 3]
+    result[:, 6] = capsules[:, 6]
+    return result
+
+
+def collision_to_capsules(collision, number_of_spheres, cache_folder):
+    """
+    :type collision: up.Collision
+    :param number_of_spheres: maximum number of spheres for meshes
+    :type number_of_spheres: int
+    :param cache_folder: where the spheres of meshes are saved
+    :type cache_folder: str
+    :return: capsules in the frame of the link
+    :rtype: np.ndarray
+    """
+    geometry = collision.geometry
+    if isinstance(geometry, up.Sphere):
+        capsules = sphere_to_capsules(geometry.radius)
+    elif isinstance(geometry, up.Cylinder):
+        capsules = cylinder_to_capsules(geometry.radius, geometry.length)
+    elif isinstance(geometry, up.Box):
+        capsules = box_to_capsules(geometry.size)
+    elif isinstance(geometry, up.Mesh):
+        try:
+            capsules = mesh_to_capsules(geometry.filename, geometry.scale, number_of_spheres, cache_folder)
+        except (IOError, TypeError) as e:
+            logging.logwarn(u'can\'t create capsules for mesh \'{}\': {}'.format(geometry.filename, e))
+            return np.zeros((0, CAPSULE_WIDTH))
+    else:
+        logging.logwarn(u'collision geometry {} not supported'.format(type(geometry)))
+        return np.zeros((0, CAPSULE_WIDTH))
+    origin = collision.origin
+    if origin is not None:
+        link_T_geometry = euler_matrix(*(origin.rpy if origin.rpy is not None else [0, 0, 0]))
+        if origin.xyz is not None:
+            link_T_geometry[:3, 3] = origin.xyz
+        capsules = transform_capsules(link_T_geometry, capsules)
+    return capsules
+
+
+def closest_points_on_segments(p0, p1, q0, q1):
+    """
+    Vectorized closest points between the segments p0-p1 and q0-q1, see Ericson, Real-Time Collision Detection, 5.1.9.
+    :param p0: array with shape (n, 3)
+    :return: closest point on p, closest point on q, both with shape (n, 3)
+    :rtype: tuple
+    """
+    d1 = p1 - p0
+    d2 = q1 - q0
+    r = p0 - q0
+    a = np.einsum(u'ij,ij->i', d1, d1)
+    e = np.einsum(u'ij,ij->i', d2, d2)
+    f = np.einsum(u'ij,ij->i', d2, r)
+    c = np.einsum(u'ij,ij->i', d1, r)
+    b = np.einsum(u'ij,ij->i', d1, d2)
+    p_is_point = a <= EPSILON
+    q_is_point = e <= EPSILON
+    safe_a = np.where(p_is_point, 1, a)
+    safe_e = np.where(q_is_point, 1, e)
+    denominator = a * e - b * b
+    parallel = denominator <= EPSILON * a * e
+    s = np.where(parallel, 0, np.clip((b * f - c * e) / np.where(parallel, 1, denominator), 0, 1))
+    t = (b * s + f) / safe_e
+    # t outside of the segment, clamp it and recompute s
+    s = np.where(t < 0, np.clip(-c / safe_a, 0, 1), np.where(t > 1, np.clip((b - c) / safe_a, 0, 1), s))
+    t = np.clip(t, 0, 1)
+    # degenerate segments
+    s = np.where(q_is_point, np.clip(-c / safe_a, 0, 1), s)
+    t = np.where(q_is_point, 0, t)
+    t = np.where(p_is_point, np.clip(f / safe_e, 0, 1), t)
+    s = np.where(p_is_point, 0, s)
+    t = np.where(p_is_point & q_is_point, 0, t)
+    return p0 + d1 * s[:, None], q0 + d2 * t[:, None]
+
+
+def capsule_distances(capsules_a, capsules_b):
+    """
+    :param capsules_a: array with shape (n, 7)
+    :param capsules_b: array with shape (n, 7)
+    :return: position on a, position on b, contact normal on b pointing towards a, distance; for each row
+    :rtype: tuple
+    """
+    on_a, on_b = closest_points_on_segments(capsules_a[:, :3], capsules_a[:, 3:6],
+                                            capsules_b[:, :3], capsules_b[:, 3:6])
+    diff = on_a - on_b
+    center_distance = np.sqrt(np.einsum(u'ij,ij->i', diff, diff))
+    normal = np.zeros(diff.shape)
+    normal[:, 2] = 1
+    non_zero = center_distance > EPSILON
+    normal[non_zero] = diff[non_zero] / center_distance[non_zero, None]
+    radius_a = capsules_a[:, 6]
+    radius_b = capsules_b[:, 6]
+    position_on_a = on_a - normal * radius_a[:, None]
+    position_on_b = on_b + normal * radius_b[:, None]
+    return position_on_a, position_on_b, normal, center_distance - radius_a - radius_b
+
+
+def capsules_aabb(capsules):
+    """
+    :return: min corner, max corner
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    radius = capsules[:, 6:7]
+    lower = np.minimum(capsules[:, :3], capsules[:, 3:6]) - radius
+    upper = np.maximum(capsules[:, :3], capsules[:, 3:6]) + radius
+    return lower.min(axis=0), upper.max(axis=0)
@@ -1,5 +1,10 @@
+import hashlib
 import os
 import pickle
+import subprocess
+import tempfile
+from collections import OrderedDict
+from time import time
 
 import casadi as ca
 import errno
@@ -11,6 +16,9 @@ from giskardpy import logging
 
 pathSeparator = '_'
 
+# increase this, when a change makes previously pickled CompiledFunctions incompatible
+COMPILED_FUNCTION_VERSION = 4
+
 # VERY_SMALL_NUMBER = 2.22507385851e-308
 VERY_SMALL_NUMBER = 1e-100
 SMALL_NUMBER = 1e-10
@@ -112,6 +120,15 @@ def zeros(x, y):
     return ca.SX.zeros(x, y)
 
 
+def vstack(matrices):
+    """
+    :type matrices: list
+    :return: the matrices stacked on top of each other
+    :rtype: Matrix
+    """
+    return ca.vertcat(*matrices)
+
+
 def Abs(x):
     """
     :type x: Union[float, Symbol]
@@ -215,38 +232,233 @@ def if_eq(a, b, if_result, else_result):
     return ca.if_else(ca.eq(a, b), if_result, else_result)
 
 
+def get_libraries(f):
+    """
+    :type f: Union[CompiledFunction, StackedCompiledFunction]
+    :return: absolute paths of the shared libraries that f was loaded from
+    :rtype: set
+    """
+    if isinstance(f, StackedCompiledFunction):
+        return set().union(*[get_libraries(x) for x in f.functions])
+    if f.library is None:
+        return set()
+    return {os.path.abspath(f.library)}
+
+
 def safe_compiled_function(f, file_name):
+    """
+    Pickles f to file_name. The file is written to a temporary name first and then renamed, such that concurrent
+    writers and readers never see a partially written file.
+    The shared libraries of f are pickled separately in front of f, such that evict_compiled_functions can read them
+    without loading f.
+    :type f: CompiledFunction
+    :type file_name: str
+    """
     if not os.path.exists(os.path.dirname(file_name)):
         try:
             os.makedirs(os.path.dirname(file_name))
         except OSError as exc:  # Guard against race condition
             if exc.errno != errno.EEXIST:
                 raise
-    with open(file_name, 'w') as file:
-        pickle.dump(f, file)
-        logging.loginfo(u'saved {}'.format(file_name))
+    tmp_file_name = u'{}.{}.tmp'.format(file_name, os.getpid())
+    with open(tmp_file_name, 'wb') as file:
+        pickle.dump((COMPILED_FUNCTION_VERSION, get_libraries(f)), file, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(f, file, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file_name, file_name)
+    logging.loginfo(u'saved {}'.format(file_name))
 
 
 def load_compiled_function(file_name):
+    """
+    :type file_name: str
+    :return: the function saved with safe_compiled_function or None, if the file does not exist, is corrupted or was
+                created by a different version
+    :rtype: CompiledFunction
+    """
     if os.path.isfile(file_name):
         try:
-            with open(file_name, u'r') as file:
+            with open(file_name, u'rb') as file:
+                version, _ = pickle.load(file)
+                if version != COMPILED_FUNCTION_VERSION:
+                    raise ValueError(u'version {} != {}'.format(version, COMPILED_FUNCTION_VERSION))
                 fast_f = pickle.load(file)
-                return fast_f
-        except EOFError as e:
-            os.remove(file_name)
-            logging.logerr(u'{} deleted because it was corrupted'.format(file_name))
+        except Exception as e:
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+            logging.logerr(u'{} deleted because it was corrupted or outdated: {}'.format(file_name, e))
+            return None
+        # update the modification time, such that evict_compiled_functions removes the least recently used files
+        try:
+            os.utime(file_name, None)
+        except OSError:
+            # another process evicted it in the meantime, which doesn't affect the loaded function
+            pass
+        logging.loginfo(u'loaded {}'.format(file_name))
+        return fast_f
+
+
+def evict_compiled_functions(folder, max_size=0, max_age=0):
+    """
+    Deletes files that were saved with safe_compiled_function in folder, starting with the least recently used ones.
+    Shared libraries in folder get deleted together with the last file that uses them, libraries that are not used by
+    any file are evicted on their own. Files that are still being written by other processes are skipped.
+    :param max_size: in MB, files get deleted until the folder is smaller than this. 0 means no limit.
+    :type max_size: float
+    :param max_age: in days, files that have not been used for longer get deleted. 0 means no limit.
+    :type max_age: float
+    """
+    if not os.path.isdir(folder):
+        return
+    functions = []
+    libraries = {}
+    for file_name in os.listdir(folder):
+        if file_name.endswith(u'.tmp') or file_name.endswith(u'.c'):
+            # safe_compiled_function or compile_shared_library of another process is not done yet
+            continue
+        path = os.path.abspath(os.path.join(folder, file_name))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path):
+            continue
+        if file_name.endswith(u'.so'):
+            libraries[path] = stat.st_size
+            functions.append((stat.st_mtime, stat.st_size, path, set()))
+            continue
+        try:
+            with open(path, u'rb') as file:
+                version, used_libraries = pickle.load(file)
+            if version != COMPILED_FUNCTION_VERSION:
+                used_libraries = set()
+        except Exception:
+            # load_compiled_function deletes these files anyway
+            used_libraries = set()
+        functions.append((stat.st_mtime, stat.st_size, path, used_libraries))
+    users = {library: 0 for library in libraries}
+    for _, _, _, used_libraries in functions:
+        for library in used_libraries & set(libraries):
+            users[library] += 1
+    # used libraries are deleted with their last user instead
+    functions = [x for x in functions if x[2] not in users or users[x[2]] == 0]
+    functions.sort()
+    total_size = sum(x[1] for x in functions) + sum(size for library, size in libraries.items() if users[library] > 0)
+    now = time()
+    for mtime, size, path, used_libraries in functions:
+        too_old = max_age > 0 and now - mtime > max_age * 24 * 60 * 60
+        too_big = max_size > 0 and total_size > max_size * 1024 * 1024
+        if not too_old and not too_big:
+            break
+        if remove_cached_file(path):
+            total_size -= size
+        for library in used_libraries & set(libraries):
+            users[library] -= 1
+            if users[library] == 0 and remove_cached_file(library):
+                total_size -= libraries[library]
+
+
+def remove_cached_file(path):
+    """
+    :return: whether path was deleted
+    :rtype: bool
+    """
+    try:
+        os.remove(path)
+        logging.loginfo(u'deleted {} from function cache'.format(path))
+        return True
+    except OSError:
+        # another process might have deleted it already
+        return False
+
+
+def compile_shared_library(f, compiler, build_folder):
+    """
+    Generates C code for f and compiles it into a shared library in build_folder. Libraries are named after the hash
+    of their code, such that they only have to be compiled once.
+    :type f: ca.Function
+    :param compiler: e.g. gcc or clang
+    :type compiler: str
+    :type build_folder: str
+    :return: path to the shared library or None, if compilation failed
+    :rtype: str
+    """
+    code_generator = ca.CodeGenerator(u'{}.c'.format(f.name()), {u'with_header': False})
+    code_generator.add(f)
+    code = code_generator.dump()
+    library = os.path.join(build_folder, u'{}.so'.format(hashlib.md5((compiler + code).encode(u'utf-8')).hexdigest()))
+    if os.path.isfile(library):
+        try:
+            # for evict_compiled_functions
+            os.utime(library, None)
+        except OSError:
+            pass
+        return library
+    if not os.path.exists(build_folder):
+        try:
+            os.makedirs(build_folder)
+        except OSError as exc:  # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+    t = time()
+    c_file_name = u'{}.{}.c'.format(library[:-3], os.getpid())
+    tmp_library = u'{}.{}.tmp'.format(library, os.getpid())
+    with open(c_file_name, u'w') as c_file:
+        c_file.write(code)
+    try:
+        # higher optimization levels take ages for big functions without making them much faster
+        subprocess.check_call([compiler, u'-fPIC', u'-shared', u'-O1', c_file_name, u'-o', tmp_library])
+        os.rename(tmp_library, library)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.logwarn(u'failed to compile {} with {}: {}'.format(c_file_name, compiler, e))
+        return None
+    finally:
+        os.remove(c_file_name)
+    logging.loginfo(u'compiled {} in {:.5f}s'.format(library, time() - t))
+    return library
 
 
 class CompiledFunction(object):
-    def __init__(self, str_params, fast_f, l, shape):
+    def __init__(self, str_params, fast_f, l, shape, sparse=False, library=None):
+        """
+        :param sparse: if True, call2 only returns the structural nonzeros of the result in column major order,
+                        use get_sparsity to get their indices.
+        :type sparse: bool
+        :param library: shared library that fast_f was loaded from, see compile_shared_library
+        :type library: str
+        """
         self.str_params = str_params
         self.fast_f = fast_f
+        self.library = library
         self.shape = shape
+        self.sparse = sparse
         self.buf, self.f_eval = fast_f.buffer()
-        self.out = np.zeros(self.shape, order='F')
+        self.batch_fs = {}
+        if self.sparse:
+            self.out = np.zeros(fast_f.nnz_out(0))
+        else:
+            self.out = np.zeros(self.shape, order='F')
         self.buf.set_res(0, memoryview(self.out))
 
+    def __getstate__(self):
+        # buffers can't be pickled, they are recreated in __setstate__
+        if self.library is not None:
+            # functions from shared libraries can't be pickled, they are loaded again instead
+            return self.str_params, None, self.shape, self.sparse, self.library
+        return self.str_params, self.fast_f, self.shape, self.sparse, self.library
+
+    def __setstate__(self, state):
+        str_params, fast_f, shape, sparse, library = state
+        if library is not None:
+            # raises if the library was evicted from the cache, which makes load_compiled_function delete this file
+            fast_f = ca.external(u'f', library)
+            try:
+                os.utime(library, None)
+            except OSError:
+                pass
+        self.__init__(str_params, fast_f, 0, shape, sparse, library)
+
     def __call__(self, **kwargs):
         filtered_args = [kwargs[k] for k in self.str_params]
         return self.call2(filtered_args)
@@ -258,22 +470,161 @@ class CompiledFunction(object):
         :return:
         """
 
-        filtered_args = np.array(filtered_args, dtype=float)
+        # no copy, if filtered_args already is a float array, e.g. from GodMap.get_input_layout
+        filtered_args = np.asarray(filtered_args, dtype=float)
         self.buf.set_arg(0, memoryview(filtered_args))
         self.f_eval()
         return self.out
 
+    def call_batch(self, filtered_args):
+        """
+        Evaluates the function for many parameter vectors at once with casadi's map, which is a lot faster than
+        calling call2 in a loop.
+        :param filtered_args: one row of parameter values for each evaluation, in the same order as in self.str_params
+        :type filtered_args: np.ndarray
+        :return: array with shape (number of rows in filtered_args, shape[0], shape[1]) or, if sparse is True,
+                    (number of rows in filtered_args, number of nonzeros)
+        :rtype: np.ndarray
+        """
+        filtered_args = np.asarray(filtered_args, dtype=float)
+        n = filtered_args.shape[0]
+        if n not in self.batch_fs:
+            self.batch_fs[n] = self.fast_f.map(n)
+        # map concatenates the results horizontally
+        result = self.batch_fs[n](filtered_args.T)
+        if self.sparse:
+            return np.array(result.nonzeros()).reshape(n, -1)
+        return np.array(result.full()).reshape(self.shape[0], n, self.shape[1]).transpose(1, 0, 2)
+
+    def get_sparsity(self):
+        """
+        :return: row and column indices of the entries returned by call2, if sparse is True
+        :rtype: (np.ndarray, np.ndarray)
+        """
+        rows, columns = self.fast_f.sparsity_out(0).get_triplet()
+        return np.array(rows, dtype=int), np.array(columns, dtype=int)
+
 
-def speed_up(function, parameters, backend=u'clang'):
+class StackedCompiledFunction(object):
+    """
+    Evaluates several CompiledFunctions and scatters their results into one matrix. This allows to reuse the functions
+    of parts of a big expression that did not change, instead of compiling the whole thing again.
+    """
+
+    def __init__(self, functions, rows, columns, shape, sparse=False):
+        """
+        :type functions: list of CompiledFunction
+        :param rows: for each function a matrix with the same shape as its result, containing the row of each entry in
+                        the stacked result
+        :type rows: list of np.ndarray
+        :param columns: same as rows, but for the columns
+        :type columns: list of np.ndarray
+        :param shape: shape of the stacked result
+        :type shape: tuple
+        :param sparse: if True, call2 only returns the structural nonzeros of the result in column major order,
+                        use get_sparsity to get their indices. All functions have to be sparse as well.
+        :type sparse: bool
+        """
+        self.functions = functions
+        self.shape = shape
+        self.sparse = sparse
+        param_index = OrderedDict()
+        for f in functions:
+            for param in f.str_params:
+                param_index.setdefault(param, len(param_index))
+        self.str_params = list(param_index.keys())
+        self.param_indices = [np.array([param_index[x] for x in f.str_params], dtype=int) for f in functions]
+        if self.sparse:
+            stacked_rows = []
+            stacked_columns = []
+            for f, f_rows, f_columns in zip(functions, rows, columns):
+                nz_rows, nz_columns = f.get_sparsity()
+                stacked_rows.append(f_rows[nz_rows, nz_columns])
+                stacked_columns.append(f_columns[nz_rows, nz_columns])
+            stacked_rows = np.concatenate(stacked_rows).astype(int)
+            stacked_columns = np.concatenate(stacked_columns).astype(int)
+            # column major order, like the result of a sparse CompiledFunction
+            order = np.lexsort((stacked_rows, stacked_columns))
+            self.rows = stacked_rows[order]
+            self.columns = stacked_columns[order]
+            position = np.empty(len(order), dtype=int)
+            position[order] = np.arange(len(order))
+            self.out_indices = np.split(position, np.cumsum([f.out.shape[0] for f in functions])[:-1])
+            self.out = np.zeros(len(order))
+        else:
+            self.out_indices = [(np.asarray(f_rows, dtype=int), np.asarray(f_columns, dtype=int))
+                                for f_rows, f_columns in zip(rows, columns)]
+            self.out = np.zeros(self.shape)
+
+    def __call__(self, **kwargs):
+        filtered_args = [kwargs[k] for k in self.str_params]
+        return self.call2(filtered_args)
+
+    def call2(self, filtered_args):
+        """
+        :param filtered_args: parameter values in the same order as in self.str_params
+        :type filtered_args: list
+        :return:
+        """
+        filtered_args = np.asarray(filtered_args, dtype=float)
+        for f, param_index, out_index in zip(self.functions, self.param_indices, self.out_indices):
+            self.out[out_index] = f.call2(filtered_args[param_index])
+        return self.out
+
+    def call_batch(self, filtered_args):
+        """
+        See CompiledFunction.call_batch.
+        :type filtered_args: np.ndarray
+        :rtype: np.ndarray
+        """
+        filtered_args = np.asarray(filtered_args, dtype=float)
+        out = np.zeros((filtered_args.shape[0],) + self.out.shape)
+        for f, param_index, out_index in zip(self.functions, self.param_indices, self.out_indices):
+            if self.sparse:
+                out[:, out_index] = f.call_batch(filtered_args[:, param_index])
+            else:
+                out[(slice(None),) + out_index] = f.call_batch(filtered_args[:, param_index])
+        return out
+
+    def get_sparsity(self):
+        """
+        :return: row and column indices of the entries returned by call2, if sparse is True
+        :rtype: (np.ndarray, np.ndarray)
+        """
+        return self.rows, self.columns
+
+
+def speed_up(function, parameters, backend=None, sparse=False, build_folder=None):
+    """
+    :param backend: None evaluates the function with casadi's virtual machine, otherwise it is the c compiler, e.g.
+                    gcc or clang, that is used to compile it into a shared library. Compiling takes a while, but the
+                    function gets a lot faster.
+    :type backend: str
+    :param sparse: if True, entries of function that are always 0 are not evaluated, see CompiledFunction
+    :type sparse: bool
+    :param build_folder: where shared libraries are stored, if backend is not None. Defaults to a folder in /tmp.
+    :type build_folder: str
+    :rtype: CompiledFunction
+    """
     str_params = [str(x) for x in parameters]
-    try:
-        f = ca.Function('f', [Matrix(parameters)], [ca.densify(function)])
-    except:
-        # try:
-        f = ca.Function('f', [Matrix(parameters)], ca.densify(function))
-        # except:
-        #     f = ca.Function('f', parameters, [ca.densify(function)])
-    return CompiledFunction(str_params, f, 0, function.shape)
+    if sparse:
+        f = ca.Function('f', [Matrix(parameters)], [ca.sparsify(function)])
+    else:
+        try:
+            f = ca.Function('f', [Matrix(parameters)], [ca.densify(function)])
+        except:
+            # try:
+            f = ca.Function('f', [Matrix(parameters)], ca.densify(function))
+            # except:
+            #     f = ca.Function('f', parameters, [ca.densify(function)])
+    library = None
+    if backend is not None:
+        if not build_folder:
+            build_folder = os.path.join(tempfile.gettempdir(), u'giskardpy_shared_libraries')
+        library = compile_shared_library(f, backend, build_folder)
+        if library is not None:
+            f = ca.external(u'f', library)
+    return CompiledFunction(str_params, f, 0, function.shape, sparse=sparse, library=library)
 
 
 def cross(u, v):
@@ -0,0 +1,268 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import urdf_parser_py.urdf as up
+from tf.transformations import euler_matrix
+
+from giskardpy import logging
+from giskardpy.utils import resolve_ros_iris, convert_dae_to_obj, create_path
+
+ORIGINAL = u'original'
+CONVEX_HULL = u'convex_hull'
+SPHERES = u'spheres'
+# part of the cache key of spheres, increase it when bounding_spheres changes
+SPHERES_VERSION = 2
+
+
+def load_mesh(path):
+    """
+    :param path: path to an obj, stl or dae file, dae files are converted to obj with meshlabserver
+    :type path: str
+    :return: array with shape (number of vertices, 3), list of faces, each face is a list of vertex indices
+    :rtype: (np.ndarray, list)
+    """
+    if path.lower().endswith(u'.dae'):
+        path = convert_dae_to_obj(path)
+    if path.lower().endswith(u'.obj'):
+        vertices = []
+        faces = []
+        with open(path) as f:
+            for line in f:
+                if line.startswith(u'v '):
+                    vertices.append([float(x) for x in line.split()[1:4]])
+                elif line.startswith(u'f '):
+                    # f v1/vt1/vn1 v2/vt2/vn2 ..., negative indices are relative to the end
+                    face = [int(x.split(u'/')[0]) for x in line.split()[1:]]
+                    faces.append([i - 1 if i > 0 else len(vertices) + i for i in face])
+        return np.array(vertices), faces
+    if path.lower().endswith(u'.stl'):
+        with open(path, u'rb') as f:
+            data = f.read()
+        if data[:5] == b'solid' and b'facet' in data[:1000]:
+            vertices = np.array([[float(x) for x in line.split()[1:4]] for line in data.decode(u'ascii').split(u'\n')
+                                 if line.strip().startswith(u'vertex')])
+        else:
+            number_of_triangles = np.frombuffer(data, dtype=u'<u4', count=1, offset=80)[0]
+            triangles = np.frombuffer(data, count=number_of_triangles, offset=84,
+                                      dtype=np.dtype([(u'normal', u'<f4', (3,)),
+                                                      (u'vertices', u'<f4', (3, 3)),
+                                                      (u'attribute', u'<u2')]))
+            vertices = triangles[u'vertices'].reshape(-1, 3).astype(float)
+        return vertices, np.arange(len(vertices)).reshape(-1, 3).tolist()
+    raise TypeError(u'can\'t read vertices of mesh \'{}\''.format(path))
+
+
+def load_mesh_vertices(path):
+    """
+    :param path: path to an obj, stl or dae file, dae files are converted to obj with meshlabserver
+    :type path: str
+    :return: array with shape (number of vertices, 3)
+    :rtype: np.ndarray
+    """
+    return load_mesh(path)[0]
+
+
+def get_edges(number_of_vertices, faces):
+    """
+    :type number_of_vertices: int
+    :param faces: list of faces, each face is a list of vertex indices
+    :type faces: list
+    :return: array with shape (number of edges, 2) with the edges of all faces or all pairs of vertices, if there are
+                no faces, because then the convex hull of the vertices is the only safe guess for the surface
+    :rtype: np.ndarray
+    """
+    if not faces:
+        return np.array(np.triu_indices(number_of_vertices, 1)).T
+    edges = set()
+    for face in faces:
+        for a, b in zip(face, face[1:] + face[:1]):
+            edges.add((min(a, b), max(a, b)))
+    return np.array(sorted(edges), dtype=int).reshape(-1, 2)
+
+
+def bounding_spheres(vertices, number_of_spheres, faces=None):
+    """
+    Splits the mesh into slices along its principal axis and computes a sphere for each slice, that contains the part
+    of the surface inside of the slice.
+    The part of a face inside of a slice is contained in the convex hull of the face's vertices inside of the slice
+    and the points, where its edges cross the borders of the slice, so the sphere has to contain only those points.
+    :param vertices: array with shape (number of vertices, 3)
+    :type vertices: np.ndarray
+    :type number_of_spheres: int
+    :param faces: list of faces, each face is a list of vertex indices, if None the surface is assumed to be the convex
+                    hull of the vertices
+    :type faces: list
+    :return: array with shape (number of spheres, 4), each row is x, y, z, radius
+    :rtype: np.ndarray
+    """
+    mean = vertices.mean(axis=0)
+    _, _, axes = np.linalg.svd(vertices - mean, full_matrices=False)
+    projection = np.dot(vertices - mean, axes[0])
+    borders = np.linspace(projection.min(), projection.max(), number_of_spheres + 1)
+    edges = get_edges(len(vertices), faces)
+    edge_min = np.minimum(projection[edges[:, 0]], projection[edges[:, 1]])
+    edge_max = np.maximum(projection[edges[:, 0]], projection[edges[:, 1]])
+    crossings = []
+    for border in borders:
+        crossing = edges[(edge_min < border) & (edge_max > border)]
+        a = vertices[crossing[:, 0]]
+        b = vertices[crossing[:, 1]]
+        t = (border - projection[crossing[:, 0]]) / (projection[crossing[:, 1]] - projection[crossing[:, 0]])
+        crossings.append(a + (b - a) * t[:, None])
+    spheres = []
+    for i, (lower, upper) in enumerate(zip(borders[:-1], borders[1:])):
+        in_slice = np.concatenate([vertices[(projection >= lower) & (projection <= upper)],
+                                   crossings[i],
+                                   crossings[i + 1]])
+        if len(in_slice) == 0:
+            # no surface in this slice, e.g. between two parts of the mesh, that are not connected
+            continue
+        center = (in_slice.min(axis=0) + in_slice.max(axis=0)) / 2
+        radius = np.linalg.norm(in_slice - center, axis=1).max()
+        spheres.append(np.append(center, radius))
+    return np.array(spheres)
+
+
+def get_mesh_hash(path, *args):
+    """
+    :return: md5 of the mesh file and args
+    :rtype: str
+    """
+    m = hashlib.md5()
+    with open(path, u'rb') as f:
+        m.update(f.read())
+    m.update(str(args).encode(u'utf-8'))
+    return m.hexdigest()
+
+
+def get_convex_hull(path, cache_folder):
+    """
+    :param path: path to the original mesh
+    :type path: str
+    :param cache_folder: where the convex hulls are saved
+    :type cache_folder: str
+    :return: path to an obj file with the convex hull of the mesh or path, if it couldn't be computed
+    :rtype: str
+    """
+    hull_path = u'{}{}.obj'.format(cache_folder, get_mesh_hash(path, CONVEX_HULL))
+    if not os.path.isfile(hull_path):
+        try:
+            from scipy.spatial import ConvexHull
+        except ImportError:
+            logging.logwarn(u'scipy not installed, can\'t compute convex hull of \'{}\''.format(path))
+            return path
+        vertices = load_mesh_vertices(path)
+        hull = ConvexHull(vertices)
+        # only keep the vertices of the hull and renumber them
+        new_index = {old: new for new, old in enumerate(hull.vertices)}
+        create_path(hull_path)
+        with open(hull_path, u'w') as f:
+            for vertex in vertices[hull.vertices]:
+                f.write(u'v {} {} {}\n'.format(*vertex))
+            for simplex in hull.simplices:
+                f.write(u'f {} {} {}\n'.format(*[new_index[x] + 1 for x in simplex]))
+        logging.loginfo(u'saved convex hull of \'{}\' with {} instead of {} vertices in \'{}\''.format(
+            path, len(hull.vertices), len(vertices), hull_path))
+    return hull_path
+
+
+def get_bounding_spheres(path, scale, number_of_spheres, cache_folder):
+    """
+    :param path: path to the original mesh
+    :type path: str
+    :param scale: scale of the mesh in the urdf
+    :type scale: list
+    :type number_of_spheres: int
+    :param cache_folder: where the spheres are saved
+    :type cache_folder: str
+    :return: array with shape (number of spheres, 4), each row is x, y, z, radius in the frame of the mesh
+    :rtype: np.ndarray
+    """
+    spheres_path = u'{}{}.spheres'.format(cache_folder,
+                                          get_mesh_hash(path, SPHERES, SPHERES_VERSION, scale, number_of_spheres))
+    if os.path.isfile(spheres_path):
+        with open(spheres_path, u'rb') as f:
+            return pickle.load(f)
+    vertices, faces = load_mesh(path)
+    if scale is not None:
+        vertices = vertices * np.array(scale)
+    spheres = bounding_spheres(vertices, number_of_spheres, faces)
+    create_path(spheres_path)
+    with open(spheres_path, u'wb') as f:
+        pickle.dump(spheres, f)
+    return spheres
+
+
+def spheres_to_collisions(spheres, origin):
+    """
+    :param spheres: array with shape (number of spheres, 4), each row is x, y, z, radius in the frame of origin
+    :type spheres: np.ndarray
+    :param origin: origin of the replaced collision element
+    :type origin: up.Pose
+    :rtype: list
+    """
+    link_T_mesh = np.eye(4)
+    if origin is not None:
+        if origin.rpy is not None:
+            link_T_mesh = euler_matrix(*origin.rpy)
+        if origin.xyz is not None:
+            link_T_mesh[:3, 3] = origin.xyz
+    collisions = []
+    for x, y, z, radius in spheres:
+        position = np.dot(link_T_mesh, [x, y, z, 1])[:3]
+        collisions.append(up.Collision(up.Sphere(float(radius)),
+                                       origin=up.Pose(xyz=[float(v) for v in position], rpy=[0, 0, 0])))
+    return collisions
+
+
+def simplify_collision_geometry(urdf, fidelity, cache_folder, number_of_spheres=8):
+    """
+    Replaces the collision meshes of all links with simpler geometry, which is much cheaper for distance queries.
+    :type urdf: str
+    :param fidelity: ORIGINAL, CONVEX_HULL or SPHERES
+    :type fidelity: str
+    :param cache_folder: where the simplified geometry is saved, it is reused as long as the mesh file doesn't change
+    :type cache_folder: str
+    :param number_of_spheres: maximum number of spheres per mesh, if fidelity is SPHERES
+    :type number_of_spheres: int
+    :return: urdf with simplified collision geometry
+    :rtype: str
+    """
+    if fidelity == ORIGINAL:
+        return urdf
+    if fidelity not in (CONVEX_HULL, SPHERES):
+        raise ValueError(u'unknown collision geometry fidelity \'{}\''.format(fidelity))
+    robot = up.URDF.from_xml_string(urdf)
+    changed = False
+    for link in robot.links:
+        if not hasattr(link, u'collisions'):
+            # old versions of urdf_parser_py only support one collision element per link
+            collisions = [link.collision] if link.collision is not None else []
+        else:
+            collisions = link.collisions
+        new_collisions = []
+        for collision in collisions:
+            if not isinstance(collision.geometry, up.Mesh):
+                new_collisions.append(collision)
+                continue
+            path = resolve_ros_iris(collision.geometry.filename)
+            if not os.path.isfile(path):
+                logging.logwarn(u'collision mesh \'{}\' does not exist'.format(path))
+                new_collisions.append(collision)
+                continue
+            changed = True
+            if fidelity == SPHERES and hasattr(link, u'collisions'):
+                spheres = get_bounding_spheres(path, collision.geometry.scale, number_of_spheres, cache_folder)
+                new_collisions.extend(spheres_to_collisions(spheres, collision.origin))
+            else:
+                collision.geometry.filename = get_convex_hull(path, cache_folder)
+                new_collisions.append(collision)
+        if hasattr(link, u'collisions'):
+            link.collisions = new_collisions
+        elif new_collisions:
+            link.collision = new_collisions[0]
+    if not changed:
+        return urdf
+    return robot.to_xml_string()
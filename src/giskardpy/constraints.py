@@ -12,7 +12,7 @@ from giskard_msgs.msg import Constraint as Constraint_msg
 import giskardpy.identifier as identifier
 import giskardpy.tfwrapper as tf
 from giskardpy import cas_wrapper as w
-from giskardpy.data_types import SoftConstraint
+from giskardpy.data_types import SoftConstraint, Collisions
 from giskardpy.exceptions import GiskardException, ConstraintException
 from giskardpy.input_system import \
     PoseStampedInput, Point3Input, Vector3Input, \
@@ -213,6 +213,34 @@ class Constraint(object):
         return PointStampedInput(self.god_map.to_symbol,
                                  prefix=self.get_identifier() + [name, u'point']).get_expression()
 
+    def get_input_collision_point3(self, prefix, column):
+        """
+        :param prefix: identifier of a row of a Collisions array
+        :type prefix: list
+        :param column: column of the x coordinate, see the column constants of Collisions
+        :type column: int
+        :return: a point with symbols that refer to the god map
+        """
+        return Point3Input(self.god_map.to_symbol,
+                           prefix=prefix,
+                           x=(column,),
+                           y=(column + 1,),
+                           z=(column + 2,)).get_expression()
+
+    def get_input_collision_vector3(self, prefix, column):
+        """
+        :param prefix: identifier of a row of a Collisions array
+        :type prefix: list
+        :param column: column of the x coordinate, see the column constants of Collisions
+        :type column: int
+        :return: a vector with symbols that refer to the god map
+        """
+        return Vector3Input(self.god_map.to_symbol,
+                            prefix=prefix,
+                            x=(column,),
+                            y=(column + 1,),
+                            z=(column + 2,)).get_expression()
+
     def get_input_np_frame(self, name):
         return FrameInput(self.get_god_map().to_symbol,
                           prefix=self.get_identifier() + [name]).get_frame()
@@ -1307,39 +1335,23 @@ class ExternalCollisionAvoidance(Constraint):
         self.save_params_on_god_map(params)
 
     def get_contact_normal_on_b_in_root(self):
-        return Vector3Input(self.god_map.to_symbol,
-                            prefix=identifier.closest_point + [u'get_external_collisions',
-                                                               (self.link_name,),
-                                                               self.idx,
-                                                               u'get_contact_normal_in_root',
-                                                               tuple()]).get_expression()
+        return self.get_input_collision_vector3(self.get_collision_prefix(), Collisions.CONTACT_NORMAL_IN_ROOT)
 
     def get_closest_point_on_a_in_a(self):
-        return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_external_collisions',
-                                                              (self.link_name,),
-                                                              self.idx,
-                                                              u'get_position_on_a_in_a',
-                                                              tuple()]).get_expression()
+        return self.get_input_collision_point3(self.get_collision_prefix(), Collisions.POSITION_ON_A_IN_A)
 
     def get_closest_point_on_b_in_root(self):
-        return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_external_collisions',
-                                                              (self.link_name,),
-                                                              self.idx,
-                                                              u'get_position_on_b_in_root',
-                                                              tuple()]).get_expression()
+        return self.get_input_collision_point3(self.get_collision_prefix(), Collisions.POSITION_ON_B_IN_ROOT)
 
     def get_actual_distance(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_external_collisions',
-                                                                  (self.link_name,),
-                                                                  self.idx,
-                                                                  u'get_contact_distance',
-                                                                  tuple()])
+        return self.god_map.to_symbol(self.get_collision_prefix() + [Collisions.CONTACT_DISTANCE])
 
     def get_number_of_external_collisions(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_number_of_external_collisions',
-                                                                  (self.link_name,)])
+        return self.god_map.to_symbol(identifier.closest_point + [u'number_of_external_collisions',
+                                                                  self.link_name])
+
+    def get_collision_prefix(self):
+        return identifier.closest_point + [u'external_collisions', self.link_name, self.idx]
 
     def make_constraints(self):
         a_P_pa = self.get_closest_point_on_a_in_a()
@@ -1464,39 +1476,25 @@ class CollisionAvoidanceHint(Constraint):
         self.save_params_on_god_map(params)
 
     def get_contact_normal_on_b_in_root(self):
-        return Vector3Input(self.god_map.to_symbol,
-                            prefix=identifier.closest_point + [u'get_external_collisions_long_key',
-                                                               self.key,
-                                                               u'get_contact_normal_in_root',
-                                                               tuple()]).get_expression()
+        return self.get_input_collision_vector3(self.get_collision_prefix(), Collisions.CONTACT_NORMAL_IN_ROOT)
 
     def get_closest_point_on_a_in_a(self):
-        return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_external_collisions_long_key',
-                                                              self.key,
-                                                              u'get_position_on_a_in_a',
-                                                              tuple()]).get_expression()
+        return self.get_input_collision_point3(self.get_collision_prefix(), Collisions.POSITION_ON_A_IN_A)
 
     def get_closest_point_on_b_in_root(self):
-        return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_external_collisions_long_key',
-                                                              self.key,
-                                                              u'get_position_on_b_in_root',
-                                                              tuple()]).get_expression()
+        return self.get_input_collision_point3(self.get_collision_prefix(), Collisions.POSITION_ON_B_IN_ROOT)
 
     def get_actual_distance(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_external_collisions_long_key',
-                                                                  self.key,
-                                                                  u'get_contact_distance',
-                                                                  tuple()])
+        return self.god_map.to_symbol(self.get_collision_prefix() + [Collisions.CONTACT_DISTANCE])
 
     def get_body_b(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_external_collisions_long_key',
-                                                                  self.key, u'get_body_b_hash', tuple()])
+        return self.god_map.to_symbol(self.get_collision_prefix() + [Collisions.BODY_B_HASH])
 
     def get_link_b(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_external_collisions_long_key',
-                                                                  self.key, u'get_link_b_hash', tuple()])
+        return self.god_map.to_symbol(self.get_collision_prefix() + [Collisions.LINK_B_HASH])
+
+    def get_collision_prefix(self):
+        return identifier.closest_point + [u'external_collision_long_key', self.key]
 
     def make_constraints(self):
         weight = self.get_input_float(self.weight_id)
@@ -1566,40 +1564,29 @@ class SelfCollisionAvoidance(Constraint):
         self.save_params_on_god_map(params)
 
     def get_contact_normal_in_b(self):
-        return Vector3Input(self.god_map.to_symbol,
-                            prefix=identifier.closest_point + [u'get_self_collisions',
-                                                               (self.link_a, self.link_b),
-                                                               self.idx,
-                                                               u'get_contact_normal_in_b',
-                                                               tuple()]).get_expression()
+        return self.get_input_collision_vector3(self.get_collision_prefix(), Collisions.CONTACT_NORMAL_IN_B)
 
     def get_position_on_a_in_a(self):
-        return Point3Input(self.god_map.to_symbol,
-                           prefix=identifier.closest_point + [u'get_self_collisions',
-                                                              (self.link_a, self.link_b),
-                                                              self.idx,
-                                                              u'get_position_on_a_in_a',
-                                                              tuple()]).get_expression()
+        return self.get_input_collision_point3(self.get_collision_prefix(), Collisions.POSITION_ON_A_IN_A)
 
     def get_b_T_pb(self):
-        return TranslationInput(self.god_map.to_symbol,
-                                prefix=identifier.closest_point + [u'get_self_collisions',
-                                                                   (self.link_a, self.link_b),
-                                                                   self.idx,
-                                                                   u'get_position_on_b_in_b',
-                                                                   tuple()]).get_frame()
+        b_P_pb = Point3Input(self.god_map.to_symbol,
+                             prefix=self.get_collision_prefix(),
+                             x=(Collisions.POSITION_ON_B_IN_B,),
+                             y=(Collisions.POSITION_ON_B_IN_B + 1,),
+                             z=(Collisions.POSITION_ON_B_IN_B + 2,))
+        return w.translation3(b_P_pb.x, b_P_pb.y, b_P_pb.z)
 
     def get_actual_distance(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_self_collisions',
-                                                                  (self.link_a, self.link_b),
-                                                                  self.idx,
-                                                                  u'get_contact_distance',
-                                                                  tuple()])
+        return self.god_map.to_symbol(self.get_collision_prefix() + [Collisions.CONTACT_DISTANCE])
 
     def get_number_of_self_collisions(self):
-        return self.god_map.to_symbol(identifier.closest_point + [u'get_number_of_self_collisions',
+        return self.god_map.to_symbol(identifier.closest_point + [u'number_of_self_collisions',
                                                                   (self.link_a, self.link_b)])
 
+    def get_collision_prefix(self):
+        return identifier.closest_point + [u'self_collisions', (self.link_a, self.link_b), self.idx]
+
     def make_constraints(self):
         repel_velocity = self.get_input_float(self.max_velocity_id)
         hard_threshold = self.get_input_float(self.hard_threshold_id)
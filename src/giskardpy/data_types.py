@@ -1,8 +1,7 @@
 from collections import OrderedDict, defaultdict, namedtuple
 
 import numpy as np
-from sortedcontainers import SortedKeyList
-from giskardpy.tfwrapper import kdl_to_np, np_vector, np_point
+from giskardpy.tfwrapper import kdl_to_np
 
 SoftConstraint = namedtuple(u'SoftConstraint', [u'lbA', u'ubA',
                                                 u'weight', u'expression', u'goal_constraint',
@@ -160,9 +159,38 @@ class Collision(object):
                       contact_distance=self.get_contact_distance())
 
 
-class Collisions(object):
+class DefaultValueDict(dict):
+    """
+    Returns default_value for missing keys without adding them.
+    """
+
+    def __init__(self, default_value):
+        super(DefaultValueDict, self).__init__()
+        self.default_value = default_value
+
+    def __missing__(self, key):
+        return self.default_value
 
 
+class Collisions(object):
+    """
+    Stores the contacts of one collision check in one float array with one row per contact, see the column constants.
+    After finalize, the closest collision_list_size contacts of each key are available as arrays, such that the
+    symbols of the collision avoidance constraints resolve to plain array indexing.
+    """
+    POSITION_ON_A_IN_MAP = 0
+    POSITION_ON_B_IN_MAP = 3
+    CONTACT_NORMAL_IN_MAP = 6
+    CONTACT_DISTANCE = 9
+    POSITION_ON_A_IN_A = 10
+    POSITION_ON_B_IN_ROOT = 13
+    POSITION_ON_B_IN_B = 16
+    CONTACT_NORMAL_IN_ROOT = 19
+    CONTACT_NORMAL_IN_B = 22
+    BODY_B_HASH = 25
+    LINK_B_HASH = 26
+    WIDTH = 27
+
     def __init__(self, robot, collision_list_size):
         """
         :type robot: giskardpy.robot.Robot
@@ -170,165 +198,237 @@ class Collisions(object):
         self.robot = robot
         self.root_T_map = kdl_to_np(self.robot.root_T_map)
         self.robot_root = self.robot.get_root()
+        self.robot_name = self.robot.get_name()
         self.collision_list_size = collision_list_size
 
-        # @profile
-        def sort(x):
-            return x.get_contact_distance()
-
-
-
-        # @profile
-        def default_f():
-            return SortedKeyList([self._default_collision('', '', '')] * collision_list_size,
-                                 key=sort)
-
-        self.default_result = default_f()
-
-        self.self_collisions = defaultdict(default_f)
-        self.external_collision = defaultdict(default_f)
-        self.external_collision_long_key = defaultdict(lambda : self._default_collision('', '', ''))
-        self.all_collisions = set()
+        self.default_row = np.zeros(self.WIDTH)
+        self.default_row[self.CONTACT_NORMAL_IN_MAP + 2] = 1
+        self.default_row[self.CONTACT_NORMAL_IN_ROOT + 2] = 1
+        self.default_row[self.CONTACT_NORMAL_IN_B + 2] = 1
+        self.default_row[self.CONTACT_DISTANCE] = 100
+        self.default_row[self.BODY_B_HASH] = u''.__hash__()
+        self.default_row[self.LINK_B_HASH] = u''.__hash__()
+        self.default_result = np.tile(self.default_row, (collision_list_size, 1))
+
+        self._rows = np.empty((64, self.WIDTH))
+        self._number_of_rows = 0
+        self._names = []  # (link_a, body_b, link_b, original_link_a, original_link_b) for each row
+
+        # key -> (collision_list_size, WIDTH) array sorted by contact distance, filled up with default_row
+        self.self_collisions = DefaultValueDict(self.default_result)
+        self.external_collisions = DefaultValueDict(self.default_result)
+        # (original link a, body b, original link b) -> row of the closest contact
+        self.external_collision_long_key = DefaultValueDict(self.default_row)
         self.number_of_self_collisions = defaultdict(int)
         self.number_of_external_collisions = defaultdict(int)
 
-
-    # @profile
     def add(self, collision):
         """
         :type collision: Collision
-        :return:
         """
-        collision = self.transform_closest_point(collision)
-        self.all_collisions.add(collision)
-
-        if collision.get_body_b() == self.robot.get_name():
-            key = collision.get_link_a(), collision.get_link_b()
-            self.self_collisions[key].add(collision)
-            self.number_of_self_collisions[key] = min(self.collision_list_size,
-                                                      self.number_of_self_collisions[key] + 1)
-        else:
-            key = collision.get_link_a()
-            self.external_collision[key].add(collision)
-            self.number_of_external_collisions[key] = min(self.collision_list_size,
-                                                          self.number_of_external_collisions[key] + 1)
-            key_long = (collision.get_original_link_a(),collision.get_body_b(), collision.get_original_link_b())
-            if key_long not in self.external_collision_long_key:
-                self.external_collision_long_key[key_long] = collision
-            else:
-                self.external_collision_long_key[key_long] = min(collision, self.external_collision_long_key[key_long],
-                                                            key=lambda x: x.get_contact_distance())
+        self.add_contact(collision.get_original_link_a(), collision.get_body_b(), collision.get_original_link_b(),
+                         collision.get_position_on_a_in_map(), collision.get_position_on_b_in_map(),
+                         collision.get_contact_normal_in_map(), collision.get_contact_distance())
 
-
-
-    def transform_closest_point(self, collision):
+    def add_contact(self, link_a, body_b, link_b, position_on_a, position_on_b, contact_normal, contact_distance):
         """
-        :type collision: Collision
-        :rtype: Collision
+        Adds a contact in map frame, call finalize once all contacts are added.
+        """
+        if self._number_of_rows == self._rows.shape[0]:
+            self._rows = np.concatenate((self._rows, np.empty(self._rows.shape)))
+        row = self._rows[self._number_of_rows]
+        row[self.POSITION_ON_A_IN_MAP:self.POSITION_ON_A_IN_MAP + 3] = position_on_a
+        row[self.POSITION_ON_B_IN_MAP:self.POSITION_ON_B_IN_MAP + 3] = position_on_b
+        row[self.CONTACT_NORMAL_IN_MAP:self.CONTACT_NORMAL_IN_MAP + 3] = contact_normal
+        row[self.CONTACT_DISTANCE] = contact_distance
+        self._names.append((link_a, body_b, link_b, link_a, link_b))
+        self._number_of_rows += 1
+
+    def finalize(self):
         """
-        if collision.get_body_b() == self.robot.get_name():
-            return self.transform_self_collision(collision)
-        else:
-            return self.transform_external_collision(collision)
+        Transforms all contacts into the frames used by the collision avoidance constraints and sorts them by key and
+        contact distance.
+        """
+        rows = self._rows[:self._number_of_rows]
+        if len(rows) == 0:
+            return
+        keys, a_links, b_links, flip = self.reduce_links()
+        self.transform_contacts(rows, a_links, b_links, flip)
+
+        key_to_slot = {}
+        slots = np.array([key_to_slot.setdefault(key, len(key_to_slot)) for key in keys], dtype=int)
+        # sort by slot first and contact distance second, the rank of a contact is its position within its slot
+        order = np.lexsort((rows[:, self.CONTACT_DISTANCE], slots))
+        sorted_slots = slots[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_slots, sorted_slots)
+        keep = rank < self.collision_list_size
+        results = np.tile(self.default_result, (len(key_to_slot), 1, 1))
+        results[sorted_slots[keep], rank[keep]] = rows[order[keep]]
+        counts = np.minimum(np.bincount(slots), self.collision_list_size)
+        for key, slot in key_to_slot.items():
+            if isinstance(key, tuple):
+                self.self_collisions[key] = results[slot]
+                self.number_of_self_collisions[key] = counts[slot]
+            else:
+                self.external_collisions[key] = results[slot]
+                self.number_of_external_collisions[key] = counts[slot]
 
+        for i in order:
+            link_a, body_b, link_b, original_link_a, original_link_b = self._names[i]
+            if body_b != self.robot_name:
+                long_key = (original_link_a, body_b, original_link_b)
+                if long_key not in self.external_collision_long_key:
+                    self.external_collision_long_key[long_key] = rows[i]
 
-    def transform_self_collision(self, collision):
+    def reduce_links(self):
         """
-        :type collision: Collision
-        :rtype: Collision
+        Replaces the links of each contact with the links of the controlled joints that can move them and decides
+        which self collisions have to be reversed, such that link_a < link_b.
+        Lookups are done once per link or link pair and not once per contact.
+        :return: key of each contact, the link in whose frame position_on_a is needed,
+                    the link in whose frame position_on_b and the contact normal are needed,
+                    mask of the contacts that have to be reversed
+        :rtype: tuple
         """
-        link_a = collision.get_original_link_a()
-        link_b = collision.get_original_link_b()
-        new_link_a, new_link_b = self.robot.get_chain_reduced_to_controlled_joints(link_a, link_b)
-        if new_link_a > new_link_b:
-            collision = collision.reverse()
-            new_link_a, new_link_b = new_link_b, new_link_a
-
-        new_b_T_r = self.robot.get_fk_np(new_link_b, self.robot_root)
-        new_a_T_r = self.robot.get_fk_np(new_link_a, self.robot_root)
-        collision.set_link_a(new_link_a)
-        collision.set_link_b(new_link_b)
-
-        new_b_T_map = np.dot(new_b_T_r, self.root_T_map)
-
-        new_a_P_pa = np.dot(np.dot(new_a_T_r, self.root_T_map), np_point(*collision.get_position_on_a_in_map()))
-        new_b_P_pb = np.dot(new_b_T_map, np_point(*collision.get_position_on_b_in_map()))
-        # r_P_pb = np.dot(self.root_T_map, np_point(*closest_point.position_on_b))
-        new_b_V_n = np.dot(new_b_T_map, np_vector(*collision.get_contact_normal_in_map()))
-        collision.set_position_on_a_in_a(new_a_P_pa[:-1])
-        collision.set_position_on_b_in_b(new_b_P_pb[:-1])
-        collision.set_contact_normal_in_b(new_b_V_n[:-1])
-        return collision
-
-
-    def transform_external_collision(self, collision):
+        reduced_self_collisions = {}
+        controlled_links = {}
+        keys = []
+        a_links = []
+        b_links = []
+        flip = np.zeros(self._number_of_rows, dtype=bool)
+        for i, (link_a, body_b, link_b, original_link_a, original_link_b) in enumerate(self._names):
+            if body_b == self.robot_name:
+                if (link_a, link_b) not in reduced_self_collisions:
+                    reduced_self_collisions[link_a, link_b] = \
+                        self.robot.get_chain_reduced_to_controlled_joints(link_a, link_b)
+                new_link_a, new_link_b = reduced_self_collisions[link_a, link_b]
+                if new_link_a > new_link_b:
+                    new_link_a, new_link_b = new_link_b, new_link_a
+                    original_link_a, original_link_b = original_link_b, original_link_a
+                    flip[i] = True
+                keys.append((new_link_a, new_link_b))
+                b_links.append(new_link_b)
+            else:
+                if link_a not in controlled_links:
+                    movable_joint = self.robot.get_controlled_parent_joint(link_a)
+                    controlled_links[link_a] = self.robot.get_child_link_of_joint(movable_joint)
+                new_link_a = controlled_links[link_a]
+                new_link_b = link_b
+                keys.append(new_link_a)
+                b_links.append(self.robot_root)
+            a_links.append(new_link_a)
+            self._names[i] = (new_link_a, body_b, new_link_b, original_link_a, original_link_b)
+        return keys, a_links, b_links, flip
+
+    def transform_contacts(self, rows, a_links, b_links, flip):
         """
-        :type collision: Collision
-        :rtype: Collision
+        Fills the columns in link frames of all contacts. The fk of each link is computed once and applied to all
+        contacts with one einsum.
+        :param rows: contacts in map frame
+        :type rows: np.ndarray
+        :param a_links: link in whose frame position_on_a is needed for each contact
+        :type a_links: list
+        :param b_links: link in whose frame position_on_b and the contact normal are needed for each contact,
+                        robot root for external collisions
+        :type b_links: list
+        :param flip: mask of the contacts that have to be reversed
+        :type flip: np.ndarray
         """
-        movable_joint = self.robot.get_controlled_parent_joint(collision.get_original_link_a())
-        new_a = self.robot.get_child_link_of_joint(movable_joint)
-        new_a_T_r = self.robot.get_fk_np(new_a, self.robot_root)
-        collision.set_link_a(new_a)
+        if flip.any():
+            position_on_a = rows[flip, self.POSITION_ON_A_IN_MAP:self.POSITION_ON_A_IN_MAP + 3]
+            rows[flip, self.POSITION_ON_A_IN_MAP:self.POSITION_ON_A_IN_MAP + 3] = \
+                rows[flip, self.POSITION_ON_B_IN_MAP:self.POSITION_ON_B_IN_MAP + 3]
+            rows[flip, self.POSITION_ON_B_IN_MAP:self.POSITION_ON_B_IN_MAP + 3] = position_on_a
+            rows[flip, self.CONTACT_NORMAL_IN_MAP:self.CONTACT_NORMAL_IN_MAP + 3] *= -1
+
+        link_to_index = {}
+        a_indices = np.array([link_to_index.setdefault(link, len(link_to_index)) for link in a_links], dtype=int)
+        b_indices = np.array([link_to_index.setdefault(link, len(link_to_index)) for link in b_links], dtype=int)
+        link_T_map = np.empty((len(link_to_index), 4, 4))
+        for link, index in link_to_index.items():
+            link_T_map[index] = np.dot(self.robot.get_fk_np(link, self.robot_root), self.root_T_map)
+
+        number_of_rows = len(rows)
+        points_a = np.ones((number_of_rows, 4))
+        points_a[:, :3] = rows[:, self.POSITION_ON_A_IN_MAP:self.POSITION_ON_A_IN_MAP + 3]
+        points_b = np.ones((number_of_rows, 4))
+        points_b[:, :3] = rows[:, self.POSITION_ON_B_IN_MAP:self.POSITION_ON_B_IN_MAP + 3]
+        normals = np.zeros((number_of_rows, 4))
+        normals[:, :3] = rows[:, self.CONTACT_NORMAL_IN_MAP:self.CONTACT_NORMAL_IN_MAP + 3]
+        a_T_map = link_T_map[a_indices]
+        b_T_map = link_T_map[b_indices]
+        points_a = np.einsum(u'nij,nj->ni', a_T_map, points_a)
+        points_b = np.einsum(u'nij,nj->ni', b_T_map, points_b)
+        normals = np.einsum(u'nij,nj->ni', b_T_map, normals)
+
+        rows[:, self.POSITION_ON_A_IN_A:self.POSITION_ON_A_IN_A + 3] = points_a[:, :3]
+        is_self_collision = np.array([names[1] == self.robot_name for names in self._names], dtype=bool)
+        is_external_collision = ~is_self_collision
+        rows[is_self_collision, self.POSITION_ON_B_IN_B:self.POSITION_ON_B_IN_B + 3] = \
+            points_b[is_self_collision, :3]
+        rows[is_self_collision, self.CONTACT_NORMAL_IN_B:self.CONTACT_NORMAL_IN_B + 3] = \
+            normals[is_self_collision, :3]
+        rows[is_external_collision, self.POSITION_ON_B_IN_ROOT:self.POSITION_ON_B_IN_ROOT + 3] = \
+            points_b[is_external_collision, :3]
+        rows[is_external_collision, self.CONTACT_NORMAL_IN_ROOT:self.CONTACT_NORMAL_IN_ROOT + 3] = \
+            normals[is_external_collision, :3]
+        rows[:, self.BODY_B_HASH] = [names[1].__hash__() for names in self._names]
+        rows[:, self.LINK_B_HASH] = [names[2].__hash__() for names in self._names]
 
-        new_a_P_pa = np.dot(np.dot(new_a_T_r, self.root_T_map), np_point(*collision.get_position_on_a_in_map()))
-        r_P_pb = np.dot(self.root_T_map, np_point(*collision.get_position_on_b_in_map()))
-        r_V_n = np.dot(self.root_T_map, np_vector(*collision.get_contact_normal_in_map()))
-        collision.set_position_on_a_in_a(new_a_P_pa[:-1])
-        collision.set_position_on_b_in_root(r_P_pb[:-1])
-        collision.set_contact_normal_in_root(r_V_n[:-1])
-        return collision
-
-
-    def _default_collision(self, link_a, body_b, link_b):
-        return Collision(link_a, body_b, link_b, [0, 0, 0], [0, 0, 0], [0, 0, 1], 100)
-
-    # @profile
     def get_external_collisions(self, joint_name):
         """
-        Collisions are saved as a list for each movable robot joint, sorted by contact distance
+        Collisions are saved as an array for each movable robot joint, sorted by contact distance
         :type joint_name: str
-        :rtype: SortedKeyList
+        :return: array with collision_list_size rows, see the column constants
+        :rtype: np.ndarray
         """
-        if joint_name in self.external_collision:
-            return self.external_collision[joint_name]
-        return self.default_result
+        return self.external_collisions[joint_name]
 
     def get_external_collisions_long_key(self, link_a, body_b, link_b):
         """
-        Collisions are saved as a list for each movable robot joint, sorted by contact distance
-        :type joint_name: str
-        :rtype: SortedKeyList
+        :return: the row of the closest contact between link_a and link_b of body_b
+        :rtype: np.ndarray
         """
         return self.external_collision_long_key[link_a, body_b, link_b]
 
-
     def get_number_of_external_collisions(self, joint_name):
         return self.number_of_external_collisions[joint_name]
 
-
-    # @profile
     def get_self_collisions(self, link_a, link_b):
         """
         Make sure that link_a < link_b, the reverse collision is not saved.
         :type link_a: str
         :type link_b: str
-        :return:
-        :rtype: SortedKeyList
+        :return: array with collision_list_size rows, see the column constants
+        :rtype: np.ndarray
         """
         # FIXME maybe check for reverse key?
-        if (link_a, link_b) in self.self_collisions:
-            return self.self_collisions[link_a, link_b]
-        return self.default_result
-
+        return self.self_collisions[link_a, link_b]
 
     def get_number_of_self_collisions(self, link_a, link_b):
         return self.number_of_self_collisions[link_a, link_b]
 
-
     def __contains__(self, item):
-        return item in self.self_collisions or item in self.external_collision
+        return item in self.self_collisions or item in self.external_collisions
 
+    @property
+    def all_collisions(self):
+        """
+        :return: all contacts as Collision objects in map frame, e.g. for visualization
+        :rtype: list
+        """
+        collisions = []
+        for names, row in zip(self._names, self._rows[:self._number_of_rows]):
+            link_a, body_b, link_b, original_link_a, original_link_b = names
+            collision = Collision(original_link_a, body_b, original_link_b,
+                                  row[self.POSITION_ON_A_IN_MAP:self.POSITION_ON_A_IN_MAP + 3],
+                                  row[self.POSITION_ON_B_IN_MAP:self.POSITION_ON_B_IN_MAP + 3],
+                                  row[self.CONTACT_NORMAL_IN_MAP:self.CONTACT_NORMAL_IN_MAP + 3],
+                                  row[self.CONTACT_DISTANCE])
+            collision.set_link_a(link_a)
+            collision.set_link_b(link_b)
+            collisions.append(collision)
+        return collisions
 
     def items(self):
         return self.all_collisions
@@ -11,6 +11,7 @@ from py_trees.meta import failure_is_success, success_is_failure, running_is_suc
 from py_trees_ros.trees import BehaviourTree
 from rospy import ROSException
 
+import giskardpy
 import giskardpy.identifier as identifier
 import giskardpy.pybullet_wrapper as pbw
 from giskardpy import logging
@@ -39,6 +40,7 @@ from giskardpy.plugin_set_cmd import SetCmd
 from giskardpy.plugin_time import TimePlugin
 from giskardpy.plugin_update_constraints import GoalToConstraints
 from giskardpy.plugin_visualization import VisualizationBehavior
+from giskardpy.numpy_world import NumpyWorld
 from giskardpy.pybullet_world import PyBulletWorld
 from giskardpy.tree_manager import TreeManager
 from giskardpy.utils import create_path, render_dot_tree, KeyDefaultDict
@@ -49,19 +51,7 @@ def initialize_god_map():
     god_map = GodMap()
     blackboard = Blackboard
     blackboard.god_map = god_map
-    god_map.set_data(identifier.rosparam, rospy.get_param(rospy.get_name()))
-    god_map.set_data(identifier.robot_description, rospy.get_param(u'robot_description'))
-    path_to_data_folder = god_map.get_data(identifier.data_folder)
-    # fix path to data folder
-    if not path_to_data_folder.endswith(u'/'):
-        path_to_data_folder += u'/'
-    god_map.set_data(identifier.data_folder, path_to_data_folder)
-
-    # fix nWSR
-    nWSR = god_map.get_data(identifier.nWSR)
-    if nWSR == u'None':
-        nWSR = None
-    god_map.set_data(identifier.nWSR, nWSR)
+    load_params(god_map, rospy.get_param(rospy.get_name()), rospy.get_param(u'robot_description'))
 
     pbw.start_pybullet(god_map.get_data(identifier.gui))
     while not rospy.is_shutdown():
@@ -76,6 +66,45 @@ def initialize_god_map():
             break
         rospy.sleep(0.5)
 
+    initialize_world(god_map, controlled_joints)
+    return god_map
+
+
+def load_params(god_map, params, robot_description):
+    """
+    Saves the parameters of the giskard node and the robot description on the god map.
+    :type god_map: GodMap
+    :param params: content of one of the yamls in config
+    :type params: dict
+    :type robot_description: str
+    """
+    god_map.set_data(identifier.rosparam, params)
+    god_map.set_data(identifier.robot_description, robot_description)
+    path_to_data_folder = god_map.get_data(identifier.data_folder)
+    # fix path to data folder
+    if not path_to_data_folder.endswith(u'/'):
+        path_to_data_folder += u'/'
+    god_map.set_data(identifier.data_folder, path_to_data_folder)
+
+    # fix nWSR
+    nWSR = god_map.get_data(identifier.nWSR)
+    if nWSR == u'None':
+        nWSR = None
+    god_map.set_data(identifier.nWSR, nWSR)
+
+    # fix compiler
+    compiler = god_map.get_data(identifier.function_cache_compiler)
+    if compiler == u'None':
+        compiler = None
+    god_map.set_data(identifier.function_cache_compiler, compiler)
+
+
+def initialize_world(god_map, controlled_joints):
+    """
+    Creates the world and the robot from the parameters on the god map, pybullet has to be running already.
+    :type god_map: GodMap
+    :type controlled_joints: list
+    """
     joint_weight_symbols = process_joint_specific_params(identifier.joint_weight,
                                                          identifier.joint_weight_default,
                                                          identifier.joint_weight_override,
@@ -111,7 +140,10 @@ def initialize_god_map():
         identifier.joint_acceleration_angular_limit_override,
         god_map)
 
-    world = PyBulletWorld(False, blackboard.god_map.get_data(identifier.data_folder))
+    if giskardpy.WORLD_IMPLEMENTATION == u'numpy':
+        world = NumpyWorld(god_map.get_data(identifier.data_folder))
+    else:
+        world = PyBulletWorld(False, god_map.get_data(identifier.data_folder))
     god_map.set_data(identifier.world, world)
     robot = WorldObject(god_map.get_data(identifier.robot_description),
                         None,
@@ -119,11 +151,24 @@ def initialize_god_map():
     world.add_robot(robot, None, controlled_joints,
                     ignored_pairs=god_map.get_data(identifier.ignored_self_collisions),
                     added_pairs=god_map.get_data(identifier.added_self_collisions))
+    # also used for the spheres of the capsules, that cover meshes in the numpy world and signed distance fields
+    world.robot.set_collision_geometry(god_map.get_data(identifier.collision_geometry_fidelity),
+                                       u'{}collision_geometry/'.format(god_map.get_data(identifier.data_folder)),
+                                       god_map.get_data(identifier.collision_geometry_number_of_spheres))
+    if hasattr(world.robot, u'set_number_of_self_collision_workers') and not god_map.get_data(identifier.gui):
+        world.robot.set_number_of_self_collision_workers(god_map.get_data(identifier.self_collision_matrix_workers))
+    if god_map.get_data(identifier.signed_distance_field_enabled):
+        world.enable_signed_distance_fields(god_map.get_data(identifier.signed_distance_field_resolution),
+                                            god_map.get_data(identifier.signed_distance_field_padding),
+                                            u'{}signed_distance_fields/'.format(god_map.get_data(identifier.data_folder)))
+    if god_map.get_data(identifier.function_cache_compiler) is not None:
+        world.robot.set_compiler(god_map.get_data(identifier.function_cache_compiler),
+                                 u'{}{}/'.format(god_map.get_data(identifier.data_folder), world.robot.get_name()))
 
-    joint_position_symbols = JointStatesInput(blackboard.god_map.to_symbol, world.robot.get_movable_joints(),
+    joint_position_symbols = JointStatesInput(god_map.to_symbol, world.robot.get_movable_joints(),
                                               identifier.joint_states,
                                               suffix=[u'position'])
-    joint_vel_symbols = JointStatesInput(blackboard.god_map.to_symbol, world.robot.get_movable_joints(),
+    joint_vel_symbols = JointStatesInput(god_map.to_symbol, world.robot.get_movable_joints(),
                                          identifier.joint_states,
                                          suffix=[u'velocity'])
     world.robot.update_joint_symbols(joint_position_symbols.joint_map, joint_vel_symbols.joint_map,
@@ -131,7 +176,6 @@ def initialize_god_map():
                                      joint_velocity_linear_limit_symbols, joint_velocity_angular_limit_symbols,
                                      joint_acceleration_linear_limit_symbols, joint_acceleration_angular_limit_symbols)
     world.robot.init_self_collision_matrix()
-    return god_map
 
 
 def process_joint_specific_params(identifier_, default, override, god_map):
@@ -1,7 +1,10 @@
 import copy
+from collections import OrderedDict
 from copy import copy
 from multiprocessing import Lock
 
+import numpy as np
+
 from giskardpy import cas_wrapper as w
 
 
@@ -180,6 +183,97 @@ def get_data(identifier, data, default_value=0.0):
     return result, shortcut
 
 
+class InputLayoutNode(object):
+    """
+    One member of the identifiers in an InputLayout. Identifiers with the same prefix share nodes.
+    """
+
+    def __init__(self, member, default_value):
+        self.member = member
+        self.default_value = default_value
+        self.shortcut = None
+        self.children = OrderedDict()
+        self.slots = []
+
+    def get_child(self, member):
+        if member not in self.children:
+            self.children[member] = InputLayoutNode(member, self.default_value)
+        return self.children[member]
+
+    def get(self, data):
+        if self.shortcut is None:
+            shortcut = GetMemberLeaf(self.default_value)
+            try:
+                result = shortcut.init_call(self.member, data)
+            except (AttributeError, KeyError, IndexError):
+                # same as get_data, try again next time
+                return self.default_value
+            self.shortcut = shortcut
+            return result
+        return self.shortcut.c(data)
+
+    def update(self, data, buffer):
+        for child in self.children.values():
+            value = child.get(data)
+            for slot in child.slots:
+                buffer[slot] = value
+            if child.children:
+                child.update(value, buffer)
+
+
+class InputLayout(object):
+    """
+    Gathers the values of a fixed list of symbols into a preallocated float64 array, which can be given to a
+    CompiledFunction without conversion.
+    The identifiers are stored as a tree, such that shared prefixes, e.g. the joint state of the robot or the
+    collisions of one link, are only looked up once per update.
+    """
+
+    def __init__(self, god_map, symbols):
+        """
+        :type god_map: GodMap
+        :param symbols: symbols created with god_map.to_symbol
+        :type symbols: list
+        """
+        self.god_map = god_map
+        self.str_params = [str(x) for x in symbols]
+        self.buffer = np.zeros(len(self.str_params))
+        self.root = InputLayoutNode(None, god_map.default_value)
+        for slot, symbol in enumerate(self.str_params):
+            node = self.root
+            for member in god_map.expr_to_key[symbol]:
+                node = node.get_child(member)
+            node.slots.append(slot)
+
+    def update(self):
+        """
+        :return: the current values of all symbols, the array is reused by the next update
+        :rtype: np.ndarray
+        """
+        with self.god_map:
+            self.root.update(self.god_map._data, self.buffer)
+        return self.buffer
+
+
+class GodMapSnapshot(object):
+    """
+    Read only copy of some entries of a GodMap, see GodMap.publish_snapshot.
+    """
+
+    def __init__(self, data, version, default_value=0.0):
+        self._data = data
+        self.version = version
+        self.default_value = default_value
+
+    def get_data(self, identifier):
+        """
+        Does not block, because snapshots are never changed after they are published.
+        :type identifier: list
+        :return: object that was saved at key, when the snapshot was published
+        """
+        return get_data(identifier, self._data, self.default_value)[0]
+
+
 class GodMap(object):
     """
     Data structure used by plugins to exchange information.
@@ -195,6 +289,7 @@ class GodMap(object):
         self.last_expr_values = {}
         self.shortcuts = {}
         self.lock = Lock()
+        self._snapshot = GodMapSnapshot({}, 0, default_value)
 
     def __copy__(self):
         god_map_copy = GodMap(self.default_value)
@@ -271,6 +366,42 @@ class GodMap(object):
             # return {expr: self.get_data(self.expr_to_key[expr]) for expr in exprs}
             return [self.unsafe_get_data(self.expr_to_key[expr]) for expr in symbols]
 
+    def publish_snapshot(self, identifiers):
+        """
+        Copies the entries at identifiers into a new GodMapSnapshot, which replaces the previous one.
+        Values are copied shallowly, they should be replaced instead of modified in place by their writers, e.g. like the
+        joint state of the robot.
+        :type identifiers: list
+        """
+        data = {}
+        with self.lock:
+            for identifier in identifiers:
+                value = copy(self.unsafe_get_data(identifier))
+                sub_data = data
+                for member in identifier[:-1]:
+                    sub_data = sub_data.setdefault(member, {})
+                sub_data[identifier[-1]] = value
+            version = self._snapshot.version + 1
+        # swapping the reference is atomic, readers either get the old or the new snapshot
+        self._snapshot = GodMapSnapshot(data, version, self.default_value)
+
+    def get_snapshot(self):
+        """
+        Lock free alternative to get_data for threads that don't need the latest data, e.g. visualization or services,
+        such that they don't slow down the planning loop.
+        :return: the snapshot that was published last
+        :rtype: GodMapSnapshot
+        """
+        return self._snapshot
+
+    def get_input_layout(self, symbols):
+        """
+        Faster alternative to get_values, if the same symbols are needed repeatedly.
+        :type symbols: list
+        :rtype: InputLayout
+        """
+        return InputLayout(self, symbols)
+
     def get_registered_symbols(self):
         """
         :rtype: list
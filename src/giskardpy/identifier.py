@@ -37,6 +37,9 @@ b_keys = qp_data + [u'b_keys']
 bA_keys = qp_data + [u'bA_keys']
 xdot_keys = qp_data + [u'xdot_keys']
 
+# entries that PluginBehavior copies into the god map snapshot after each tick, see GodMap.publish_snapshot
+snapshot = [joint_states, time, cmd, closest_point, next_move_goal]
+
 post_processing = [u'post_processing']
 soft_constraints = post_processing + [u'soft_constraints']
 result_message = [u'result_message']
@@ -83,6 +86,17 @@ joint_weight_override = joint_weight + [u'override']
 # qp solver
 qp_solver = rosparam + [u'qp_solver']
 nWSR = qp_solver + [u'nWSR']
+qp_solver_sparse = qp_solver + [u'sparse']
+qp_solver_backend = qp_solver + [u'backend']
+qp_solver_large_problem_backend = qp_solver + [u'large_problem_backend']
+qp_solver_large_problem_threshold = qp_solver + [u'large_problem_threshold']
+
+# function cache
+function_cache = rosparam + [u'function_cache']
+function_cache_enabled = function_cache + [u'enabled']
+function_cache_max_size = function_cache + [u'max_size']
+function_cache_max_age = function_cache + [u'max_age']
+function_cache_compiler = function_cache + [u'compiler']
 
 # plugins
 plugins = rosparam + [u'plugins']
@@ -119,6 +133,13 @@ tree_manager = behavior_tree + [u'tree_manager']
 collision_avoidance = rosparam + [u'collision_avoidance']
 maximum_collision_threshold = collision_avoidance + [u'maximum_collision_threshold']
 added_collision_checks = collision_avoidance + [u'added_collision_checks']
+number_of_collision_workers = collision_avoidance + [u'number_of_workers']
+collision_temporal_coherence = collision_avoidance + [u'temporal_coherence']
+collision_geometry_fidelity = collision_avoidance + [u'collision_geometry', u'fidelity']
+collision_geometry_number_of_spheres = collision_avoidance + [u'collision_geometry', u'number_of_spheres']
+signed_distance_field_enabled = collision_avoidance + [u'signed_distance_field', u'enabled']
+signed_distance_field_resolution = collision_avoidance + [u'signed_distance_field', u'resolution']
+signed_distance_field_padding = collision_avoidance + [u'signed_distance_field', u'padding']
 
 self_collision_avoidance = collision_avoidance + [u'self_collision_avoidance']
 self_collision_avoidance_distance = self_collision_avoidance + [u'distance_thresholds']
@@ -127,6 +148,7 @@ self_collision_avoidance_default_override = self_collision_avoidance_distance +
 ignored_self_collisions = self_collision_avoidance + [u'ignore']
 added_self_collisions = self_collision_avoidance + [u'add']
 self_collision_avoidance_repeller = self_collision_avoidance + [u'number_of_repeller']
+self_collision_matrix_workers = self_collision_avoidance + [u'number_of_workers_for_matrix']
 
 external_collision_avoidance = collision_avoidance + [u'external_collision_avoidance']
 external_collision_avoidance_distance = external_collision_avoidance + [u'distance_thresholds']
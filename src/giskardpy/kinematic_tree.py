@@ -0,0 +1,162 @@
+import numpy as np
+
+
+class KinematicTreeIndex(object):
+    """
+    Integer representation of a kinematic tree for fast chain queries.
+    Links are numbered in breadth first order starting with the root, so parents always have a smaller index than their
+    children. The lowest common ancestor of two links is found with a range minimum query over the depths of an euler
+    tour of the tree, which is answered in O(1) by a sparse table.
+    """
+
+    def __init__(self, root, child_map, fixed_joints):
+        """
+        :param root: name of the root link
+        :type root: str
+        :param child_map: link name -> list of (joint name, child link name), like urdf_parser_py's child_map
+        :type child_map: dict
+        :param fixed_joints: names of all fixed joints
+        :type fixed_joints: set
+        """
+        self.link_names = [root]
+        self.parent_joint_names = [None]
+        parents = [-1]
+        depths = [0]
+        children = []
+        i = 0
+        while i < len(self.link_names):
+            children.append([])
+            for joint_name, child_link in child_map.get(self.link_names[i], []):
+                children[i].append(len(self.link_names))
+                self.link_names.append(child_link)
+                self.parent_joint_names.append(joint_name)
+                parents.append(i)
+                depths.append(depths[i] + 1)
+            i += 1
+        self.link_to_index = {link_name: i for i, link_name in enumerate(self.link_names)}
+        self.joint_to_index = {joint_name: i for i, joint_name in enumerate(self.parent_joint_names)
+                               if joint_name is not None}
+        self.parents = np.array(parents)
+        self.depths = np.array(depths)
+        self.fixed = np.array([joint_name in fixed_joints for joint_name in self.parent_joint_names])
+        self._init_euler_tour(children)
+
+    def _init_euler_tour(self, children):
+        tour = []
+        self._first_visit = np.empty(len(self.link_names), dtype=int)
+        stack = [(0, 0)]  # (link, index of the next child to visit)
+        while stack:
+            link, next_child = stack[-1]
+            if next_child == 0:
+                self._first_visit[link] = len(tour)
+            tour.append(link)
+            if next_child < len(children[link]):
+                stack[-1] = (link, next_child + 1)
+                stack.append((children[link][next_child], 0))
+            else:
+                stack.pop()
+        self._tour = np.array(tour)
+        tour_depths = self.depths[self._tour]
+        # self._sparse_table[k][i] is the position of the shallowest link in tour[i:i + 2**k]
+        self._sparse_table = [np.arange(len(tour))]
+        k = 1
+        while 1 << k <= len(tour):
+            previous = self._sparse_table[-1]
+            left = previous[:len(tour) - (1 << k) + 1]
+            right = previous[1 << (k - 1):len(tour) - (1 << (k - 1)) + 1]
+            self._sparse_table.append(np.where(tour_depths[left] <= tour_depths[right], left, right))
+            k += 1
+
+    def get_lca_index(self, link_a, link_b):
+        """
+        :type link_a: int
+        :type link_b: int
+        :return: index of the lowest common ancestor of link_a and link_b
+        :rtype: int
+        """
+        first = self._first_visit[link_a]
+        last = self._first_visit[link_b]
+        if first > last:
+            first, last = last, first
+        k = int(last - first + 1).bit_length() - 1
+        left = self._sparse_table[k][first]
+        right = self._sparse_table[k][last - (1 << k) + 1]
+        if self.depths[self._tour[left]] <= self.depths[self._tour[right]]:
+            return int(self._tour[left])
+        return int(self._tour[right])
+
+    def get_lca(self, link_a, link_b):
+        """
+        :type link_a: str
+        :type link_b: str
+        :return: name of the lowest common ancestor of link_a and link_b
+        :rtype: str
+        """
+        return self.link_names[self.get_lca_index(self.link_to_index[link_a], self.link_to_index[link_b])]
+
+    def is_ancestor(self, ancestor, link):
+        """
+        :type ancestor: int
+        :type link: int
+        :return: whether ancestor is link or one of its ancestors
+        :rtype: bool
+        """
+        return self.get_lca_index(ancestor, link) == ancestor
+
+    def are_linked(self, link_a, link_b):
+        """
+        :type link_a: str
+        :type link_b: str
+        :return: whether one link is the parent of the other
+        :rtype: bool
+        """
+        if link_a not in self.link_to_index or link_b not in self.link_to_index:
+            return False
+        link_a = self.link_to_index[link_a]
+        link_b = self.link_to_index[link_b]
+        return self.parents[link_a] == link_b or self.parents[link_b] == link_a
+
+    def get_chain_from_ancestor(self, ancestor, tip, joints=True, links=True, fixed=True):
+        """
+        Same result as urdf_parser_py's Robot.get_chain.
+        :param ancestor: name of a link that is tip or one of its ancestors
+        :type ancestor: str
+        :type tip: str
+        :type joints: bool
+        :type links: bool
+        :param fixed: whether fixed joints are included
+        :type fixed: bool
+        :rtype: list
+        """
+        ancestor_index = self.link_to_index[ancestor]
+        link = self.link_to_index[tip]
+        if not self.is_ancestor(ancestor_index, link):
+            raise KeyError(u'{} is not an ancestor of {}'.format(ancestor, tip))
+        chain = []
+        if links:
+            chain.append(tip)
+        while link != ancestor_index:
+            if joints and (fixed or not self.fixed[link]):
+                chain.append(self.parent_joint_names[link])
+            link = self.parents[link]
+            if links:
+                chain.append(self.link_names[link])
+        chain.reverse()
+        return chain
+
+    def get_nearest_ancestors(self, joint_names):
+        """
+        :param joint_names: joints of interest
+        :type joint_names: set
+        :return: for each link the index of the closest link, that is the link itself or one of its ancestors, whose
+                    parent joint is in joint_names, -1 if there is none
+        :rtype: np.ndarray
+        """
+        nearest = np.full(len(self.link_names), -1, dtype=int)
+        for link, joint_name in enumerate(self.parent_joint_names):
+            if joint_name in joint_names:
+                nearest[link] = link
+            elif link > 0:
+                # parents come first, so their entry is already set
+                nearest[link] = nearest[self.parents[link]]
+        return nearest
@@ -0,0 +1,97 @@
+import numpy as np
+from giskard_msgs.msg import CollisionEntry
+
+from giskardpy import capsule_collision as cc
+from giskardpy.data_types import Collisions
+from giskardpy.numpy_world_object import NumpyWorldObject
+from giskardpy.world import World
+
+
+class NumpyWorld(World):
+    """
+    World without physics engine, all links are represented as capsules and the distances of all entries of the
+    collision matrix are computed in one batch, see capsule_collision.
+    Requires giskardpy.WORLD_IMPLEMENTATION == u'numpy', such that the robot is a NumpyWorldObject.
+    """
+
+    def add_object(self, object_):
+        """
+        :type object_: giskardpy.world_object.WorldObject
+        """
+        nwo = NumpyWorldObject.from_urdf_object(object_)
+        nwo.base_pose = object_.base_pose
+        nwo.joint_state = object_.joint_state
+        return super(NumpyWorld, self).add_object(nwo)
+
+    def check_collisions(self, cut_off_distances, collision_list_size=15, distance_lower_bounds=None):
+        """
+        :param cut_off_distances: (robot_link, body_b, link_b) -> cut off distance. Contacts between objects not in this
+                                    dict or further away than the cut off distance will be ignored.
+        :type cut_off_distances: dict
+        :param distance_lower_bounds: if not None, a lower bound for the distance of each entry of cut_off_distances
+                                        is written into this dict
+        :type distance_lower_bounds: dict
+        :return: one contact for each link pair that is closer than its cut off distance
+        :rtype: Collisions
+        """
+        collisions = Collisions(self.robot, collision_list_size)
+        cut_off_distances = self.check_signed_distance_field_collisions(collisions, cut_off_distances,
+                                                                        distance_lower_bounds)
+        robot_name = self.robot.get_name()
+        blocks = {}  # (body name, link name) -> (first row, number of rows) in capsules
+        capsules = []
+        number_of_capsules = [0]
+
+        def get_block(body, body_name, link_name):
+            if (body_name, link_name) not in blocks:
+                link_capsules = body.get_capsules_in_map(link_name)
+                blocks[body_name, link_name] = number_of_capsules[0], len(link_capsules)
+                capsules.append(link_capsules)
+                number_of_capsules[0] += len(link_capsules)
+            return blocks[body_name, link_name]
+
+        keys = list(cut_off_distances.keys())
+        groups = []  # (entry index, link b) for each group of capsule pairs
+        index_a = []
+        index_b = []
+        group_index = []
+        for i, (robot_link, body_b, link_b) in enumerate(keys):
+            body = self.robot if body_b == robot_name else self.get_object(body_b)
+            if link_b == CollisionEntry.ALL:
+                link_bs = body.get_link_names_with_collision()
+            else:
+                link_bs = [link_b]
+            start_a, length_a = get_block(self.robot, robot_name, robot_link)
+            for link_b_tmp in link_bs:
+                start_b, length_b = get_block(body, body_b, link_b_tmp)
+                if length_a == 0 or length_b == 0:
+                    continue
+                index_a.append(np.repeat(np.arange(start_a, start_a + length_a), length_b))
+                index_b.append(np.tile(np.arange(start_b, start_b + length_b), length_a))
+                group_index.append(np.full(length_a * length_b, len(groups), dtype=int))
+                groups.append((i, link_b_tmp))
+
+        if distance_lower_bounds is not None:
+            for key in keys:
+                distance_lower_bounds[key] = np.inf
+        if groups:
+            capsules = np.concatenate(capsules)
+            index_a = np.concatenate(index_a)
+            index_b = np.concatenate(index_b)
+            group_index = np.concatenate(group_index)
+            position_on_a, position_on_b, contact_normal, contact_distance = \
+                cc.capsule_distances(capsules[index_a], capsules[index_b])
+            # closest capsule pair of each group
+            order = np.lexsort((contact_distance, group_index))
+            sorted_groups = group_index[order]
+            closest = order[np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1]))]
+            for k in closest:
+                i, link_b = groups[group_index[k]]
+                robot_link, body_b, _ = keys[i]
+                if distance_lower_bounds is not None:
+                    distance_lower_bounds[keys[i]] = min(distance_lower_bounds[keys[i]], contact_distance[k])
+                if contact_distance[k] < cut_off_distances[keys[i]] * 1.1:
+                    collisions.add_contact(robot_link, body_b, link_b, position_on_a[k], position_on_b[k],
+                                           contact_normal[k], contact_distance[k])
+        collisions.finalize()
+        return collisions
@@ -0,0 +1,98 @@
+import numpy as np
+
+from giskardpy import capsule_collision as cc
+from giskardpy.tfwrapper import kdl_to_np
+from giskardpy.world_object import WorldObject
+
+
+class NumpyWorldObject(WorldObject):
+    """
+    Represents the collision geometry of every link as capsules, see capsule_collision, and computes distances between
+    them with numpy, without any physics engine.
+    """
+
+    def __init__(self, urdf, base_pose=None, controlled_joints=None, path_to_data_folder=u'',
+                 calc_self_collision_matrix=False, *args, **kwargs):
+        """
+        :param urdf: Path to URDF file, or content of already loaded URDF file.
+        :type urdf: str
+        :type base_pose: Pose
+        :type calc_self_collision_matrix: bool
+        :param path_to_data_folder: where the self collision matrix is stored
+        :type path_to_data_folder: str
+        """
+        self._map_T_links = None
+        super(NumpyWorldObject, self).__init__(urdf,
+                                               base_pose=base_pose,
+                                               controlled_joints=controlled_joints,
+                                               path_to_data_folder=path_to_data_folder,
+                                               calc_self_collision_matrix=calc_self_collision_matrix,
+                                               *args, **kwargs)
+
+    @WorldObject.joint_state.setter
+    def joint_state(self, value):
+        """
+        :type value: dict
+        """
+        WorldObject.joint_state.fset(self, value)
+        self._map_T_links = None
+
+    @WorldObject.base_pose.setter
+    def base_pose(self, value):
+        """
+        :type value: Pose
+        """
+        WorldObject.base_pose.fset(self, value)
+        self._map_T_links = None
+
+    def reinitialize(self):
+        super(NumpyWorldObject, self).reinitialize()
+        self._map_T_links = None
+
+    def update_after_attach(self, urdf_object, parent_link):
+        super(NumpyWorldObject, self).update_after_attach(urdf_object, parent_link)
+        self._map_T_links = None
+
+    def update_after_detach(self, sub_tree, joint_name):
+        super(NumpyWorldObject, self).update_after_detach(sub_tree, joint_name)
+        self._map_T_links = None
+
+    def get_map_T_links(self):
+        """
+        Computes the poses of all links in one pass over the kinematic tree. The result is cached until the joint state
+        or base pose changes.
+        :return: link name -> map_T_link
+        :rtype: dict
+        """
+        if self._map_T_links is None:
+            map_T_root = np.linalg.inv(kdl_to_np(self.root_T_map))
+            self._map_T_links = {link_name: np.dot(map_T_root, root_T_link)
+                                 for link_name, root_T_link in self.get_root_T_links().items()}
+        return self._map_T_links
+
+    def get_capsules_in_map(self, link_name):
+        """
+        :rtype: np.ndarray
+        """
+        return cc.transform_capsules(self.get_map_T_links()[link_name], self.get_link_capsules(link_name))
+
+    def get_link_aabb(self, link_name):
+        """
+        :return: min corner, max corner in map
+        :rtype: (np.ndarray, np.ndarray)
+        """
+        capsules = self.get_capsules_in_map(link_name)
+        if len(capsules) == 0:
+            position = self.get_map_T_links()[link_name][:3, 3]
+            return position, position
+        return cc.capsules_aabb(capsules)
+
+    def in_collision(self, link_a, link_b, distance):
+        capsules_a = self.get_capsules_in_map(link_a)
+        capsules_b = self.get_capsules_in_map(link_b)
+        if len(capsules_a) == 0 or len(capsules_b) == 0:
+            return False
+        index_a = np.repeat(np.arange(len(capsules_a)), len(capsules_b))
+        index_b = np.tile(np.arange(len(capsules_b)), len(capsules_a))
+        distances = cc.capsule_distances(capsules_a[index_a], capsules_b[index_b])[3]
+        return distances.min() < distance
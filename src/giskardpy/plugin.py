@@ -7,7 +7,7 @@ from threading import Thread
 import rospy
 from py_trees import Behaviour, Blackboard, Status
 
-from giskardpy.identifier import world, robot
+from giskardpy.identifier import world, robot, snapshot
 from giskardpy import logging
 import time
 
@@ -148,9 +148,11 @@ class PluginBehavior(GiskardBehavior):
         self.my_status = new_state
 
     def loop_over_plugins(self):
+        published = True
         try:
             # self.init_plugins()
             while self.is_running() and not rospy.is_shutdown():
+                published = False
                 for plugin_name, plugin in self._plugins.items():
                     with self.status_lock:
                         if not self.is_running():
@@ -163,10 +165,16 @@ class PluginBehavior(GiskardBehavior):
                         if not self.is_running():
                             return
                 self.looped_once = True
+                self.get_god_map().publish_snapshot(snapshot)
+                published = True
         except Exception as e:
             traceback.print_exc()
             # TODO make 'exception' string a parameter somewhere
             Blackboard().set('exception', e)
+        finally:
+            # only if the last loop was interrupted before its snapshot was published
+            if not published:
+                self.get_god_map().publish_snapshot(snapshot)
 
 
 class SuccessPlugin(GiskardBehavior):
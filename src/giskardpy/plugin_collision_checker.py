@@ -3,13 +3,17 @@ from collections import defaultdict
 from copy import deepcopy
 from multiprocessing import Lock
 
+import numpy as np
 import rospy
 from py_trees import Status
 from std_srvs.srv import SetBool, SetBoolResponse, SetBoolRequest
 
+import giskardpy
 import giskardpy.identifier as identifier
-from giskardpy import pybullet_wrapper
+from giskardpy import pybullet_wrapper, logging
 from giskardpy.plugin import GiskardBehavior
+from giskardpy.pybullet_collision_workers import CollisionWorkers
+from giskardpy.tfwrapper import kdl_to_np
 
 
 class CollisionChecker(GiskardBehavior):
@@ -21,11 +25,23 @@ class CollisionChecker(GiskardBehavior):
         self.object_js_subs = {}  # JointState subscribers for articulated world objects
         self.object_joint_states = {}  # JointStates messages for articulated world objects
         self.get_god_map().set_data(identifier.added_collision_checks, {})
+        self.number_of_workers = self.get_god_map().get_data(identifier.number_of_collision_workers)
+        if self.number_of_workers > 0 and self.get_god_map().get_data(identifier.gui):
+            logging.logwarn(u'collision workers don\'t work with the pybullet gui, checking collisions sequentially')
+            self.number_of_workers = 0
+        if self.number_of_workers > 0 and giskardpy.WORLD_IMPLEMENTATION != u'pybullet':
+            logging.logwarn(u'collision workers only work with pybullet, checking collisions sequentially')
+            self.number_of_workers = 0
+        self.collision_workers = None
+        self.temporal_coherence = self.get_god_map().get_data(identifier.collision_temporal_coherence)
+        self.joint_velocity_limits = {}
 
     def setup(self, timeout=10.0):
         super(CollisionChecker, self).setup(timeout)
         # self.pub_collision_marker = rospy.Publisher(u'~visualization_marker_array', MarkerArray, queue_size=1)
         self.srv_activate_rendering = rospy.Service(u'~render', SetBool, self.activate_rendering)
+        if self.number_of_workers > 0 and self.collision_workers is None:
+            self.collision_workers = CollisionWorkers(self.get_world(), self.number_of_workers)
         rospy.sleep(.5)
         return True
 
@@ -81,12 +97,118 @@ class CollisionChecker(GiskardBehavior):
         self.collision_list_size = max(self.collision_list_size,
                                        self.get_god_map().get_data(identifier.self_collision_avoidance_repeller))
 
+        if self.temporal_coherence:
+            self.init_temporal_coherence()
+
         super(CollisionChecker, self).initialise()
 
+    def init_temporal_coherence(self):
+        """
+        Computes how far each pair of the collision matrix can get closer during one sample period.
+        Objects don't move during planning, only the robot does.
+        """
+        link_motion = self.get_link_motion_bounds()
+        robot_name = self.get_robot().get_name()
+        self.pair_motion = {}
+        for robot_link, body_b, link_b in self.collision_matrix:
+            motion = link_motion[robot_link]
+            if body_b == robot_name:
+                motion += link_motion[link_b]
+            self.pair_motion[robot_link, body_b, link_b] = motion
+        self.tick = 0
+        self.next_check = defaultdict(int)  # pair -> tick at which it has to be checked again
+
+    def get_joint_velocity_limit(self, joint_name):
+        """
+        :return: velocity limit of joint_name, mimic joints use the limit of the joint they mimic
+        :rtype: float
+        """
+        robot = self.get_robot()
+        if joint_name not in self.joint_velocity_limits:
+            if robot.is_joint_mimic(joint_name):
+                limit = self.get_joint_velocity_limit(robot.get_mimiced_joint_name(joint_name)) * \
+                        abs(robot.get_mimic_multiplier(joint_name))
+            else:
+                limit = robot.get_joint_velocity_limit_expr_evaluated(joint_name, self.get_god_map())
+            self.joint_velocity_limits[joint_name] = limit
+        return self.joint_velocity_limits[joint_name]
+
+    def get_link_motion_bounds(self):
+        """
+        A rotation by at most a rad moves a point at distance r from the joint axis at most a * r. r is bounded by the
+        lengths of the joint origins between the joint and the link, plus the distance of the link's collision geometry
+        to its origin.
+        :return: robot link -> upper bound for how far any point of the link can move during one sample period
+        :rtype: dict
+        """
+        robot = self.get_robot()
+        sample_period = self.get_god_map().get_data(identifier.sample_period)
+        map_T_root = np.linalg.inv(kdl_to_np(robot.root_T_map))
+        bounds = defaultdict(lambda: np.inf)
+        for link_name in robot.get_link_names_with_collision():
+            aabb_min, aabb_max = robot.get_link_aabb(link_name)
+            corners = np.array(list(itertools.product(*zip(aabb_min, aabb_max))))
+            link_position = np.dot(map_T_root, robot.get_fk_np(robot.get_root(), link_name))[:3, 3]
+            lever = np.max(np.linalg.norm(corners - link_position, axis=1))
+            bound = 0
+            for joint_name in reversed(robot.get_chain(robot.get_root(), link_name, joints=True, links=False)):
+                if robot.is_joint_movable(joint_name) or robot.is_joint_mimic(joint_name):
+                    max_motion = self.get_joint_velocity_limit(joint_name) * sample_period
+                    if robot.is_joint_prismatic(joint_name):
+                        bound += max_motion
+                        lower, upper = robot.get_joint_limits(joint_name)
+                        if lower is None or upper is None:
+                            lever = np.inf
+                        else:
+                            lever += max(abs(lower), abs(upper))
+                    elif max_motion > 0:
+                        bound += max_motion * lever
+                origin = robot.get_urdf_joint(joint_name).origin
+                if origin is not None and origin.xyz is not None:
+                    lever += np.linalg.norm(origin.xyz)
+            bounds[link_name] = bound
+        return bounds
+
+    def get_due_collision_matrix(self):
+        """
+        :return: the entries of the collision matrix that could be within their cut off distance by now
+        :rtype: dict
+        """
+        return {key: distance for key, distance in self.collision_matrix.items() if self.next_check[key] <= self.tick}
+
+    def update_next_checks(self, collision_matrix, distance_lower_bounds):
+        """
+        Pairs that were further away than their cut off distance are skipped, until they could have moved close enough.
+        """
+        for key, distance_lower_bound in distance_lower_bounds.items():
+            motion = self.pair_motion[key]
+            margin = distance_lower_bound - collision_matrix[key] * 1.1
+            if margin <= 0 or motion == np.inf:
+                skip = 1
+            elif motion == 0:
+                skip = np.inf
+            else:
+                skip = max(1, int(margin / motion))
+            self.next_check[key] = self.tick + skip
+        self.tick += 1
+
     def update(self):
         """
         Computes closest point info for all robot links and safes it to the god map.
         """
-        collisions = self.get_world().check_collisions(self.collision_matrix, self.collision_list_size)
+        if self.temporal_coherence:
+            collision_matrix = self.get_due_collision_matrix()
+            distance_lower_bounds = {}
+        else:
+            collision_matrix = self.collision_matrix
+            distance_lower_bounds = None
+        if self.collision_workers is not None:
+            collisions = self.collision_workers.check_collisions(collision_matrix, self.collision_list_size,
+                                                                 distance_lower_bounds)
+        else:
+            collisions = self.get_world().check_collisions(collision_matrix, self.collision_list_size,
+                                                           distance_lower_bounds)
+        if self.temporal_coherence:
+            self.update_next_checks(collision_matrix, distance_lower_bounds)
         self.god_map.set_data(identifier.closest_point, collisions)
         return Status.RUNNING
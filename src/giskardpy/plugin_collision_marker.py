@@ -14,6 +14,7 @@ class CollisionMarker(GiskardBehavior):
         super(CollisionMarker, self).setup(timeout)
         self.pub_collision_marker = rospy.Publisher(u'~visualization_marker_array', MarkerArray, queue_size=1)
         self.name_space = name_space
+        self.map_frame = self.get_god_map().get_data(identifier.map_frame)
         rospy.sleep(.5)
         return True
 
@@ -21,7 +22,8 @@ class CollisionMarker(GiskardBehavior):
         """
         Computes closest point info for all robot links and safes it to the god map.
         """
-        collisions = self.get_god_map().get_data(identifier.closest_point)
+        # the snapshot is used, because this plugin runs in parallel to the planning loop
+        collisions = self.get_god_map().get_snapshot().get_data(identifier.closest_point)
         if collisions:
             self.publish_cpi_markers(collisions)
         return Status.SUCCESS
@@ -34,7 +36,7 @@ class CollisionMarker(GiskardBehavior):
         :type collisions: Collisions
         """
         m = Marker()
-        m.header.frame_id = self.get_god_map().get_data(identifier.map_frame)
+        m.header.frame_id = self.map_frame
         m.action = Marker.ADD
         m.type = Marker.LINE_LIST
         m.id = 1337
@@ -2,6 +2,7 @@ from time import time
 
 import numpy as np
 from py_trees import Status
+from scipy.sparse import issparse
 
 import giskardpy.identifier as identifier
 from giskardpy import logging
@@ -86,6 +87,11 @@ class GoalReachedPlugin(GiskardBehavior):
         p_lbA = pd.DataFrame(np_lbA, lbA).sort_index()
         p_A_dot_x = pd.DataFrame(A_dot_x, lbA).sort_index()
         p_ubA = pd.DataFrame(np_ubA, lbA).sort_index()
+        if np_H.ndim == 1:
+            # sparse qp mode only saves the diagonal
+            np_H = np.diag(np_H)
+        if issparse(np_A):
+            np_A = np_A.toarray()
         p_weights = pd.DataFrame(np_H.dot(np.ones(np_H.shape[0])), weights).sort_index()
         p_xdot = pd.DataFrame(xdot_full, xdot).sort_index()
         p_A = pd.DataFrame(np_A, lbA, weights).sort_index(1).sort_index(0)
@@ -14,9 +14,19 @@ class ControllerPlugin(GiskardBehavior):
         super(ControllerPlugin, self).__init__(name)
         self.path_to_functions = self.get_god_map().get_data(identifier.data_folder)
         self.nWSR = self.get_god_map().get_data(identifier.nWSR)
+        self.sparse = self.get_god_map().get_data(identifier.qp_solver_sparse)
+        self.qp_solver_backend = self.get_god_map().get_data(identifier.qp_solver_backend)
+        self.qp_solver_large_problem_backend = self.get_god_map().get_data(identifier.qp_solver_large_problem_backend)
+        self.qp_solver_large_problem_threshold = self.get_god_map().get_data(
+            identifier.qp_solver_large_problem_threshold)
+        self.function_cache_enabled = self.get_god_map().get_data(identifier.function_cache_enabled)
+        self.function_cache_max_size = self.get_god_map().get_data(identifier.function_cache_max_size)
+        self.function_cache_max_age = self.get_god_map().get_data(identifier.function_cache_max_age)
+        self.compiler = self.get_god_map().get_data(identifier.function_cache_compiler)
         self.soft_constraints = None
         self.joint_constraints = None
         self.hard_constraints = None
+        self.controller = None
         self.qp_data = {}
         self.get_god_map().set_data(identifier.qp_data, self.qp_data)  # safe dict on godmap and work on ref
         self.rc_prismatic_velocity = self.get_god_map().get_data(identifier.rc_prismatic_velocity)
@@ -50,9 +60,21 @@ class ControllerPlugin(GiskardBehavior):
             # update = True
 
         # if update:
-        self.controller = InstantaneousController(self.get_robot(),
-                                                  u'{}/{}/'.format(self.path_to_functions,
-                                                                   self.get_robot().get_name()))
+        if self.controller is None:
+            # the controller is kept between goals, such that it can reuse constraints that did not change
+            if self.function_cache_enabled:
+                path_to_functions = u'{}/{}/'.format(self.path_to_functions, self.get_robot().get_name())
+            else:
+                path_to_functions = u''
+            self.controller = InstantaneousController(self.get_robot(),
+                                                      path_to_functions,
+                                                      self.function_cache_max_size,
+                                                      self.function_cache_max_age,
+                                                      self.sparse,
+                                                      self.qp_solver_backend,
+                                                      self.qp_solver_large_problem_backend,
+                                                      self.qp_solver_large_problem_threshold,
+                                                      self.compiler)
 
         controlled_joints = self.get_robot().controlled_joints
         joint_to_symbols_str = OrderedDict(
@@ -64,6 +86,7 @@ class ControllerPlugin(GiskardBehavior):
                                            self.joint_constraints,
                                            self.hard_constraints)
         self.controller.compile()
+        self.input_layout = self.get_god_map().get_input_layout(self.controller.get_expr())
 
         self.qp_data[identifier.weight_keys[-1]], \
         self.qp_data[identifier.b_keys[-1]], \
@@ -72,8 +95,7 @@ class ControllerPlugin(GiskardBehavior):
 
     def update(self):
 
-        expr = self.controller.get_expr()
-        expr = self.god_map.get_values(expr)
+        expr = self.input_layout.update()
 
         next_cmd, \
         self.qp_data[identifier.H[-1]], \
@@ -128,7 +128,7 @@ class WorldUpdatePlugin(GiskardBehavior):
                     write_dict(to_joint_state_position_dict((dict_to_joint_states(world_object.joint_state))), f)
                     f.write("zero_pose.set_object_joint_state({0}_name, {0}_joint_state)\n\n".format(object_name))
 
-                last_goal = self.get_god_map().unsafe_get_data(identifier.next_move_goal)
+                last_goal = self.get_god_map().get_snapshot().get_data(identifier.next_move_goal)
                 if last_goal:
                     f.write(u'last_goal_dict = ')
                     write_dict(convert_ros_message_to_dictionary(last_goal), f)
@@ -29,7 +29,7 @@ class GoalToConstraints(GetGoal):
 
         self.controlled_joints = set()
         self.controllable_links = set()
-        self.last_urdf = None
+        self.last_urdf_hash = None
         self.allowed_constraint_types = {x[0]: x[1] for x in inspect.getmembers(giskardpy.constraints) if
                                          inspect.isclass(x[1])}
 
@@ -173,9 +173,9 @@ class GoalToConstraints(GetGoal):
         loginfo(u'done parsing goal message')
 
     def has_robot_changed(self):
-        new_urdf = self.get_robot().get_urdf_str()
-        result = self.last_urdf != new_urdf
-        self.last_urdf = new_urdf
+        new_urdf_hash = self.get_robot().get_urdf_hash()
+        result = self.last_urdf_hash != new_urdf_hash
+        self.last_urdf_hash = new_urdf_hash
         return result
 
     def add_collision_avoidance_soft_constraints(self, collision_cmds):
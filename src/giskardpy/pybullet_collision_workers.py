@@ -0,0 +1,241 @@
+from multiprocessing import Process, Pipe, Pool
+
+import pybullet as p
+from giskard_msgs.msg import CollisionEntry
+
+import giskardpy.pybullet_wrapper as pw
+from giskardpy import logging
+from giskardpy.data_types import Collisions
+
+
+def collision_worker(connection):
+    """
+    Main loop of a worker process. It keeps a copy of the world in its own pybullet DIRECT client and computes the
+    contacts of the collision matrix entries it receives.
+    :type connection: multiprocessing.Connection
+    """
+    # the pybullet client is inherited from the parent process, if it was already connected
+    if p.isConnected():
+        p.resetSimulation()
+    else:
+        p.connect(p.DIRECT)
+    bodies = {}  # pybullet id in the main process -> pybullet id in this process
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        updates, queries = message
+        for update in updates:
+            if update[0] == u'remove':
+                p.removeBody(bodies.pop(update[1]))
+            elif update[0] == u'load':
+                bodies[update[1]] = pw.load_urdf_string_into_bullet(update[2])
+            else:
+                _, body_id, base_pose, joint_positions = update
+                if base_pose is not None:
+                    p.resetBasePositionAndOrientation(bodies[body_id], *base_pose)
+                for joint_index, position in joint_positions.items():
+                    p.resetJointState(bodies[body_id], joint_index, position)
+        aabbs = {}
+        result = []
+        distance_lower_bounds = []
+        for i, body_a, link_a_id, body_b, link_b_id, max_distance in queries:
+            contacts = pw.get_closest_points(bodies[body_a], link_a_id, bodies[body_b], link_b_id, max_distance, aabbs)
+            for contact in contacts:
+                result.append((i,) + contact)
+            distance_lower_bounds.append((i, pw.get_distance_lower_bound(bodies[body_a], link_a_id, bodies[body_b],
+                                                                         link_b_id, max_distance, contacts, aabbs)))
+        connection.send((result, distance_lower_bounds))
+    p.disconnect()
+
+
+class CollisionWorkers(object):
+    """
+    Mirrors a PyBulletWorld into worker processes, which have their own pybullet DIRECT clients, and splits the
+    collision matrix between them. Only works if the world uses a DIRECT client itself.
+    """
+
+    def __init__(self, world, number_of_workers):
+        """
+        :type world: giskardpy.pybullet_world.PyBulletWorld
+        :type number_of_workers: int
+        """
+        self.world = world
+        self.connections = []
+        self.processes = []
+        for i in range(number_of_workers):
+            parent_connection, child_connection = Pipe()
+            process = Process(target=collision_worker, args=(child_connection,))
+            process.daemon = True
+            process.start()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+        self.mirrored_bodies = {}  # pybullet id -> collision urdf of the mirrored body
+        self.mirrored_states = {}  # pybullet id -> (base pose, joint positions) that the workers have
+        logging.loginfo(u'started {} collision workers'.format(number_of_workers))
+
+    def get_updates(self):
+        """
+        :return: changes since the last call, which have to be applied to the worlds of the workers.
+                    Bodies get reloaded, if their pybullet id or urdf changed, e.g. because the robot was reloaded,
+                    otherwise only the base poses and joint positions that changed are send.
+                    Attached objects are mirrored as separate bodies, like in this process.
+        :rtype: list
+        """
+        bodies = self.world.robot.get_pybullet_bodies()
+        for body in self.world.get_objects().values():
+            bodies.update(body.get_pybullet_bodies())
+        updates = []
+        for body_id, collision_urdf in list(self.mirrored_bodies.items()):
+            if bodies.get(body_id) != collision_urdf:
+                updates.append((u'remove', body_id))
+                del self.mirrored_bodies[body_id]
+                del self.mirrored_states[body_id]
+        for body_id, collision_urdf in bodies.items():
+            if body_id not in self.mirrored_bodies:
+                updates.append((u'load', body_id, collision_urdf))
+                self.mirrored_bodies[body_id] = collision_urdf
+                self.mirrored_states[body_id] = (None, ())
+            base_pose = p.getBasePositionAndOrientation(body_id)
+            number_of_joints = p.getNumJoints(body_id)
+            if number_of_joints > 0:
+                joint_positions = tuple(x[0] for x in p.getJointStates(body_id, range(number_of_joints)))
+            else:
+                joint_positions = ()
+            old_base_pose, old_joint_positions = self.mirrored_states[body_id]
+            changed_joint_positions = {i: position for i, position in enumerate(joint_positions)
+                                       if i >= len(old_joint_positions) or old_joint_positions[i] != position}
+            if base_pose != old_base_pose or changed_joint_positions:
+                updates.append((u'state', body_id, base_pose if base_pose != old_base_pose else None,
+                                changed_joint_positions))
+                self.mirrored_states[body_id] = (base_pose, joint_positions)
+        return updates
+
+    def check_collisions(self, cut_off_distances, collision_list_size=15, distance_lower_bounds=None):
+        """
+        Same as PyBulletWorld.check_collisions, but the entries of cut_off_distances are split between the workers.
+        :type cut_off_distances: dict
+        :type collision_list_size: int
+        :type distance_lower_bounds: dict
+        :rtype: Collisions
+        """
+        robot = self.world.robot
+        robot_name = robot.get_name()
+        collisions = Collisions(robot, collision_list_size)
+        cut_off_distances = self.world.check_signed_distance_field_collisions(collisions, cut_off_distances,
+                                                                              distance_lower_bounds)
+        updates = self.get_updates()
+        keys = []
+        queries = [[] for _ in self.connections]
+        for i, ((robot_link, body_b, link_b), distance) in enumerate(cut_off_distances.items()):
+            if robot_name == body_b:
+                body_b_id = robot.get_pybullet_body_id(link_b)
+                link_b_id = robot.get_pybullet_link_id(link_b)
+            else:
+                body_b_id = self.world.get_object(body_b).get_pybullet_id()
+                if link_b != CollisionEntry.ALL:
+                    link_b_id = self.world.get_object(body_b).get_pybullet_link_id(link_b)
+                else:
+                    link_b_id = None
+            keys.append((robot_link, body_b, link_b))
+            queries[i % len(queries)].append((i, robot.get_pybullet_body_id(robot_link),
+                                              robot.get_pybullet_link_id(robot_link), body_b_id, link_b_id,
+                                              distance * 1.1))
+        for connection, worker_queries in zip(self.connections, queries):
+            connection.send((updates, worker_queries))
+
+        for connection in self.connections:
+            result, worker_distance_lower_bounds = connection.recv()
+            if distance_lower_bounds is not None:
+                for i, distance_lower_bound in worker_distance_lower_bounds:
+                    distance_lower_bounds[keys[i]] = distance_lower_bound
+            for i, link_index_b, position_on_a, position_on_b, contact_normal, contact_distance in result:
+                robot_link, body_b, link_b = keys[i]
+                if link_b == CollisionEntry.ALL:
+                    link_b = self.world.get_object(body_b).pybullet_link_id_to_name(link_index_b)
+                collisions.add_contact(robot_link, body_b, link_b, position_on_a, position_on_b,
+                                       contact_normal, contact_distance)
+        collisions.finalize()
+        return collisions
+
+    def stop(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+_sampled_bodies = {}  # urdf -> pybullet id, in the processes of SelfCollisionSampler
+
+
+def init_self_collision_sampler():
+    # the pybullet client is inherited from the parent process, if it was already connected
+    if p.isConnected():
+        p.resetSimulation()
+    else:
+        p.connect(p.DIRECT)
+
+
+def find_self_collisions(task):
+    """
+    Runs in the processes of SelfCollisionSampler.
+    :param task: (urdf, link id pairs, distance, list of [(joint index, position)])
+    :type task: tuple
+    :return: link id pairs that are closer than distance in at least one of the joint states
+    :rtype: set
+    """
+    urdf, link_id_pairs, distance, joint_states = task
+    if urdf not in _sampled_bodies:
+        p.resetSimulation()
+        _sampled_bodies.clear()
+        _sampled_bodies[urdf] = pw.load_urdf_string_into_bullet(urdf)
+    body_id = _sampled_bodies[urdf]
+    rest = set(link_id_pairs)
+    in_collision = set()
+    for joint_positions in joint_states:
+        for joint_index, position in joint_positions:
+            p.resetJointState(body_id, joint_index, position)
+        found = {(link_a, link_b) for link_a, link_b in rest
+                 if len(pw.getClosestPoints(body_id, body_id, distance, link_a, link_b)) > 0}
+        rest.difference_update(found)
+        in_collision.update(found)
+    return in_collision
+
+
+class SelfCollisionSampler(object):
+    """
+    Splits the random joint states, that are used to compute the self collision matrix, between worker processes,
+    which have their own pybullet DIRECT clients.
+    """
+
+    def __init__(self, number_of_workers):
+        """
+        :type number_of_workers: int
+        """
+        self.number_of_workers = number_of_workers
+        self.pool = Pool(number_of_workers, initializer=init_self_collision_sampler)
+        logging.loginfo(u'started {} self collision matrix workers'.format(number_of_workers))
+
+    def check_collisions(self, urdf, link_id_pairs, distance, joint_states):
+        """
+        :type urdf: str
+        :param link_id_pairs: pairs of pybullet link ids
+        :type link_id_pairs: set
+        :type distance: float
+        :param joint_states: list of [(pybullet joint index, position)]
+        :type joint_states: list
+        :return: link id pairs that are closer than distance in at least one of the joint states
+        :rtype: set
+        """
+        tasks = [(urdf, link_id_pairs, distance, joint_states[i::self.number_of_workers])
+                 for i in range(self.number_of_workers)]
+        in_collision = set()
+        for result in self.pool.map(find_self_collisions, tasks):
+            in_collision.update(result)
+        return in_collision
+
+    def stop(self):
+        self.pool.terminate()
+        self.pool.join()
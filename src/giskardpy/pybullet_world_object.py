@@ -1,15 +1,23 @@
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from multiprocessing import Lock
 
+import numpy as np
 import pybullet as p
 import giskardpy.pybullet_wrapper as pw
 from geometry_msgs.msg import Pose
+from tf.transformations import quaternion_matrix, quaternion_from_matrix
 
 from giskardpy.pybullet_wrapper import load_urdf_string_into_bullet, JointInfo, pybullet_pose_to_msg, \
     deactivate_rendering, activate_rendering, msg_to_pybullet_pose
+from giskardpy.collision_geometry import ORIGINAL, simplify_collision_geometry
+from giskardpy.pybullet_collision_workers import SelfCollisionSampler
 from giskardpy.world_object import WorldObject
 from giskardpy import logging
 
+# a rigidly attached object, that has its own body in pybullet, see PyBulletWorldObject.update_after_attach
+AttachedBody = namedtuple(u'AttachedBody', [u'pybullet_id', u'parent_link', u'parent_T_object', u'collision_urdf',
+                                            u'link_ids'])
+
 
 class PyBulletWorldObject(WorldObject):
     """
@@ -29,6 +37,11 @@ class PyBulletWorldObject(WorldObject):
         :type path_to_data_folder: str
         """
         self._pybullet_id = None
+        self._loaded_collision_urdf = None
+        self._attached_bodies = OrderedDict()  # object name -> AttachedBody
+        self._attached_link_to_body = {}  # link name -> object name
+        self.self_collision_sampler = None
+        self._collision_urdf = None, None
         self.mimic_cb = {}
         self.lock = Lock()
         super(PyBulletWorldObject, self).__init__(urdf,
@@ -55,19 +68,26 @@ class PyBulletWorldObject(WorldObject):
                 """
         with self.lock:
             WorldObject.joint_state.fset(self, value)
-            for joint_name, singe_joint_state in value.items():
-                # FIXME hack because pybullet doesn't support mimic joints
-                if not self.is_joint_mimic(joint_name):
-                    p.resetJointState(self._pybullet_id, self.joint_name_to_info[joint_name].joint_index,
-                                      singe_joint_state.position)
-                if joint_name in self.mimic_cb:
-                    mimic_joint, cb = self.mimic_cb[joint_name]
-                    mimiced_position = cb(singe_joint_state.position)
-                    p.resetJointState(self._pybullet_id, self.joint_name_to_info[mimic_joint].joint_index,
-                                      mimiced_position)
-                else:
-                    pass
+            for joint_index, position in self.get_pybullet_joint_positions(value):
+                p.resetJointState(self._pybullet_id, joint_index, position)
+            self.pin_attached_bodies()
 
+    def get_pybullet_joint_positions(self, joint_state):
+        """
+        :type joint_state: dict
+        :return: pybullet joint index and position for each joint, including mimic joints
+        :rtype: list
+        """
+        joint_positions = []
+        for joint_name, singe_joint_state in joint_state.items():
+            # FIXME hack because pybullet doesn't support mimic joints
+            if not self.is_joint_mimic(joint_name):
+                joint_positions.append((self.joint_name_to_info[joint_name].joint_index, singe_joint_state.position))
+            if joint_name in self.mimic_cb:
+                mimic_joint, cb = self.mimic_cb[joint_name]
+                joint_positions.append((self.joint_name_to_info[mimic_joint].joint_index,
+                                        cb(singe_joint_state.position)))
+        return joint_positions
 
     @WorldObject.base_pose.setter
     def base_pose(self, value):
@@ -77,10 +97,119 @@ class PyBulletWorldObject(WorldObject):
                 WorldObject.base_pose.fset(self, value)
                 position, orientation = msg_to_pybullet_pose(value)
                 p.resetBasePositionAndOrientation(self._pybullet_id, position, orientation)
+                self.pin_attached_bodies()
 
     def get_pybullet_id(self):
         return self._pybullet_id
 
+    def get_pybullet_body_id(self, link_name):
+        """
+        :return: pybullet id of the body that contains link_name, which is different from get_pybullet_id for links of
+                    attached objects
+        :rtype: int
+        """
+        if link_name in self._attached_link_to_body:
+            return self._attached_bodies[self._attached_link_to_body[link_name]].pybullet_id
+        return self._pybullet_id
+
+    def get_pybullet_bodies(self):
+        """
+        :return: pybullet id -> collision urdf, of all bodies that represent this object in pybullet
+        :rtype: dict
+        """
+        bodies = {body.pybullet_id: body.collision_urdf for body in self._attached_bodies.values()}
+        if self._pybullet_id is not None:
+            bodies[self._pybullet_id] = self._loaded_collision_urdf
+        return bodies
+
+    def get_map_T_link_in_pybullet(self, link_name):
+        """
+        :return: pose of link_name according to pybullet
+        :rtype: np.ndarray
+        """
+        body_id = self.get_pybullet_body_id(link_name)
+        link_id = self.get_pybullet_link_id(link_name)
+        if link_id == -1:
+            position, orientation = p.getBasePositionAndOrientation(body_id)
+        else:
+            position, orientation = p.getLinkState(body_id, link_id, computeForwardKinematics=True)[4:6]
+        map_T_link = quaternion_matrix(orientation)
+        map_T_link[:3, 3] = position
+        return map_T_link
+
+    def pin_attached_bodies(self):
+        """
+        Moves the bodies of attached objects to their parent links, is called whenever the joint state or base pose
+        changes.
+        """
+        for body in self._attached_bodies.values():
+            map_T_object = np.dot(self.get_map_T_link_in_pybullet(body.parent_link), body.parent_T_object)
+            p.resetBasePositionAndOrientation(body.pybullet_id, map_T_object[:3, 3],
+                                              quaternion_from_matrix(map_T_object))
+
+    def update_after_attach(self, urdf_object, parent_link):
+        """
+        Rigid objects are loaded as separate pybullet bodies, which are pinned to parent_link, instead of reloading this
+        whole object into pybullet. If urdf_object is a PyBulletWorldObject, its body is taken over.
+        Objects with movable joints are merged into the body of this object with reinitialize.
+        :type urdf_object: URDFObject
+        :type parent_link: str
+        """
+        super(PyBulletWorldObject, self).update_after_attach(urdf_object, parent_link)
+        if urdf_object.get_movable_joints() or self._pybullet_id is None:
+            self.reinitialize()
+            return
+        with self.lock:
+            name = urdf_object.get_name()
+            if isinstance(urdf_object, PyBulletWorldObject) and urdf_object.get_pybullet_id() is not None:
+                pybullet_id = urdf_object.get_pybullet_id()
+                collision_urdf = urdf_object.get_pybullet_bodies()[pybullet_id]
+                # otherwise urdf_object removes the body, when it gets deleted
+                urdf_object._pybullet_id = None
+            else:
+                collision_urdf = simplify_collision_geometry(urdf_object.get_urdf_str(),
+                                                             self.collision_geometry_fidelity,
+                                                             self.collision_geometry_folder,
+                                                             self.number_of_spheres)
+                pybullet_id = load_urdf_string_into_bullet(collision_urdf)
+            link_ids = {urdf_object.get_root(): -1}
+            for joint_index in range(p.getNumJoints(pybullet_id)):
+                link_ids[JointInfo(*p.getJointInfo(pybullet_id, joint_index)).link_name] = joint_index
+            parent_T_object = self.get_joint_origin_np(self.robot_name_to_root_joint(name))
+            self._attached_bodies[name] = AttachedBody(pybullet_id, parent_link, parent_T_object, collision_urdf,
+                                                       link_ids)
+            for link_name in link_ids:
+                self._attached_link_to_body[link_name] = name
+            self.pin_attached_bodies()
+        logging.logdebug(u'--> attached {} to {} as separate pybullet body'.format(name, self.get_name()))
+
+    def update_after_detach(self, sub_tree, joint_name):
+        """
+        Removes the bodies of detached objects from pybullet. If a part of this object's own body is detached, the
+        whole object is reloaded with reinitialize.
+        :type sub_tree: URDFObject
+        :type joint_name: str
+        """
+        super(PyBulletWorldObject, self).update_after_detach(sub_tree, joint_name)
+        removed_links = set(sub_tree.get_link_names())
+        removed_bodies = {self._attached_link_to_body[link_name] for link_name in removed_links
+                          if link_name in self._attached_link_to_body}
+        if any(link_name not in self._attached_link_to_body for link_name in removed_links) or \
+                any(not removed_links.issuperset(self._attached_bodies[name].link_ids) for name in removed_bodies):
+            self.reinitialize()
+            return
+        with self.lock:
+            for name in removed_bodies:
+                p.removeBody(self._attached_bodies.pop(name).pybullet_id)
+            self._attached_link_to_body = {link_name: name for link_name, name in self._attached_link_to_body.items()
+                                           if name not in removed_bodies}
+
+    def remove_attached_bodies(self):
+        for body in self._attached_bodies.values():
+            p.removeBody(body.pybullet_id)
+        self._attached_bodies = OrderedDict()
+        self._attached_link_to_body = {}
+
     def __sync_with_bullet(self):
         """
         Syncs joint and link infos with bullet
@@ -130,14 +259,72 @@ class PyBulletWorldObject(WorldObject):
                 joint_state = self.joint_state
                 base_pose = self.base_pose
                 self.suicide()
-            self._pybullet_id = load_urdf_string_into_bullet(self.get_urdf_str(), base_pose)
+            # attached objects are part of the urdf, their separate bodies are no longer needed
+            self.remove_attached_bodies()
+            self._loaded_collision_urdf = self.get_collision_urdf_str()
+            self._pybullet_id = load_urdf_string_into_bullet(self._loaded_collision_urdf, base_pose)
             self.__sync_with_bullet()
         if joint_state is not None:
             joint_state = {k: v for k, v in joint_state.items() if k in self.get_joint_names()}
             self.joint_state = joint_state
         activate_rendering()
 
+    def set_collision_geometry(self, fidelity, cache_folder, number_of_spheres=8):
+        """
+        Replaces the collision meshes in pybullet with simplified geometry, see collision_geometry.
+        The object is only reloaded into pybullet, if the old or new fidelity is not original.
+        :param fidelity: original, convex_hull or spheres
+        :type fidelity: str
+        :param cache_folder: where the simplified meshes are saved
+        :type cache_folder: str
+        :param number_of_spheres: maximum number of spheres per mesh, if fidelity is spheres
+        :type number_of_spheres: int
+        """
+        old_fidelity = self.collision_geometry_fidelity
+        super(PyBulletWorldObject, self).set_collision_geometry(fidelity, cache_folder, number_of_spheres)
+        self._collision_urdf = None, None
+        if fidelity != ORIGINAL or old_fidelity != ORIGINAL:
+            self.reinitialize()
+
+    def get_collision_urdf_str(self):
+        """
+        :return: the urdf that is loaded into pybullet, it only differs from get_urdf_str in the collision geometry
+        :rtype: str
+        """
+        urdf_hash = self.get_urdf_hash()
+        if self._collision_urdf[0] != urdf_hash:
+            self._collision_urdf = urdf_hash, simplify_collision_geometry(self.get_urdf_str(),
+                                                                          self.collision_geometry_fidelity,
+                                                                          self.collision_geometry_folder,
+                                                                          self.number_of_spheres)
+        return self._collision_urdf[1]
+
+    def set_number_of_self_collision_workers(self, number_of_workers):
+        """
+        :param number_of_workers: >1 samples the random joint states of the self collision matrix in that many
+                                    processes, doesn't work with the pybullet gui
+        :type number_of_workers: int
+        """
+        if self.self_collision_sampler is not None:
+            self.self_collision_sampler.stop()
+            self.self_collision_sampler = None
+        if number_of_workers > 1:
+            self.self_collision_sampler = SelfCollisionSampler(number_of_workers)
+
+    def check_collisions_in_joint_states(self, link_combinations, distance, joint_states):
+        # the sampler loads the whole urdf into one body, its link ids don't match the ones of attached bodies
+        if self.self_collision_sampler is None or self._attached_bodies:
+            return super(PyBulletWorldObject, self).check_collisions_in_joint_states(link_combinations, distance,
+                                                                                     joint_states)
+        link_id_pairs = {(self.get_pybullet_link_id(link_a), self.get_pybullet_link_id(link_b)): (link_a, link_b)
+                         for link_a, link_b in link_combinations}
+        joint_states = [self.get_pybullet_joint_positions(joint_state) for joint_state in joint_states]
+        in_collision = self.self_collision_sampler.check_collisions(self.get_collision_urdf_str(),
+                                                                    set(link_id_pairs.keys()), distance, joint_states)
+        return {link_id_pairs[x] for x in in_collision}
+
     def suicide(self):
+        self.remove_attached_bodies()
         if self._pybullet_id is not None:
             p.removeBody(self._pybullet_id)
             self._pybullet_id = None
@@ -145,6 +332,8 @@ class PyBulletWorldObject(WorldObject):
 
     def __del__(self):
         self.suicide()
+        if self.self_collision_sampler is not None:
+            self.self_collision_sampler.stop()
 
     def get_base_pose(self):
         """
@@ -157,14 +346,25 @@ class PyBulletWorldObject(WorldObject):
     def get_pybullet_link_id(self, link_name):
         """
         :type link_name: str
+        :return: link id in the body of get_pybullet_body_id
         :rtype: int
         """
+        if link_name in self._attached_link_to_body:
+            return self._attached_bodies[self._attached_link_to_body[link_name]].link_ids[link_name]
         return self.link_name_to_id[link_name]
 
     def pybullet_link_id_to_name(self, link_id):
         return self.link_id_to_name[link_id]
 
+    def get_link_aabb(self, link_name):
+        """
+        :return: min corner, max corner in map
+        :rtype: (np.ndarray, np.ndarray)
+        """
+        return pw.get_aabb(self.get_pybullet_body_id(link_name), self.get_pybullet_link_id(link_name))
+
     def in_collision(self, link_a, link_b, distance):
         link_id_a = self.get_pybullet_link_id(link_a)
         link_id_b = self.get_pybullet_link_id(link_b)
-        return len(pw.getClosestPoints(self._pybullet_id, self._pybullet_id, distance, link_id_a, link_id_b)) > 0
+        return len(pw.getClosestPoints(self.get_pybullet_body_id(link_a), self.get_pybullet_body_id(link_b), distance,
+                                       link_id_a, link_id_b)) > 0
@@ -3,6 +3,7 @@ import random
 import string
 from collections import namedtuple
 
+import numpy as np
 import pybullet as p
 from pybullet import getClosestPoints
 from geometry_msgs.msg import Pose, PoseStamped, Point, Quaternion
@@ -131,3 +132,118 @@ def get_body_names():
 
 def print_body_names():
     logging.loginfo("".join(get_body_names()))
+
+
+def get_aabb(body_id, link_id=None):
+    """
+    :param link_id: if None, the aabb of the whole body is returned
+    :type link_id: int
+    :return: min corner, max corner
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    if link_id is not None:
+        aabb_min, aabb_max = p.getAABB(body_id, link_id)
+        return np.array(aabb_min), np.array(aabb_max)
+    aabbs = [p.getAABB(body_id, link_id) for link_id in range(-1, p.getNumJoints(body_id))]
+    return np.min([x[0] for x in aabbs], axis=0), np.max([x[1] for x in aabbs], axis=0)
+
+
+def aabb_distance(aabb_a, aabb_b):
+    """
+    :type aabb_a: (np.ndarray, np.ndarray)
+    :type aabb_b: (np.ndarray, np.ndarray)
+    :return: lower bound for the distance between everything inside of aabb_a and aabb_b, 0 if they overlap
+    :rtype: float
+    """
+    gap = np.maximum(np.maximum(aabb_b[0] - aabb_a[1], aabb_a[0] - aabb_b[1]), 0)
+    return np.sqrt(np.dot(gap, gap))
+
+
+def point_to_aabb_distance(point, aabb):
+    """
+    :type point: list
+    :type aabb: (np.ndarray, np.ndarray)
+    :return: 0 if point is inside of aabb
+    :rtype: float
+    """
+    point = np.array(point)
+    gap = np.maximum(np.maximum(aabb[0] - point, point - aabb[1]), 0)
+    return np.sqrt(np.dot(gap, gap))
+
+
+def should_flip_contact(contact, aabb_a, aabb_b):
+    """
+    Pybullet sometimes swaps the contact points and the normal of a and b, e.g. for self collisions, if link b has more
+    than one collision element. They are flipped, if they fit better into the aabbs of the links the other way around.
+    If both orders fit equally well, which is the normal case for touching or penetrating links, the normal decides,
+    because it has to point from b towards a.
+    :type contact: ContactInfo
+    :param aabb_a: aabb of the link that should be a
+    :type aabb_a: (np.ndarray, np.ndarray)
+    :param aabb_b: aabb of the link that should be b
+    :type aabb_b: (np.ndarray, np.ndarray)
+    :rtype: bool
+    """
+    error = point_to_aabb_distance(contact.position_on_a, aabb_a) + \
+            point_to_aabb_distance(contact.position_on_b, aabb_b)
+    flipped_error = point_to_aabb_distance(contact.position_on_b, aabb_a) + \
+                    point_to_aabb_distance(contact.position_on_a, aabb_b)
+    if abs(error - flipped_error) > 1e-6:
+        return flipped_error < error
+    b_to_a = (aabb_a[0] + aabb_a[1]) / 2. - (aabb_b[0] + aabb_b[1]) / 2.
+    return np.dot(b_to_a, contact.contact_normal_on_b) < 0
+
+
+def get_closest_points(body_a, link_a, body_b, link_b, max_distance, aabbs):
+    """
+    Computes the contacts of one entry of the collision matrix. getClosestPoints is skipped, if the aabbs of the links
+    are further apart than max_distance.
+    :type body_a: int
+    :type link_a: int
+    :type body_b: int
+    :param link_b: None to check against all links of body_b
+    :type link_b: int
+    :type max_distance: float
+    :param aabbs: (body id, link id or None for the whole body) -> aabb, the aabbs are cached in this dict
+    :type aabbs: dict
+    :return: list of (link index b, position on a, position on b, contact normal, contact distance) in map
+    :rtype: list
+    """
+    if (body_a, link_a) not in aabbs:
+        aabbs[body_a, link_a] = get_aabb(body_a, link_a)
+    if (body_b, link_b) not in aabbs:
+        aabbs[body_b, link_b] = get_aabb(body_b, link_b)
+    if aabb_distance(aabbs[body_a, link_a], aabbs[body_b, link_b]) > max_distance:
+        return []
+    if link_b is None:
+        contacts = [ContactInfo(*x) for x in getClosestPoints(body_a, body_b, max_distance, link_a)]
+    else:
+        contacts = [ContactInfo(*x) for x in getClosestPoints(body_a, body_b, max_distance, link_a, link_b)]
+    result = []
+    for contact in contacts:  # type: ContactInfo
+        if (body_b, contact.link_index_b) not in aabbs:
+            aabbs[body_b, contact.link_index_b] = get_aabb(body_b, contact.link_index_b)
+        if should_flip_contact(contact, aabbs[body_a, link_a], aabbs[body_b, contact.link_index_b]):
+            flipped_normal = [-contact.contact_normal_on_b[0],
+                              -contact.contact_normal_on_b[1],
+                              -contact.contact_normal_on_b[2]]
+            result.append((contact.link_index_b, contact.position_on_b, contact.position_on_a,
+                           flipped_normal, contact.contact_distance))
+        else:
+            result.append((contact.link_index_b, contact.position_on_a, contact.position_on_b,
+                           contact.contact_normal_on_b, contact.contact_distance))
+    return result
+
+
+def get_distance_lower_bound(body_a, link_a, body_b, link_b, max_distance, contacts, aabbs):
+    """
+    :param contacts: result of get_closest_points for these parameters
+    :type contacts: list
+    :param aabbs: the aabb cache that was used for get_closest_points
+    :type aabbs: dict
+    :return: a lower bound for the distance between the links, without any additional engine calls
+    :rtype: float
+    """
+    if len(contacts) > 0:
+        return min(contact[4] for contact in contacts)
+    return max(max_distance, aabb_distance(aabbs[body_a, link_a], aabbs[body_b, link_b]))
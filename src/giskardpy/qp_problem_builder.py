@@ -1,30 +1,46 @@
+import hashlib
 from collections import OrderedDict
 from time import time
 
 import numpy as np
+from scipy.sparse import csc_matrix
 
 from giskardpy import logging, cas_wrapper as w
-from giskardpy.data_types import SoftConstraint
 from giskardpy.exceptions import QPSolverException, InfeasibleException, OutOfJointLimitsException, \
     HardConstraintsViolatedException
-from giskardpy.qp_solver import QPSolver
+from giskardpy.qp_solver import get_qp_solver_class
 from giskardpy.utils import make_filter_masks, create_path
 
 
+JOINT_CONSTRAINTS = u'joint constraints'
+HARD_CONSTRAINTS = u'hard constraints'
+SOFT_CONSTRAINTS = u'soft constraints'
+
+
 class QProblemBuilder(object):
     """
-    Wraps around QPOases. Builds the required matrices from constraints.
+    Wraps around the qp solver. Builds the required matrices from constraints.
     """
 
     def __init__(self, joint_constraints_dict, hard_constraints_dict, soft_constraints_dict, controlled_joint_symbols,
-                 path_to_functions=''):
+                 path_to_functions='', sparse=False, qp_solver_name=None, compiled_groups=None, compiler=None):
         """
         :type joint_constraints_dict: dict
         :type hard_constraints_dict: dict
         :type soft_constraints_dict: dict
         :type controlled_joint_symbols: list
-        :param path_to_functions: location where the compiled functions can be safed.
+        :param path_to_functions: folder where the compiled constraint groups can be safed.
         :type path_to_functions: str
+        :param sparse: if True, only the nonzeros of big ass M are evaluated and get_cmd returns H as a vector of its
+                        diagonal and A as scipy.sparse.csc_matrix.
+        :type sparse: bool
+        :param qp_solver_name: qp solver backend, see qp_solver.get_qp_solver_class
+        :type qp_solver_name: str
+        :param compiled_groups: compiled constraint groups of a previous QProblemBuilder, the ones that did not change
+                                    are reused instead of compiled again.
+        :type compiled_groups: dict
+        :param compiler: c compiler used for the constraint groups, see casadi_wrapper.speed_up
+        :type compiler: str
         """
         assert (not len(controlled_joint_symbols) > len(joint_constraints_dict))
         assert (not len(controlled_joint_symbols) < len(joint_constraints_dict))
@@ -34,8 +50,11 @@ class QProblemBuilder(object):
         self.hard_constraints_dict = hard_constraints_dict
         self.soft_constraints_dict = soft_constraints_dict
         self.controlled_joints = controlled_joint_symbols
-        self.construct_big_ass_M()
-        self.compile_big_ass_M()
+        self.sparse = sparse
+        self.compiler = compiler
+        self.h = len(self.hard_constraints_dict)
+        self.s = len(self.soft_constraints_dict)
+        self.j = len(self.joint_constraints_dict)
 
         self.shape1 = len(self.hard_constraints_dict) + len(self.soft_constraints_dict)
         self.shape2 = len(self.joint_constraints_dict) + len(self.soft_constraints_dict)
@@ -44,70 +63,145 @@ class QProblemBuilder(object):
         self.num_joint_constraints = len(self.joint_constraints_dict)
         self.num_soft_constraints = len(self.soft_constraints_dict)
 
-        self.qp_solver = QPSolver()
+        if compiled_groups is None:
+            compiled_groups = {}
+        self.build_big_ass_M(compiled_groups)
+        if self.sparse:
+            self.init_sparse_layout()
+
+        self.qp_solver = get_qp_solver_class(qp_solver_name)()
         self.lbAs = None  # for debugging purposes
 
     def get_expr(self):
         return self.compiled_big_ass_M.str_params
 
-    def construct_big_ass_M(self):
-        # TODO cpu intensive
-        weights = []
-        lb = []
-        ub = []
-        lbA = []
-        ubA = []
-        linear_weight = []
-        soft_expressions = []
-        hard_expressions = []
-        for constraint_name, constraint in self.joint_constraints_dict.items():
-            weights.append(constraint.weight)
-            lb.append(constraint.lower)
-            ub.append(constraint.upper)
-            linear_weight.append(constraint.linear_weight)
-        for constraint_name, constraint in self.hard_constraints_dict.items():
-            lbA.append(constraint.lower)
-            ubA.append(constraint.upper)
-            hard_expressions.append(constraint.expression)
-        for constraint_name, constraint in self.soft_constraints_dict.items(): # type: (str, SoftConstraint)
-            weights.append(constraint.weight)
-            lbA.append(constraint.lbA)
-            ubA.append(constraint.ubA)
-            lb.append(constraint.lower_slack_limit)
-            ub.append(constraint.upper_slack_limit)
-            linear_weight.append(constraint.linear_weight)
-            assert not w.is_matrix(constraint.expression), u'Matrices are not allowed as soft constraint expression'
-            soft_expressions.append(constraint.expression)
-
-        self.np_g = np.zeros(len(weights))
-
-        logging.loginfo(u'constructing new controller with {} soft constraints...'.format(len(soft_expressions)))
-        self.h = len(self.hard_constraints_dict)
-        self.s = len(self.soft_constraints_dict)
-        self.j = len(self.joint_constraints_dict)
-
-        self.init_big_ass_M()
-
-        self.set_weights(weights)
-
-        self.construct_A_hard(hard_expressions)
-        self.construct_A_soft(soft_expressions)
-
-        self.set_lbA(w.Matrix(lbA))
-        self.set_ubA(w.Matrix(ubA))
-        self.set_lb(w.Matrix(lb))
-        self.set_ub(w.Matrix(ub))
-        self.set_linear_weights(w.Matrix(linear_weight))
-
-
-    def compile_big_ass_M(self):
+    def get_big_ass_M_batch(self, substitutions):
+        """
+        Evaluates big ass M for many substitutions at once, e.g. for offline analysis of many joint states.
+        :param substitutions: one row for each evaluation, with values for the symbols returned by get_expr
+        :type substitutions: np.ndarray
+        :return: array with shape (number of substitutions, h + s + j + s, j + s + 3), also in sparse mode
+        :rtype: np.ndarray
+        """
+        batch = self.compiled_big_ass_M.call_batch(substitutions)
+        if not self.sparse:
+            return batch
+        dense_batch = np.zeros((batch.shape[0],) + self.compiled_big_ass_M.shape)
+        rows, columns = self.compiled_big_ass_M.get_sparsity()
+        dense_batch[:, rows, columns] = batch
+        return dense_batch
+
+    def build_big_ass_M(self, compiled_groups):
+        """
+        Big ass M is not compiled as a whole, instead each group of constraints gets its own function, which computes
+        the entries of its rows in a compact matrix. Groups whose constraints did not change since the last goal are
+        taken from compiled_groups or loaded from self.path_to_functions, such that only new groups have to be
+        differentiated and compiled.
+        :param compiled_groups: group hash -> CompiledFunction
+        :type compiled_groups: dict
+        """
         t = time()
-        self.free_symbols = w.free_symbols(self.big_ass_M)
-        self.compiled_big_ass_M = w.speed_up(self.big_ass_M,
-                                             self.free_symbols)
-        logging.loginfo(u'compiled symbolic expressions in {:.5f}s'.format(time() - t))
+        self.compiled_groups = OrderedDict()
+        functions = []
+        rows = []
+        columns = []
+        for kind, group_name, indices, constraints in self.get_constraint_groups():
+            group_hash = self.get_group_hash(kind, constraints)
+            if group_hash in self.compiled_groups:
+                compiled_group = self.compiled_groups[group_hash]
+            elif group_hash in compiled_groups:
+                compiled_group = compiled_groups[group_hash]
+            else:
+                compiled_group = self.load_group(group_hash)
+                if compiled_group is None:
+                    compiled_group = self.compile_group(kind, group_name, constraints)
+                    self.safe_group(group_hash, compiled_group)
+            self.compiled_groups[group_hash] = compiled_group
+            group_rows, group_columns = self.get_group_layout(kind, indices)
+            functions.append(compiled_group)
+            rows.append(group_rows)
+            columns.append(group_columns)
+        self.compiled_big_ass_M = w.StackedCompiledFunction(functions, rows, columns,
+                                                            (self.shape1 + self.shape2, self.shape2 + 3),
+                                                            sparse=self.sparse)
+        logging.loginfo(u'constructed controller with {} soft constraints in {:.5f}s'.format(self.s, time() - t))
+
+    def get_constraint_groups(self):
+        """
+        Soft constraints are grouped by the goal type that created them, which is the part of their name before the
+        first '/'.
+        :return: list of (kind, group name, indices of the constraints within their kind, constraints)
+        :rtype: list
+        """
+        groups = []
+        if self.j > 0:
+            groups.append((JOINT_CONSTRAINTS, JOINT_CONSTRAINTS, range(self.j), self.joint_constraints_dict.values()))
+        if self.h > 0:
+            groups.append((HARD_CONSTRAINTS, HARD_CONSTRAINTS, range(self.h), self.hard_constraints_dict.values()))
+        soft_groups = OrderedDict()
+        for i, (constraint_name, constraint) in enumerate(self.soft_constraints_dict.items()):
+            assert not w.is_matrix(constraint.expression), u'Matrices are not allowed as soft constraint expression'
+            group_name = str(constraint_name).split(u'/')[0]
+            if group_name not in soft_groups:
+                soft_groups[group_name] = ([], [])
+            soft_groups[group_name][0].append(i)
+            soft_groups[group_name][1].append(constraint)
+        for group_name, (indices, constraints) in soft_groups.items():
+            groups.append((SOFT_CONSTRAINTS, group_name, indices, constraints))
+        return groups
+
+    def get_group_hash(self, kind, constraints):
+        """
+        :return: a hash that only changes, if the compiled function of the group would change
+        :rtype: str
+        """
+        fields = self.get_group_fields(kind)
+        if kind != JOINT_CONSTRAINTS:
+            fields = fields + [u'expression']
+        # printed as one vector, subexpressions that the constraints share, e.g. forward kinematics, are printed only
+        # once instead of for every entry
+        v = w.vstack([getattr(c, field) for c in constraints for field in fields])
+        s = u''.join([kind, str(self.sparse), str(self.compiler)] +
+                     [str(x) for x in self.controlled_joints] +
+                     [str(v)])
+        return hashlib.md5(s.encode(u'utf-8')).hexdigest()
+
+    def get_group_fields(self, kind):
+        """
+        :return: the attributes of constraints of this kind that are copied into the compact matrix of their group
+        :rtype: list
+        """
+        if kind == JOINT_CONSTRAINTS:
+            return [u'weight', u'lower', u'upper', u'linear_weight']
+        if kind == HARD_CONSTRAINTS:
+            return [u'lower', u'upper']
+        return [u'lbA', u'ubA', u'weight', u'lower_slack_limit', u'upper_slack_limit', u'linear_weight']
 
-    def init_big_ass_M(self):
+    def make_group_matrix(self, kind, constraints):
+        """
+        Each row of the compact matrix contains the entries that one constraint adds to big ass M:
+            joint constraints: weight, lb, ub, g
+            hard constraints: A (j columns), lbA, ubA
+            soft constraints: A (j columns), 1 (identity for the slack variable), lbA, ubA, weight, lb, ub, g
+        :rtype: w.Matrix
+        """
+        fields = self.get_group_fields(kind)
+        if kind == JOINT_CONSTRAINTS:
+            M = w.zeros(len(constraints), len(fields))
+            offset = 0
+        else:
+            if kind == HARD_CONSTRAINTS:
+                M = w.zeros(len(constraints), self.j + len(fields))
+            else:
+                M = w.zeros(len(constraints), self.j + 1 + len(fields))
+                M[:, self.j] = w.Matrix([1] * len(constraints))
+            offset = M.shape[1] - len(fields)
+            M[:, :self.j] = w.jacobian(w.Matrix([c.expression for c in constraints]), self.controlled_joints)
+        for i, field in enumerate(fields):
+            M[:, offset + i] = w.Matrix([getattr(c, field) for c in constraints])
+        return M
+
+    def get_group_layout(self, kind, indices):
         """
         #        j           s       1      1     1
         #    |--------------------------------------|
@@ -117,46 +211,106 @@ class QProblemBuilder(object):
         #    |--------------------------------------|
         # j+s| H                  | lb    | ub  | g |
         #    | -------------------------------------|
+        :param indices: indices of the constraints within their kind
+        :type indices: list
+        :return: row and column in big ass M of each entry of the matrix created by make_group_matrix
+        :rtype: (np.ndarray, np.ndarray)
         """
-        self.big_ass_M = w.zeros(self.h + self.s * 2 + self.j,
-                                 self.j + self.s + 3)
-
-    def construct_A_hard(self, hard_expressions):
-        A_hard = w.Matrix(hard_expressions)
-        A_hard = w.jacobian(A_hard, self.controlled_joints)
-        self.set_A_hard(A_hard)
-
-    def set_A_hard(self, A_hard):
-        self.big_ass_M[:self.h, :self.j] = A_hard
-
-    def construct_A_soft(self, soft_expressions):
-        A_soft = w.zeros(self.s, self.j + self.s)
+        indices = np.array(indices, dtype=int)
+        lbA_column = self.shape2
+        ubA_column = self.shape2 + 1
+        g_column = self.shape2 + 2
+
+        def stack(*entries):
+            return np.column_stack([x * np.ones(len(indices), dtype=int) for x in entries])
+
+        if kind == JOINT_CONSTRAINTS:
+            H_rows = self.shape1 + indices
+            rows = stack(*[H_rows] * 4)
+            columns = stack(indices, lbA_column, ubA_column, g_column)
+        elif kind == HARD_CONSTRAINTS:
+            rows = stack(*[indices] * (self.j + 2))
+            columns = stack(*(range(self.j) + [lbA_column, ubA_column]))
+        else:
+            A_rows = self.h + indices
+            H_rows = self.shape1 + self.j + indices
+            slack_columns = self.j + indices
+            rows = stack(*([A_rows] * (self.j + 3) + [H_rows] * 4))
+            columns = stack(*(range(self.j) + [slack_columns, lbA_column, ubA_column,
+                                                slack_columns, lbA_column, ubA_column, g_column]))
+        return rows, columns
+
+    def compile_group(self, kind, group_name, constraints):
         t = time()
-        A_soft[:, :self.j] = w.jacobian(w.Matrix(soft_expressions), self.controlled_joints)
-        logging.loginfo(u'computed Jacobian in {:.5f}s'.format(time() - t))
-        A_soft[:, self.j:] = w.eye(self.s)
-        self.set_A_soft(A_soft)
+        M = self.make_group_matrix(kind, constraints)
+        compiled_group = w.speed_up(M, w.free_symbols(M), backend=self.compiler, sparse=self.sparse,
+                                    build_folder=self.path_to_functions)
+        logging.loginfo(u'compiled {} {} in {:.5f}s'.format(len(constraints), group_name, time() - t))
+        return compiled_group
 
-    def set_A_soft(self, A_soft):
-        self.big_ass_M[self.h:self.h + self.s, :self.j + self.s] = A_soft
-
-    def set_lbA(self, lbA):
-        self.big_ass_M[:self.h + self.s, self.j + self.s] = lbA
-
-    def set_ubA(self, ubA):
-        self.big_ass_M[:self.h + self.s, self.j + self.s + 1] = ubA
-
-    def set_lb(self, lb):
-        self.big_ass_M[self.h + self.s:, self.j + self.s] = lb
+    def load_group(self, group_hash):
+        """
+        Tries to load a previously compiled constraint group from self.path_to_functions.
+        :rtype: w.CompiledFunction
+        """
+        if not self.path_to_functions:
+            return None
+        return w.load_compiled_function(self.path_to_functions + group_hash)
 
-    def set_ub(self, ub):
-        self.big_ass_M[self.h + self.s:, self.j + self.s + 1] = ub
+    def safe_group(self, group_hash, compiled_group):
+        if self.path_to_functions:
+            w.safe_compiled_function(compiled_group, self.path_to_functions + group_hash)
 
-    def set_linear_weights(self, linear_weights):
-        self.big_ass_M[self.h + self.s:, self.j + self.s + 2] = linear_weights
+    def init_sparse_layout(self):
+        """
+        Computes where the nonzeros of the sparse big ass M have to go in H, A, lb, ub, g, lbA and ubA.
+        The nonzeros are in column major order, which is why the ones belonging to A already are in CSC order.
+        """
+        rows, columns = self.compiled_big_ass_M.get_sparsity()
+        is_A_row = rows < self.shape1
+        is_b_row = rows >= self.shape1
+
+        A_mask = is_A_row & (columns < self.shape2)
+        self.A_nz_index = np.where(A_mask)[0]
+        self.A_indices = rows[A_mask]
+        self.A_indptr = np.concatenate(([0], np.cumsum(np.bincount(columns[A_mask], minlength=self.shape2))))
+
+        H_mask = is_b_row & (columns == rows - self.shape1)
+        self.H_nz_index = np.where(H_mask)[0]
+        self.H_index = columns[H_mask]
+
+        def vector_layout(row_mask, column, offset):
+            mask = row_mask & (columns == column)
+            return np.where(mask)[0], rows[mask] - offset
+
+        self.lb_layout = vector_layout(is_b_row, self.shape2, self.shape1)
+        self.ub_layout = vector_layout(is_b_row, self.shape2 + 1, self.shape1)
+        self.g_layout = vector_layout(is_b_row, self.shape2 + 2, self.shape1)
+        self.lbA_layout = vector_layout(is_A_row, self.shape2, 0)
+        self.ubA_layout = vector_layout(is_A_row, self.shape2 + 1, 0)
+
+    def split_sparse_big_ass_M(self, nonzeros):
+        """
+        :param nonzeros: output of the sparse compiled big ass M
+        :type nonzeros: np.ndarray
+        :return: diagonal of H, A as csc_matrix, lb, ub, g, lbA, ubA
+        """
 
-    def set_weights(self, weights):
-        self.big_ass_M[self.h + self.s:, :-3] = w.diag(*weights)
+        def to_vector(layout, length):
+            nz_index, index = layout
+            v = np.zeros(length)
+            v[index] = nonzeros[nz_index]
+            return v
+
+        np_H = to_vector((self.H_nz_index, self.H_index), self.shape2)
+        np_A = csc_matrix((nonzeros[self.A_nz_index], self.A_indices, self.A_indptr),
+                          shape=(self.shape1, self.shape2))
+        np_lb = to_vector(self.lb_layout, self.shape2)
+        np_ub = to_vector(self.ub_layout, self.shape2)
+        np_g = to_vector(self.g_layout, self.shape2)
+        np_lbA = to_vector(self.lbA_layout, self.shape1)
+        np_ubA = to_vector(self.ubA_layout, self.shape1)
+        return np_H, np_A, np_lb, np_ub, np_g, np_lbA, np_ubA
 
     def debug_print(self, unfiltered_H, A, lb, ub, lbA, ubA, g, xdot_full=None, actually_print=False):
         import pandas as pd
@@ -248,13 +402,17 @@ class QProblemBuilder(object):
 
     def filter_zero_weight_constraints(self, H, A, lb, ub, lbA, ubA, g):
         bA_mask, b_mask = make_filter_masks(H, self.num_joint_constraints, self.num_hard_constraints)
-        A = A[bA_mask][:, b_mask].copy()
+        if self.sparse:
+            A = A[np.where(bA_mask)[0]][:, np.where(b_mask)[0]]
+            H = H[b_mask]
+        else:
+            A = A[bA_mask][:, b_mask].copy()
+            H = H[b_mask][:, b_mask]
         lbA = lbA[bA_mask]
         ubA = ubA[bA_mask]
         lb = lb[b_mask]
         ub = ub[b_mask]
         g = g[b_mask]
-        H = H[b_mask][:, b_mask]
         return H, A, lb, ub, lbA, ubA, g
 
     def get_cmd(self, substitutions, nWSR=None):
@@ -266,18 +424,27 @@ class QProblemBuilder(object):
         :rtype: dict
         """
         np_big_ass_M = self.compiled_big_ass_M.call2(substitutions)
-        np_H = np_big_ass_M[self.shape1:, :-3].copy()
-        np_A = np_big_ass_M[:self.shape1, :self.shape2].copy()
-        np_lb = np_big_ass_M[self.shape1:, -3].copy()
-        np_ub = np_big_ass_M[self.shape1:, -2].copy()
-        np_g = np_big_ass_M[self.shape1:, -1].copy()
-        np_lbA = np_big_ass_M[:self.shape1, -3].copy()
-        np_ubA = np_big_ass_M[:self.shape1, -2].copy()
+        if self.sparse:
+            np_H, np_A, np_lb, np_ub, np_g, np_lbA, np_ubA = self.split_sparse_big_ass_M(np_big_ass_M)
+        else:
+            np_H = np_big_ass_M[self.shape1:, :-3].copy()
+            np_A = np_big_ass_M[:self.shape1, :self.shape2].copy()
+            np_lb = np_big_ass_M[self.shape1:, -3].copy()
+            np_ub = np_big_ass_M[self.shape1:, -2].copy()
+            np_g = np_big_ass_M[self.shape1:, -1].copy()
+            np_lbA = np_big_ass_M[:self.shape1, -3].copy()
+            np_ubA = np_big_ass_M[:self.shape1, -2].copy()
         H, A, lb, ub, lbA, ubA, g = self.filter_zero_weight_constraints(np_H, np_A, np_lb, np_ub, np_lbA, np_ubA, np_g)
         # self.debug_print(np_H, A, lb, ub, lbA, ubA)
         try:
-            xdot_full = self.qp_solver.solve(H, g, A, lb, ub, lbA, ubA, nWSR)
+            if self.sparse:
+                xdot_full = self.qp_solver.solve_sparse(H, g, A, lb, ub, lbA, ubA, nWSR)
+            else:
+                xdot_full = self.qp_solver.solve(H, g, A, lb, ub, lbA, ubA, nWSR)
         except QPSolverException as e:
+            if self.sparse:
+                np_H = np.diag(np_H)
+                A = A.toarray()
             p_weights, p_A, p_lbA, p_ubA, p_lb, p_ub = self.debug_print(np_H, A, lb, ub, lbA, ubA, g, actually_print=True)
             if isinstance(e, InfeasibleException):
                 if self.are_joint_limits_violated(p_lb, p_ub):
@@ -1,3 +1,5 @@
+from abc import ABCMeta, abstractmethod
+
 import numpy as np
 
 import qpoases
@@ -7,7 +9,57 @@ from giskardpy.exceptions import MAX_NWSR_REACHEDException, QPSolverException, I
 from giskardpy import logging
 
 
-class QPSolver(object):
+class BaseQPSolver(object):
+    """
+    Interface for the qp solver backends used by QProblemBuilder.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def solve(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        x^T*H*x + x^T*g
+        s.t.: lbA < A*x < ubA
+        and    lb <  x  < ub
+        NaNs in lb, ub, lbA and ubA are replaced with 0, the arrays are modified in place.
+        :param H: 2d diagonal weight matrix, shape = (jc (joint constraints) + sc (soft constraints)) * (jc + sc)
+        :type np.array
+        :param g: 1d zero vector of len joint constraints + soft constraints
+        :type np.array
+        :param A: 2d jacobi matrix of hc (hard constraints) and sc, shape = (hc + sc) * (number of joints)
+        :type np.array
+        :param lb: 1d vector containing lower bound of x, len = jc + sc
+        :type np.array
+        :param ub: 1d vector containing upper bound of x, len = js + sc
+        :type np.array
+        :param lbA: 1d vector containing lower bounds for the change of hc and sc, len = hc+sc
+        :type np.array
+        :param ubA: 1d vector containing upper bounds for the change of hc and sc, len = hc+sc
+        :type np.array
+        :param nWSR: maximum number of working set recalculations, only used by qpOASES
+        :type np.array
+        :return: x according to the equations above, len = joint constraints + soft constraints
+        :type np.array
+        """
+        raise NotImplementedError()
+
+    def solve_sparse(self, weights, g, A, lb, ub, lbA, ubA, nWSR=None):
+        """
+        Same as solve, but H is given as a vector of its diagonal and A as scipy.sparse matrix.
+        Backends that only work with dense matrices don't have to override this.
+        :param weights: 1d vector containing the diagonal of H
+        :type weights: np.array
+        :type A: scipy.sparse.csc_matrix
+        :return: x according to the equations in solve
+        :type np.array
+        """
+        return self.solve(np.diag(weights), g, A.toarray(), lb, ub, lbA, ubA, nWSR)
+
+
+class QPSolver(BaseQPSolver):
+    """
+    qpOASES backend.
+    """
     RETURN_VALUE_DICT = {value: name for name, value in vars(PyReturnValue).items()}
 
     def __init__(self):
@@ -80,7 +132,6 @@ class QPSolver(object):
                 self.started = True
                 break
             elif success == PyReturnValue.NAN_IN_LB:
-                # TODO nans get replaced with 0 document this somewhere
                 # TODO might still be buggy when nan occur when the qp problem is already initialized
                 lb[np.isnan(lb)] = 0
                 nWSR = None
@@ -124,3 +175,22 @@ class QPSolver(object):
 
         self.qpProblem.getPrimalSolution(self.xdot_full)
         return self.xdot_full
+
+
+QPOASES = u'qpoases'
+OSQP = u'osqp'
+
+
+def get_qp_solver_class(name):
+    """
+    :param name: name of the qp solver backend, as used in the qp_solver section of the config file
+    :type name: str
+    :rtype: type
+    """
+    if not name or name == QPOASES:
+        return QPSolver
+    if name == OSQP:
+        # osqp is an optional dependency
+        from giskardpy.qp_solver_osqp import QPSolverOSQP
+        return QPSolverOSQP
+    raise QPSolverException(u'unknown qp solver backend \'{}\''.format(name))
@@ -0,0 +1,87 @@
+import numpy as np
+import osqp
+from scipy import sparse
+
+from giskardpy import logging
+from giskardpy.exceptions import QPSolverException, InfeasibleException
+from giskardpy.qp_solver import BaseQPSolver
+
+
+class QPSolverOSQP(BaseQPSolver):
+    """
+    OSQP backend, an ADMM solver that works directly on sparse matrices.
+    The bounds on x are added to the constraint matrix as identity, because osqp has no separate bounds.
+    """
+    SOLVED = 1
+    SOLVED_INACCURATE = 2
+    PRIMAL_INFEASIBLE = -3
+    PRIMAL_INFEASIBLE_INACCURATE = 3
+
+    def __init__(self, eps_abs=1e-5, eps_rel=1e-5, max_iter=4000, polish=True, inaccurate_tolerance=1e-3):
+        """
+        :param eps_abs: absolute tolerance
+        :type eps_abs: float
+        :param eps_rel: relative tolerance
+        :type eps_rel: float
+        :param max_iter: maximum number of admm iterations
+        :type max_iter: int
+        :param polish: tries to compute a high accuracy solution after admm terminated
+        :type polish: bool
+        :param inaccurate_tolerance: inaccurate solutions are only used, if they violate no constraint by more than this
+        :type inaccurate_tolerance: float
+        """
+        self.inaccurate_tolerance = inaccurate_tolerance
+        self.settings = {u'eps_abs': eps_abs,
+                         u'eps_rel': eps_rel,
+                         u'max_iter': max_iter,
+                         u'polish': polish,
+                         u'warm_start': True,
+                         u'verbose': False}
+        self.started = False
+        self.P_indices = None
+        self.A_indices = None
+        self.A_indptr = None
+
+    def solve(self, H, g, A, lb, ub, lbA, ubA, nWSR=None):
+        # keep explicit zeros, such that the sparsity pattern does not change between calls and hot starts work
+        rows, columns = A.shape
+        A = sparse.csc_matrix((A.ravel(order=u'F'),
+                               np.tile(np.arange(rows), columns),
+                               np.arange(columns + 1) * rows),
+                              shape=A.shape)
+        return self.solve_sparse(np.diag(H).copy(), g, A, lb, ub, lbA, ubA, nWSR)
+
+    def solve_sparse(self, weights, g, A, lb, ub, lbA, ubA, nWSR=None):
+        for v in (lb, ub, lbA, ubA):
+            v[np.isnan(v)] = 0
+        P = sparse.diags(weights, format=u'csc')
+        A = sparse.vstack((A, sparse.eye(A.shape[1], format=u'csc')), format=u'csc')
+        l = np.concatenate((lbA, lb))
+        u = np.concatenate((ubA, ub))
+        if self.started and self.is_same_sparsity(P, A):
+            self.qpProblem.update(q=g, l=l, u=u, Px=P.data, Ax=A.data)
+        else:
+            self.qpProblem = osqp.OSQP()
+            self.qpProblem.setup(P=P, q=g, A=A, l=l, u=u, **self.settings)
+            self.P_indices = P.indices
+            self.A_indices = A.indices
+            self.A_indptr = A.indptr
+        result = self.qpProblem.solve()
+        status = result.info.status_val
+        if status == self.SOLVED_INACCURATE:
+            violation = max(np.max(l - A.dot(result.x)), np.max(A.dot(result.x) - u), 0)
+            if violation <= self.inaccurate_tolerance:
+                logging.logwarn(u'osqp solution is inaccurate, constraints are violated by {}'.format(violation))
+                status = self.SOLVED
+        if status == self.SOLVED:
+            self.started = True
+            return result.x
+        self.started = False
+        if status in (self.PRIMAL_INFEASIBLE, self.PRIMAL_INFEASIBLE_INACCURATE):
+            raise InfeasibleException(result.info.status)
+        raise QPSolverException(result.info.status)
+
+    def is_same_sparsity(self, P, A):
+        return np.array_equal(self.P_indices, P.indices) and \
+               np.array_equal(self.A_indices, A.indices) and \
+               np.array_equal(self.A_indptr, A.indptr)
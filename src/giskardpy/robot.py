@@ -4,11 +4,13 @@ from collections import namedtuple, OrderedDict, defaultdict
 from copy import deepcopy
 from itertools import combinations
 from giskardpy import identifier
+import numpy as np
 from geometry_msgs.msg import PoseStamped
 
 from giskardpy import WORLD_IMPLEMENTATION, cas_wrapper as w
 from giskardpy.data_types import SingleJointState, HardConstraint, JointConstraint
 from giskardpy.god_map import GodMap
+from giskardpy.numpy_world_object import NumpyWorldObject
 from giskardpy.pybullet_world_object import PyBulletWorldObject
 from giskardpy.utils import KeyDefaultDict, \
     homo_matrix_to_pose, memoize
@@ -16,6 +18,8 @@ from giskardpy.world_object import WorldObject
 
 if WORLD_IMPLEMENTATION == u'pybullet':
     Backend = PyBulletWorldObject
+elif WORLD_IMPLEMENTATION == u'numpy':
+    Backend = NumpyWorldObject
 else:
     Backend = WorldObject
 
@@ -32,6 +36,18 @@ class Robot(Backend):
         """
         self._fk_expressions = {}
         self._fks = {}
+        self._all_fks = None
+        self._root_T_links = None
+        self._link_to_index = {}
+        self._controlled_ancestors = None  # see get_controlled_ancestors
+        self._fk_cache = {}  # (root, tip) -> root_T_tip
+        self._fk_positions = {}  # joint name -> position, that the cached fks were computed with
+        self._fk_joint_masks = {}  # joint name -> bits of the joints that move, if it changes
+        self._fk_link_masks = {}  # link name -> bits of the joints in the chain from the robot root to the link
+        self.fk_cache_hits = 0
+        self.fk_cache_misses = 0
+        self._compiler = None
+        self._build_folder = None
         self._evaluated_fks = {}
         self._joint_to_frame = {}
         self._joint_position_symbols = KeyDefaultDict(lambda x: w.Symbol(x))  # don't iterate over this map!!
@@ -63,14 +79,47 @@ class Robot(Backend):
         self.__joint_state_positions = {str(self._joint_position_symbols[k]): v.position for k, v in
                                         self.joint_state.items()}
         # self._evaluated_fks.clear()
-        self.get_fk_np.memo.clear()
+        self.invalidate_fks()
+
+    def invalidate_fks(self):
+        """
+        Only removes the cached fks whose chains contain a joint, whose position changed since the last call.
+        root_T_tip changes, iff exactly one of root and tip is in the sub tree of such a joint.
+        """
+        changed = 0
+        positions = {}
+        for joint_name, single_joint_state in self.joint_state.items():
+            positions[joint_name] = single_joint_state.position
+            if self._fk_positions.get(joint_name) != single_joint_state.position:
+                changed |= self._fk_joint_masks.get(joint_name, 0)
+        self._fk_positions = positions
+        if changed:
+            self._root_T_links = None
+            link_masks = self._fk_link_masks
+            self._fk_cache = {(root, tip): root_T_tip for (root, tip), root_T_tip in self._fk_cache.items()
+                              if not (link_masks[root] ^ link_masks[tip]) & changed}
+
+    @Backend.controlled_joints.setter
+    def controlled_joints(self, value):
+        Backend.controlled_joints.fset(self, value)
+        self._controlled_ancestors = None
+
+    def get_controlled_ancestors(self):
+        """
+        :return: for each link in the tree index the index of the closest link, that is the link itself or one of its
+                    ancestors, whose parent joint is controlled, -1 if there is none
+        :rtype: np.ndarray
+        """
+        if self._controlled_ancestors is None:
+            self._controlled_ancestors = self.get_tree_index().get_nearest_ancestors(set(self.controlled_joints))
+        return self._controlled_ancestors
 
-    @memoize
     def get_controlled_parent_joint(self, link_name):
-        joint = self.get_parent_joint_of_link(link_name)
-        while joint not in self.controlled_joints:
-            joint = self.get_parent_joint_of_joint(joint)
-        return joint
+        index = self.get_tree_index()
+        link = self.get_controlled_ancestors()[index.link_to_index[link_name]]
+        if link < 0:
+            raise KeyError(u'no controlled joint above {}'.format(link_name))
+        return index.parent_joint_names[link]
 
     @memoize
     def get_controlled_leaf_joints(self):
@@ -131,6 +180,32 @@ class Robot(Backend):
         # self._create_constraints()
         self.init_fast_fks()
 
+    def update_after_attach(self, urdf_object, parent_link):
+        """
+        Only creates the frames of the new joints, the fk expressions and compiled fks of the other links stay valid.
+        """
+        super(Robot, self).update_after_attach(urdf_object, parent_link)
+        self._create_frames_expressions([self.robot_name_to_root_joint(urdf_object.get_name())] +
+                                        urdf_object.get_joint_names())
+        self.update_fast_fks()
+
+    def update_after_detach(self, sub_tree, joint_name):
+        """
+        Only removes the frames, fk expressions and compiled fks that contain links of sub_tree.
+        """
+        super(Robot, self).update_after_detach(sub_tree, joint_name)
+        removed_links = set(sub_tree.get_link_names())
+        for joint in [joint_name] + sub_tree.get_joint_names():
+            self._joint_to_frame.pop(joint, None)
+        self._fk_expressions = {(root, tip): fk for (root, tip), fk in self._fk_expressions.items()
+                                if root not in removed_links and tip not in removed_links}
+        for root, tip in list(self._fks.keys()):
+            if root in removed_links or tip in removed_links:
+                del self._fks[root, tip]
+        self._fk_cache = {(root, tip): root_T_tip for (root, tip), root_T_tip in self._fk_cache.items()
+                          if root not in removed_links and tip not in removed_links}
+        self.update_fast_fks()
+
     def set_joint_position_symbols(self, symbols):
         self._joint_position_symbols = symbols
 
@@ -161,8 +236,15 @@ class Robot(Backend):
     def update_self_collision_matrix(self, added_links=None, removed_links=None):
         super(Robot, self).update_self_collision_matrix(added_links, removed_links)
 
-    def _create_frames_expressions(self):
-        for joint_name, urdf_joint in self._urdf_robot.joint_map.items():
+    def _create_frames_expressions(self, joint_names=None):
+        """
+        :param joint_names: only create the frames of these joints, all if None
+        :type joint_names: list
+        """
+        if joint_names is None:
+            joint_names = self._urdf_robot.joint_map.keys()
+        for joint_name in joint_names:
+            urdf_joint = self._urdf_robot.joint_map[joint_name]
             if self.is_joint_movable(joint_name):
                 joint_symbol = self.get_joint_position_symbol(joint_name)
             if self.is_joint_mimic(joint_name):
@@ -229,15 +311,36 @@ class Robot(Backend):
         :return: 4d matrix describing the transformation from root_link to tip_link
         :rtype: spw.Matrix
         """
-        fk = w.eye(4)
-        root_chain, _, tip_chain = self.get_split_chain(root_link, tip_link, links=False)
-        for joint_name in root_chain:
-            fk = w.dot(fk, w.inverse_frame(self.get_joint_frame(joint_name)))
-        for joint_name in tip_chain:
-            fk = w.dot(fk, self.get_joint_frame(joint_name))
+        if root_link == tip_link:
+            return w.eye(4)
+        _, connection, _ = self.get_split_chain(root_link, tip_link, joints=False)
+        connection = connection[0]
+        fk = self.get_link_fk_expression(connection, tip_link)
+        if root_link != connection:
+            fk = w.dot(w.inverse_frame(self.get_link_fk_expression(connection, root_link)), fk)
         # FIXME there is some reference fuckup going on, but i don't know where; deepcopy is just a quick fix
         return deepcopy(fk)
 
+    def get_link_fk_expression(self, ancestor_link, link):
+        """
+        The transformation of each link is cached and built from the one of its parent link, such that fk expressions
+        with overlapping chains share their common subexpressions instead of recomputing the whole chain.
+        :param ancestor_link: has to be link or one of its ancestors
+        :type ancestor_link: str
+        :type link: str
+        :return: 4d matrix describing the transformation from ancestor_link to link
+        :rtype: spw.Matrix
+        """
+        key = (ancestor_link, link)
+        if key not in self._fk_expressions:
+            if ancestor_link == link:
+                self._fk_expressions[key] = w.eye(4)
+            else:
+                parent_link = self.get_parent_link_of_link(link)
+                self._fk_expressions[key] = w.dot(self.get_link_fk_expression(ancestor_link, parent_link),
+                                                  self.get_joint_frame(self.get_parent_joint_of_link(link)))
+        return self._fk_expressions[key]
+
     def get_fk_pose(self, root, tip):
         try:
             homo_m = self.get_fk_np(root, tip)
@@ -250,18 +353,147 @@ class Robot(Backend):
             pass
         return p
 
-    @memoize
     def get_fk_np(self, root, tip):
-        return self._fks[root, tip](**self.get_joint_state_positions())
+        """
+        Pairs are answered from the fks of all links, see get_root_T_links_np, and cached until a joint in their chain
+        moves, see invalidate_fks.
+        :rtype: np.ndarray
+        """
+        try:
+            root_T_tip = self._fk_cache[root, tip]
+            self.fk_cache_hits += 1
+            return root_T_tip
+        except KeyError:
+            self.fk_cache_misses += 1
+        root_T_links = self.get_root_T_links_np()
+        robot_root_T_tip = root_T_links[self._link_to_index[tip]]
+        if root == self.get_root():
+            root_T_tip = robot_root_T_tip
+        else:
+            robot_root_T_root = root_T_links[self._link_to_index[root]]
+            root_T_robot_root = np.eye(4)
+            root_T_robot_root[:3, :3] = robot_root_T_root[:3, :3].T
+            root_T_robot_root[:3, 3] = -np.dot(robot_root_T_root[:3, :3].T, robot_root_T_root[:3, 3])
+            root_T_tip = np.dot(root_T_robot_root, robot_root_T_tip)
+        self._fk_cache[root, tip] = root_T_tip
+        return root_T_tip
+
+    def reset_fk_cache_statistics(self):
+        self.fk_cache_hits = 0
+        self.fk_cache_misses = 0
+
+    def get_root_T_links_np(self):
+        """
+        Computes root_T_link of all links with one compiled function, whose expressions share the chains of common
+        ancestors. The result is cached until the joint state changes.
+        :return: array with shape (number of links, 4, 4), see get_link_index
+        :rtype: np.ndarray
+        """
+        if self._root_T_links is None:
+            if self._all_fks is None:
+                root = self.get_root()
+                links = sorted(self._link_to_index, key=self._link_to_index.get)
+                fk = w.vstack([self.get_link_fk_expression(root, link_name) for link_name in links])
+                self._all_fks = w.speed_up(fk, w.free_symbols(fk), backend=self._compiler,
+                                           build_folder=self._build_folder)
+            # copy, because the output buffer of the compiled function is reused
+            self._root_T_links = np.array(self._all_fks(**self.get_joint_state_positions())).reshape(-1, 4, 4)
+        return self._root_T_links
+
+    def get_root_T_links(self):
+        """
+        :return: link name -> root_T_link
+        :rtype: dict
+        """
+        root_T_links = self.get_root_T_links_np()
+        return {link_name: root_T_links[i] for link_name, i in self._link_to_index.items()}
+
+    def get_link_index(self, link_name):
+        """
+        :return: index of link_name in the result of get_root_T_links_np
+        :rtype: int
+        """
+        return self._link_to_index[link_name]
+
+    def get_fk_np_batch(self, root, tip, joint_names, positions):
+        """
+        Computes root_T_tip for many joint states at once.
+        :type root: str
+        :type tip: str
+        :param joint_names: names of the columns of positions, other joints keep their current position
+        :type joint_names: list
+        :param positions: one row of joint positions for each evaluation
+        :type positions: np.ndarray
+        :return: array with shape (number of rows in positions, 4, 4)
+        :rtype: np.ndarray
+        """
+        fk = self._fks[root, tip]
+        positions = np.asarray(positions, dtype=float)
+        joint_state = self.get_joint_state_positions()
+        column = {str(self._joint_position_symbols[joint_name]): i for i, joint_name in enumerate(joint_names)}
+        args = np.empty((positions.shape[0], len(fk.str_params)))
+        for i, param in enumerate(fk.str_params):
+            if param in column:
+                args[:, i] = positions[:, column[param]]
+            else:
+                args[:, i] = joint_state[param]
+        return fk.call_batch(args)
+
+    def set_compiler(self, compiler, build_folder):
+        """
+        Compiles fk functions into shared libraries from now on, see casadi_wrapper.speed_up.
+        :param compiler: e.g. gcc or clang
+        :type compiler: str
+        :param build_folder: where the shared libraries are stored
+        :type build_folder: str
+        """
+        self._compiler = compiler
+        self._build_folder = build_folder
+        self.init_fast_fks()
 
     def init_fast_fks(self):
         def f(key):
             root, tip = key
             fk = self.get_fk_expression(root, tip)
-            m = w.speed_up(fk, w.free_symbols(fk))
+            m = w.speed_up(fk, w.free_symbols(fk), backend=self._compiler, build_folder=self._build_folder)
             return m
 
         self._fks = KeyDefaultDict(f)
+        self._fk_cache = {}
+        self._fk_positions = {}
+        self.update_fast_fks()
+
+    def update_fast_fks(self):
+        """
+        Has to be called, when links were added or removed.
+        """
+        self._link_to_index = self.get_tree_index().link_to_index
+        self._controlled_ancestors = None
+        self._all_fks = None
+        self._root_T_links = None
+        self.init_fk_masks()
+
+    def init_fk_masks(self):
+        """
+        Assigns a bit to each movable and mimic joint. A joint's mask contains its own bit and the ones of the joints
+        that mimic it, a link's mask the bits of all joints between the robot root and the link.
+        """
+        bits = {}
+        for joint_name in self.get_joint_names():
+            if self.is_joint_movable(joint_name) or self.is_joint_mimic(joint_name):
+                bits[joint_name] = 1 << len(bits)
+        self._fk_joint_masks = {}
+        for joint_name, bit in bits.items():
+            self._fk_joint_masks[joint_name] = self._fk_joint_masks.get(joint_name, 0) | bit
+            if self.is_joint_mimic(joint_name):
+                mimiced_joint = self.get_mimiced_joint_name(joint_name)
+                self._fk_joint_masks[mimiced_joint] = self._fk_joint_masks.get(mimiced_joint, 0) | bit
+        index = self.get_tree_index()
+        link_masks = [0] * len(index.link_names)
+        # parents come before their children in the tree index
+        for link in range(1, len(index.link_names)):
+            link_masks[link] = link_masks[index.parents[link]] | bits.get(index.parent_joint_names[link], 0)
+        self._fk_link_masks = dict(zip(index.link_names, link_masks))
 
     # JOINT FUNCTIONS
 
@@ -365,19 +597,43 @@ class Robot(Backend):
             return True
         return link_a < link_b
 
-    @memoize
     def get_chain_reduced_to_controlled_joints(self, link_a, link_b):
-        chain = self.get_chain(link_b, link_a)
-        for i, thing in enumerate(chain):
-            if i % 2 == 1 and thing in self.controlled_joints:
-                new_link_b = chain[i - 1]
-                break
-        else:
-            raise KeyError(u'no controlled joint in chain between {} and {}'.format(link_a, link_b))
-        for i, thing in enumerate(reversed(chain)):
-            if i % 2 == 1 and thing in self.controlled_joints:
-                new_link_a = chain[len(chain) - i]
-                break
-        else:
+        """
+        :return: the links at both ends of the part of the chain between link_a and link_b, that is moved by controlled
+                    joints
+        :rtype: tuple
+        """
+        index = self.get_tree_index()
+        a = index.link_to_index[link_a]
+        b = index.link_to_index[link_b]
+        connection = index.get_lca_index(a, b)
+        new_link_b = self._get_link_below_controlled_joint(connection, b, a)
+        new_link_a = self._get_link_below_controlled_joint(connection, a, b)
+        if new_link_a is None or new_link_b is None:
             raise KeyError(u'no controlled joint in chain between {} and {}'.format(link_a, link_b))
         return new_link_a, new_link_b
+
+    def _get_link_below_controlled_joint(self, connection, link, other_link):
+        """
+        Walks the chain from link over connection to other_link and stops at the first controlled joint.
+        :param connection: tree index of the lowest common ancestor of link and other_link
+        :type connection: int
+        :type link: int
+        :type other_link: int
+        :return: name of the last link before that joint, None if there is no controlled joint in the chain
+        :rtype: str
+        """
+        index = self.get_tree_index()
+        controlled_ancestors = self.get_controlled_ancestors()
+        closest = controlled_ancestors[link]
+        if closest >= 0 and index.depths[closest] > index.depths[connection]:
+            return index.link_names[closest]
+        # the first controlled joint below connection on the way down to other_link
+        topmost = -1
+        closest = controlled_ancestors[other_link]
+        while closest >= 0 and index.depths[closest] > index.depths[connection]:
+            topmost = closest
+            closest = controlled_ancestors[index.parents[closest]]
+        if topmost < 0:
+            return None
+        return index.link_names[index.parents[topmost]]
@@ -0,0 +1,323 @@
+import hashlib
+import os
+import pickle
+from itertools import product
+from time import time
+
+import numpy as np
+import urdf_parser_py.urdf as up
+from tf.transformations import euler_matrix
+
+from giskardpy import logging, capsule_collision as cc
+from giskardpy.collision_geometry import SPHERES_VERSION
+from giskardpy.utils import create_path
+
+BOX = 0
+SPHERE = 1
+CYLINDER = 2
+CAPSULE = 3
+# number of points whose distances are computed at once while baking
+CHUNK_SIZE = 2 ** 18
+
+
+def box_distances(points, size):
+    """
+    :param points: array with shape (n, 3) in the frame of the box
+    :param size: x, y, z length of the box
+    :rtype: np.ndarray
+    """
+    q = np.abs(points) - np.array(size) / 2.
+    return np.linalg.norm(np.maximum(q, 0), axis=1) + np.minimum(q.max(axis=1), 0)
+
+
+def sphere_distances(points, radius):
+    return np.linalg.norm(points, axis=1) - radius
+
+
+def cylinder_distances(points, radius, length):
+    """
+    :param points: array with shape (n, 3) in the frame of the cylinder, whose axis is z
+    """
+    q = np.stack((np.linalg.norm(points[:, :2], axis=1) - radius, np.abs(points[:, 2]) - length / 2.), axis=1)
+    return np.linalg.norm(np.maximum(q, 0), axis=1) + np.minimum(q.max(axis=1), 0)
+
+
+def capsule_point_distances(points, capsule):
+    """
+    :param capsule: one row of capsule_collision
+    """
+    p0 = np.tile(capsule[:3], (len(points), 1))
+    p1 = np.tile(capsule[3:6], (len(points), 1))
+    on_segment, _ = cc.closest_points_on_segments(p0, p1, points, points)
+    return np.linalg.norm(points - on_segment, axis=1) - capsule[6]
+
+
+def primitive_distances(points, primitive):
+    """
+    :param points: array with shape (n, 3) in the root frame of the object
+    :param primitive: (link index, type, parameters, root_T_primitive)
+    :type primitive: tuple
+    :return: signed distance of each point to the primitive
+    :rtype: np.ndarray
+    """
+    _, primitive_type, parameters, root_T_primitive = primitive
+    if primitive_type == CAPSULE:
+        return capsule_point_distances(points, parameters)
+    rotation = root_T_primitive[:3, :3]
+    points = np.dot(points - root_T_primitive[:3, 3], rotation)
+    if primitive_type == BOX:
+        return box_distances(points, parameters)
+    if primitive_type == SPHERE:
+        return sphere_distances(points, parameters)
+    return cylinder_distances(points, *parameters)
+
+
+def primitive_aabb(primitive):
+    """
+    :return: min corner, max corner in the root frame of the object
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    _, primitive_type, parameters, root_T_primitive = primitive
+    if primitive_type == CAPSULE:
+        return cc.capsules_aabb(parameters[None])
+    if primitive_type == SPHERE:
+        half_size = np.array([parameters] * 3)
+    elif primitive_type == BOX:
+        half_size = np.array(parameters) / 2.
+    else:
+        half_size = np.array([parameters[0], parameters[0], parameters[1] / 2.])
+    corners = np.array(list(product(*zip(-half_size, half_size))))
+    corners = np.dot(corners, root_T_primitive[:3, :3].T) + root_T_primitive[:3, 3]
+    return corners.min(axis=0), corners.max(axis=0)
+
+
+def get_primitives(world_object):
+    """
+    Boxes, spheres and cylinders are used as they are, meshes are covered by the capsules of capsule_collision.
+    :type world_object: giskardpy.world_object.WorldObject
+    :return: link names with collision, list of (link index, type, parameters, root_T_primitive)
+    :rtype: (list, list)
+    """
+    root_T_links = world_object.get_root_T_links()
+    link_names = sorted(world_object.get_link_names_with_collision())
+    primitives = []
+    for link_index, link_name in enumerate(link_names):
+        link = world_object.get_urdf_link(link_name)
+        collisions = getattr(link, u'collisions', None)
+        if collisions is None:
+            collisions = [link.collision] if link.collision is not None else []
+        for collision in collisions:
+            geometry = collision.geometry
+            link_T_primitive = np.eye(4)
+            if collision.origin is not None:
+                if collision.origin.rpy is not None:
+                    link_T_primitive = euler_matrix(*collision.origin.rpy)
+                if collision.origin.xyz is not None:
+                    link_T_primitive[:3, 3] = collision.origin.xyz
+            root_T_primitive = np.dot(root_T_links[link_name], link_T_primitive)
+            if isinstance(geometry, up.Box):
+                primitives.append((link_index, BOX, list(geometry.size), root_T_primitive))
+            elif isinstance(geometry, up.Sphere):
+                primitives.append((link_index, SPHERE, geometry.radius, root_T_primitive))
+            elif isinstance(geometry, up.Cylinder):
+                primitives.append((link_index, CYLINDER, (geometry.radius, geometry.length), root_T_primitive))
+            else:
+                capsules = cc.transform_capsules(root_T_links[link_name],
+                                                 cc.collision_to_capsules(collision, world_object.number_of_spheres,
+                                                                          world_object.collision_geometry_folder))
+                for capsule in capsules:
+                    primitives.append((link_index, CAPSULE, capsule, np.eye(4)))
+    return link_names, primitives
+
+
+class SignedDistanceField(object):
+    """
+    Voxelized signed distance field of a static object in its root frame. Each voxel stores the distance to the
+    closest surface, the gradient of the distance and the link of the closest surface.
+    Distances, gradients and links are looked up with trilinear or nearest neighbor interpolation.
+    """
+
+    def __init__(self, origin, resolution, padding, distances, link_indices, link_names):
+        """
+        :param origin: position of the first voxel in the root frame of the object
+        :type origin: np.ndarray
+        :param resolution: edge length of a voxel
+        :type resolution: float
+        :param padding: how far the grid extends beyond the geometry of the object
+        :type padding: float
+        :param distances: array with shape (nx, ny, nz)
+        :type distances: np.ndarray
+        :param link_indices: index in link_names of the closest link for each voxel
+        :type link_indices: np.ndarray
+        :type link_names: list
+        """
+        self.origin = origin
+        self.resolution = resolution
+        self.padding = padding
+        self.distances = distances
+        self.gradients = np.stack(np.gradient(distances, resolution), axis=-1).astype(np.float32)
+        self.link_indices = link_indices
+        self.link_names = link_names
+        self.shape = np.array(distances.shape)
+
+    @classmethod
+    def from_world_object(cls, world_object, resolution, padding):
+        """
+        Bakes the collision geometry of world_object at its current joint state.
+        :type world_object: giskardpy.world_object.WorldObject
+        :type resolution: float
+        :type padding: float
+        :rtype: SignedDistanceField
+        """
+        t = time()
+        link_names, primitives = get_primitives(world_object)
+        if primitives:
+            aabbs = [primitive_aabb(primitive) for primitive in primitives]
+            lower = np.min([aabb[0] for aabb in aabbs], axis=0) - padding
+            upper = np.max([aabb[1] for aabb in aabbs], axis=0) + padding
+        else:
+            lower = -np.ones(3) * padding
+            upper = np.ones(3) * padding
+        shape = np.maximum(np.ceil((upper - lower) / resolution).astype(int) + 1, 2)
+        grid = np.stack(np.meshgrid(*[lower[i] + np.arange(shape[i]) * resolution for i in range(3)],
+                                    indexing=u'ij'), axis=-1).reshape(-1, 3)
+        distances = np.full(len(grid), np.inf)
+        link_indices = np.zeros(len(grid), dtype=np.int16)
+        for start in range(0, len(grid), CHUNK_SIZE):
+            points = grid[start:start + CHUNK_SIZE]
+            chunk_distances = distances[start:start + CHUNK_SIZE]
+            chunk_link_indices = link_indices[start:start + CHUNK_SIZE]
+            for primitive in primitives:
+                primitive_distance = primitive_distances(points, primitive)
+                closer = primitive_distance < chunk_distances
+                chunk_distances[closer] = primitive_distance[closer]
+                chunk_link_indices[closer] = primitive[0]
+        # objects without collision geometry are at least padding away from everything within their grid
+        distances[np.isinf(distances)] = padding
+        logging.loginfo(u'baked signed distance field of {} with {} voxels in {:.3f}s'.format(
+            world_object.get_name(), len(grid), time() - t))
+        return cls(lower, resolution, padding, distances.reshape(shape).astype(np.float32),
+                   link_indices.reshape(shape), link_names)
+
+    def lookup(self, points):
+        """
+        :param points: array with shape (n, 3) in the root frame of the object
+        :type points: np.ndarray
+        :return: signed distance, gradient, index of the closest link, whether the point is within the grid.
+                    The distance of points outside of the grid is a lower bound.
+        :rtype: tuple
+        """
+        grid_points = (points - self.origin) / self.resolution
+        clipped = np.clip(grid_points, 0, self.shape - 1)
+        in_grid = np.all(clipped == grid_points, axis=1)
+        lower_index = np.minimum(np.floor(clipped).astype(int), self.shape - 2)
+        fraction = clipped - lower_index
+        distances = np.zeros(len(points))
+        gradients = np.zeros((len(points), 3))
+        for corner in product((0, 1), repeat=3):
+            weight = np.prod(np.where(corner, fraction, 1 - fraction), axis=1)
+            x, y, z = (lower_index + corner).T
+            distances += weight * self.distances[x, y, z]
+            gradients += weight[:, None] * self.gradients[x, y, z]
+        x, y, z = np.round(clipped).astype(int).T
+        link_indices = self.link_indices[x, y, z]
+        outside_distance = np.linalg.norm(grid_points - clipped, axis=1) * self.resolution
+        distances = np.where(in_grid, distances, outside_distance + self.padding)
+        return distances, gradients, link_indices, in_grid
+
+    def get_contacts(self, map_T_root, capsules, capsule_groups, number_of_groups):
+        """
+        Samples points along the segments of the capsules and looks them up in the field.
+        :param map_T_root: pose of the object
+        :type map_T_root: np.ndarray
+        :param capsules: capsules in map, see capsule_collision
+        :type capsules: np.ndarray
+        :param capsule_groups: group of each capsule, e.g. the index of its robot link
+        :type capsule_groups: np.ndarray
+        :type number_of_groups: int
+        :return: (group, link index, position on a, position on b, contact normal, contact distance) arrays with
+                    the closest contact of each pair of group and link of the object, all in map,
+                    and a lower bound for the distance of each group
+        :rtype: (tuple, np.ndarray)
+        """
+        capsules = cc.transform_capsules(np.linalg.inv(map_T_root), capsules)
+        segments = capsules[:, 3:6] - capsules[:, :3]
+        number_of_samples = np.ceil(np.linalg.norm(segments, axis=1) / self.resolution).astype(int) + 1
+        capsule_index = np.repeat(np.arange(len(capsules)), number_of_samples)
+        first_sample = np.repeat(np.cumsum(number_of_samples) - number_of_samples, number_of_samples)
+        s = (np.arange(len(capsule_index)) - first_sample) / \
+            np.maximum(number_of_samples[capsule_index] - 1, 1).astype(float)
+        points = capsules[capsule_index, :3] + segments[capsule_index] * s[:, None]
+        radii = capsules[capsule_index, 6]
+        groups = capsule_groups[capsule_index]
+
+        distances, gradients, link_indices, in_grid = self.lookup(points)
+        contact_distances = distances - radii
+        # the sampled points are at most resolution / 2 away from the closest point of their segment and the
+        # trilinear interpolation of a distance field is off by at most half a voxel diagonal
+        lower_bounds = np.full(number_of_groups, np.inf)
+        np.minimum.at(lower_bounds, groups, contact_distances - self.resolution * (np.sqrt(3) + 1) / 2)
+
+        # closest sample of each pair of group and link, points outside of the grid are further away than padding
+        samples = np.nonzero(in_grid)[0]
+        keys = groups[samples] * len(self.link_names) + link_indices[samples]
+        order = np.lexsort((contact_distances[samples], keys))
+        sorted_keys = keys[order]
+        closest = samples[order[np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))[:len(order)]]]
+
+        gradient_norms = np.linalg.norm(gradients[closest], axis=1)
+        normals = np.zeros((len(closest), 3))
+        normals[:, 2] = 1
+        non_zero = gradient_norms > cc.EPSILON
+        normals[non_zero] = gradients[closest][non_zero] / gradient_norms[non_zero, None]
+        position_on_b = points[closest] - normals * distances[closest, None]
+        position_on_a = points[closest] - normals * radii[closest, None]
+        rotation = map_T_root[:3, :3]
+        translation = map_T_root[:3, 3]
+        return (groups[closest], link_indices[closest],
+                np.dot(position_on_a, rotation.T) + translation,
+                np.dot(position_on_b, rotation.T) + translation,
+                np.dot(normals, rotation.T),
+                contact_distances[closest]), lower_bounds
+
+
+def get_state_key(world_object):
+    """
+    :return: everything besides the urdf, that changes the signed distance field of world_object
+    :rtype: tuple
+    """
+    return tuple(sorted((joint_name, world_object.get_joint_position(joint_name))
+                        for joint_name in world_object.get_movable_joints()))
+
+
+def get_signed_distance_field_hash(world_object, resolution, padding):
+    """
+    :rtype: str
+    """
+    m = hashlib.md5()
+    m.update(world_object.get_urdf_hash().encode(u'utf-8'))
+    # meshes are baked as spheres, fields of older or coarser spheres can't be reused
+    m.update(str((get_state_key(world_object), resolution, padding,
+                  world_object.number_of_spheres, SPHERES_VERSION)).encode(u'utf-8'))
+    return m.hexdigest()
+
+
+def get_signed_distance_field(world_object, resolution, padding, cache_folder):
+    """
+    Loads the signed distance field of world_object from cache_folder or bakes and saves it, if it doesn't exist yet.
+    :type world_object: giskardpy.world_object.WorldObject
+    :type resolution: float
+    :type padding: float
+    :type cache_folder: str
+    :rtype: SignedDistanceField
+    """
+    path = u'{}{}.sdf'.format(cache_folder, get_signed_distance_field_hash(world_object, resolution, padding))
+    if os.path.isfile(path):
+        with open(path, u'rb') as f:
+            return pickle.load(f)
+    sdf = SignedDistanceField.from_world_object(world_object, resolution, padding)
+    create_path(path)
+    with open(path, u'wb') as f:
+        pickle.dump(sdf, f, pickle.HIGHEST_PROTOCOL)
+    logging.loginfo(u'saved signed distance field of {} in \'{}\''.format(world_object.get_name(), path))
+    return sdf
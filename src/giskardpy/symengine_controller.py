@@ -1,7 +1,7 @@
-import hashlib
 import warnings
 from collections import OrderedDict
-from itertools import chain
+
+from giskardpy import cas_wrapper as w
 from giskardpy.qp_problem_builder import QProblemBuilder
 from giskardpy.robot import Robot
 
@@ -14,13 +14,36 @@ class InstantaneousController(object):
     # TODO should anybody who uses this class know about constraints?
 
 
-    def __init__(self, robot, path_to_functions):
+    def __init__(self, robot, path_to_functions, cache_max_size=0, cache_max_age=0, sparse=False,
+                 qp_solver_name=None, large_qp_solver_name=None, large_qp_threshold=0, compiler=None):
         """
         :type robot: Robot
-        :param path_to_functions: location where compiled functions are stored
+        :param path_to_functions: folder where compiled functions are stored, no functions are stored if empty
         :type: str
+        :param cache_max_size: in MB, compiled functions in path_to_functions get deleted if it gets bigger, 0 = no limit
+        :type cache_max_size: float
+        :param cache_max_age: in days, compiled functions that have not been used for longer get deleted, 0 = no limit
+        :type cache_max_age: float
+        :param sparse: see QProblemBuilder
+        :type sparse: bool
+        :param qp_solver_name: qp solver backend, see qp_solver.get_qp_solver_class
+        :type qp_solver_name: str
+        :param large_qp_solver_name: qp solver backend used instead, if the qp has more than large_qp_threshold
+                                        hard and soft constraints
+        :type large_qp_solver_name: str
+        :param large_qp_threshold: 0 means large_qp_solver_name is never used
+        :type large_qp_threshold: int
+        :param compiler: see QProblemBuilder
+        :type compiler: str
         """
         self.path_to_functions = path_to_functions
+        self.cache_max_size = cache_max_size
+        self.cache_max_age = cache_max_age
+        self.sparse = sparse
+        self.qp_solver_name = qp_solver_name
+        self.large_qp_solver_name = large_qp_solver_name
+        self.large_qp_threshold = large_qp_threshold
+        self.compiler = compiler
         self.robot = robot
         self.controlled_joints = []
         self.hard_constraints = {}
@@ -54,32 +77,40 @@ class InstantaneousController(object):
 
     def update_constraints(self, joint_to_symbols_str, soft_constraints, joint_constraints, hard_constraints):
         """
-        Triggers a recompile if the number of soft constraints has changed.
+        Replaces the constraints of the previous goal, call compile afterwards.
         :type soft_constraints: dict
         :type free_symbols: set
         """
-        # TODO bug if soft constraints get replaced, actual amount does not change.
-        last_number_of_constraints = len(self.soft_constraints)
-        self.soft_constraints.update(soft_constraints)
-        if last_number_of_constraints != len(self.soft_constraints):
-            self.qp_problem_builder = None
-
+        self.soft_constraints = soft_constraints
         self.joint_to_symbols_str = joint_to_symbols_str
         self.joint_constraints = joint_constraints
         self.hard_constraints = hard_constraints
 
-
     def compile(self):
-        a = ''.join(str(x) for x in sorted(chain(self.soft_constraints.keys(),
-                                                 self.hard_constraints.keys(),
-                                                 self.joint_constraints.keys())))
-        function_hash = hashlib.md5(a + self.robot.get_urdf_str()).hexdigest()
-        path_to_functions = self.path_to_functions + function_hash
+        """
+        Builds a new QProblemBuilder, which reuses the compiled constraint groups of the previous one, if they did not
+        change.
+        """
+        if self.qp_problem_builder is None:
+            compiled_groups = {}
+        else:
+            compiled_groups = self.qp_problem_builder.compiled_groups
+        number_of_constraints = len(self.hard_constraints) + len(self.soft_constraints)
+        if self.large_qp_threshold > 0 and number_of_constraints > self.large_qp_threshold:
+            qp_solver_name = self.large_qp_solver_name
+        else:
+            qp_solver_name = self.qp_solver_name
         self.qp_problem_builder = QProblemBuilder(self.joint_constraints,
                                                   self.hard_constraints,
                                                   self.soft_constraints,
                                                   self.joint_to_symbols_str.values(),
-                                                  path_to_functions)
+                                                  self.path_to_functions,
+                                                  self.sparse,
+                                                  qp_solver_name,
+                                                  compiled_groups,
+                                                  self.compiler)
+        if self.path_to_functions:
+            w.evict_compiled_functions(self.path_to_functions, self.cache_max_size, self.cache_max_age)
 
     def get_cmd(self, substitutions, nWSR=None):
         """
@@ -1,5 +1,7 @@
+import hashlib
 import numpy as np
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
 from itertools import chain
 
 import urdf_parser_py.urdf as up
@@ -9,6 +11,7 @@ from tf.transformations import euler_from_quaternion, quaternion_from_euler, rot
 from visualization_msgs.msg import Marker
 
 from giskardpy.exceptions import DuplicateNameException, UnknownBodyException, CorruptShapeException
+from giskardpy.kinematic_tree import KinematicTreeIndex
 from giskardpy.utils import cube_volume, cube_surface, sphere_volume, cylinder_volume, cylinder_surface, \
     suppress_stderr, msg_to_list, KeyDefaultDict, memoize
 
@@ -31,6 +34,32 @@ def hacky_urdf_parser_fix(urdf_str):
     return fixed_urdf
 
 
+# urdf -> (urdf after hacky_urdf_parser_fix, parsed model), see parse_urdf
+_parsed_urdfs = OrderedDict()
+PARSED_URDF_CACHE_SIZE = 20
+
+
+def parse_urdf(urdf):
+    """
+    The parsed models are cached, because the same urdfs are parsed over and over again, e.g. when objects are added to
+    the world or loaded into pybullet. If the cache is full, the least recently used model is removed.
+    :type urdf: str
+    :return: urdf after hacky_urdf_parser_fix, a copy of the parsed model that may be modified
+    :rtype: (str, up.Robot)
+    """
+    if urdf in _parsed_urdfs:
+        # move it to the end, such that the least recently used urdf is always the first one
+        _parsed_urdfs[urdf] = _parsed_urdfs.pop(urdf)
+    else:
+        fixed_urdf = hacky_urdf_parser_fix(urdf)
+        with suppress_stderr():
+            _parsed_urdfs[urdf] = fixed_urdf, up.URDF.from_xml_string(fixed_urdf)
+        if len(_parsed_urdfs) > PARSED_URDF_CACHE_SIZE:
+            _parsed_urdfs.popitem(last=False)
+    fixed_urdf, urdf_robot = _parsed_urdfs[urdf]
+    return fixed_urdf, deepcopy(urdf_robot)
+
+
 FIXED_JOINT = u'fixed'
 REVOLUTE_JOINT = u'revolute'
 CONTINUOUS_JOINT = u'continuous'
@@ -52,9 +81,10 @@ class URDFObject(object):
         :param default_joint_vel_limit: all velocity limits which are undefined or higher than this will be set to this
         :type default_joint_vel_limit: Symbol
         """
-        self.original_urdf = hacky_urdf_parser_fix(urdf)
-        with suppress_stderr():
-            self._urdf_robot = up.URDF.from_xml_string(self.original_urdf)  # type: up.Robot
+        self.original_urdf, self._urdf_robot = parse_urdf(urdf)  # type: str, up.Robot
+        self._urdf_str = None  # see get_urdf_str
+        self._element_hashes = None  # (u'joint' or u'link', name) -> md5 of the element, see get_urdf_hash
+        self._elements_hash = 0
         self._link_to_marker = {}
         self.reset_cache()
 
@@ -179,6 +209,7 @@ class URDFObject(object):
 
     def set_name(self, name):
         self._urdf_robot.name = name
+        self._urdf_str = None
         self.reinitialize()
 
     def get_urdf_robot(self):
@@ -193,23 +224,26 @@ class URDFObject(object):
         """
         return self._urdf_robot.joint_map.keys()
 
+    @memoize
+    def get_tree_index(self):
+        """
+        Is rebuilt after each reinitialize.
+        :rtype: KinematicTreeIndex
+        """
+        fixed_joints = {joint_name for joint_name in self.get_joint_names() if self.is_joint_fixed(joint_name)}
+        return KinematicTreeIndex(self.get_root(), self._urdf_robot.child_map, fixed_joints)
+
     @memoize
     def get_split_chain(self, root, tip, joints=True, links=True, fixed=True):
         if root == tip:
             return [], [], []
-        root_chain = self._urdf_robot.get_chain(self.get_root(), root, False, True, True)
-        tip_chain = self._urdf_robot.get_chain(self.get_root(), tip, False, True, True)
-        for i in range(min(len(root_chain), len(tip_chain))):
-            if root_chain[i] != tip_chain[i]:
-                break
-        else:
-            i += 1
-        connection = tip_chain[i - 1]
-        root_chain = self._urdf_robot.get_chain(connection, root, joints, links, fixed)
+        index = self.get_tree_index()
+        connection = index.get_lca(root, tip)
+        root_chain = index.get_chain_from_ancestor(connection, root, joints, links, fixed)
         if links:
             root_chain = root_chain[1:]
         root_chain.reverse()
-        tip_chain = self._urdf_robot.get_chain(connection, tip, joints, links, fixed)
+        tip_chain = index.get_chain_from_ancestor(connection, tip, joints, links, fixed)
         if links:
             tip_chain = tip_chain[1:]
         return root_chain, [connection] if links else [], tip_chain
@@ -231,7 +265,7 @@ class URDFObject(object):
 
     @memoize
     def get_connecting_link(self, link1, link2):
-        return self.get_split_chain(link1, link2, joints=False)[1][0]
+        return self.get_tree_index().get_lca(link1, link2)
 
     @memoize
     def get_joint_names_from_chain(self, root_link, tip_link):
@@ -402,7 +436,7 @@ class URDFObject(object):
         :return: list of all links in chain excluding root_link, including tip_link
         :rtype: list
         """
-        return self._urdf_robot.get_chain(root_link, tip_link, False, True, False)
+        return self.get_tree_index().get_chain_from_ancestor(root_link, tip_link, False, True, False)
 
     def get_link_names_from_joint_chain(self, root_joint, tip_joint):
         links1 = self.get_chain(self.get_parent_link_of_joint(root_joint), self.get_child_link_of_joint(tip_joint))
@@ -501,7 +535,39 @@ class URDFObject(object):
         return False
 
     def get_urdf_str(self):
-        return self._urdf_robot.to_xml_string()
+        """
+        The model is only serialized again, after it was changed.
+        :rtype: str
+        """
+        if self._urdf_str is None:
+            self._urdf_str = self._urdf_robot.to_xml_string()
+        return self._urdf_str
+
+    def get_urdf_hash(self):
+        """
+        Use this instead of hashing get_urdf_str. It combines the md5s of all joints and links, which are updated
+        incrementally when objects are attached or detached, such that the whole model is never serialized.
+        :return: md5 of the name, joints and links of the model
+        :rtype: str
+        """
+        if self._element_hashes is None:
+            self._element_hashes = {}
+            self._elements_hash = 0
+            self._add_element_hashes(self._urdf_robot.joints, self._urdf_robot.links)
+        return hashlib.md5(u'{}{:032x}'.format(self.get_name(), self._elements_hash).encode(u'utf-8')).hexdigest()
+
+    def _add_element_hashes(self, joints, links):
+        for kind, elements in ((u'joint', joints), (u'link', links)):
+            for element in elements:
+                element_hash = int(hashlib.md5(element.to_xml_string()).hexdigest(), 16)
+                self._element_hashes[kind, element.name] = element_hash
+                # xor, such that the order of the elements doesn't matter and they can be removed again
+                self._elements_hash ^= element_hash
+
+    def _remove_element_hashes(self, joint_names, link_names):
+        for kind, names in ((u'joint', joint_names), (u'link', link_names)):
+            for name in names:
+                self._elements_hash ^= self._element_hashes.pop((kind, name))
 
     @memoize
     def get_root(self):
@@ -587,16 +653,31 @@ class URDFObject(object):
                          child=urdf_object.get_root(),
                          joint_type=FIXED_JOINT,
                          origin=origin)
+        # add_joint and add_link also update the parent, child, joint and link maps of the model
         self._urdf_robot.add_joint(joint)
         for j in urdf_object._urdf_robot.joints:
-            self._urdf_robot.add_joint(j)
+            self._urdf_robot.add_joint(deepcopy(j))
         for l in urdf_object._urdf_robot.links:
-            self._urdf_robot.add_link(l)
+            self._urdf_robot.add_link(deepcopy(l))
         try:
             del self._link_to_marker[urdf_object.get_name()]
         except:
             pass
-        self.reinitialize()
+        self.update_after_attach(urdf_object, parent_link)
+
+    def update_after_attach(self, urdf_object, parent_link):
+        """
+        Is called after the links and joints of urdf_object were added to the model. Unlike reinitialize, subclasses
+        only have to extend their data structures by the new links.
+        :type urdf_object: URDFObject
+        :type parent_link: str
+        """
+        self.reset_cache()
+        self._urdf_str = None
+        if self._element_hashes is not None:
+            joint_names = [self.robot_name_to_root_joint(urdf_object.get_name())] + list(urdf_object.get_joint_names())
+            self._add_element_hashes([self.get_urdf_joint(joint_name) for joint_name in joint_names],
+                                     [self.get_urdf_link(link_name) for link_name in urdf_object.get_link_names()])
 
     @memoize
     def get_joint_origin(self, joint_name):
@@ -616,25 +697,54 @@ class URDFObject(object):
             sub_tree = self.get_sub_tree_at_joint(joint_name)
         except KeyError:
             raise KeyError(u'can\'t detach at unknown joint: {}'.format(joint_name))
+        parent_link = self.get_parent_link_of_joint(joint_name)
         for link in sub_tree.get_link_names():
             self._urdf_robot.remove_aggregate(self.get_urdf_link(link))
         for joint in chain([joint_name], sub_tree.get_joint_names()):
             self._urdf_robot.remove_aggregate(self.get_urdf_joint(joint))
-        self.reinitialize()
+        # remove_aggregate doesn't update the maps of the model
+        child_joints = self._urdf_robot.child_map.get(parent_link, [])
+        child_joints[:] = [(j, l) for j, l in child_joints if j != joint_name]
+        if not child_joints:
+            self._urdf_robot.child_map.pop(parent_link, None)
+        for link in sub_tree.get_link_names():
+            self._urdf_robot.link_map.pop(link, None)
+            self._urdf_robot.parent_map.pop(link, None)
+            self._urdf_robot.child_map.pop(link, None)
+        for joint in chain([joint_name], sub_tree.get_joint_names()):
+            self._urdf_robot.joint_map.pop(joint, None)
+        self.update_after_detach(sub_tree, joint_name)
         return sub_tree
 
+    def update_after_detach(self, sub_tree, joint_name):
+        """
+        Is called after sub_tree was removed from the model, see update_after_attach.
+        :type sub_tree: URDFObject
+        :param joint_name: joint that connected sub_tree to this object
+        :type joint_name: str
+        """
+        self.reset_cache()
+        self._urdf_str = None
+        if self._element_hashes is not None:
+            self._remove_element_hashes([joint_name] + list(sub_tree.get_joint_names()), sub_tree.get_link_names())
+
     def reset(self):
         """
         Detaches all object that have been attached to the robot.
         """
-        self._urdf_robot = up.URDF.from_xml_string(self.original_urdf)
+        self._urdf_robot = parse_urdf(self.original_urdf)[1]
+        self._urdf_str = None
+        self._element_hashes = None
         self.reinitialize()
 
     def __str__(self):
         return self.get_urdf_str()
 
     def reinitialize(self):
-        self._urdf_robot = up.URDF.from_xml_string(self.get_urdf_str())
+        """
+        Clears all caches that depend on the model. The model itself is kept, it has to be changed with the methods of
+        this class, which keep its maps up to date.
+        """
         self.reset_cache()
 
     def robot_name_to_root_joint(self, name):
@@ -682,8 +792,7 @@ class URDFObject(object):
 
     @memoize
     def are_linked(self, link_a, link_b):
-        return link_a == self.get_parent_link_of_link(link_b) or \
-               (link_b == self.get_parent_link_of_link(link_a))
+        return self.get_tree_index().are_linked(link_a, link_b)
 
     @memoize
     def get_movable_joints(self):
@@ -694,7 +803,7 @@ class URDFObject(object):
         :type o: URDFObject
         :rtype: bool
         """
-        return o.get_urdf_str() == self.get_urdf_str()
+        return o.get_urdf_hash() == self.get_urdf_hash()
 
     @memoize
     def has_link_visuals(self, link_name):
@@ -847,6 +847,12 @@ def traj_to_msg(sample_period, trajectory, controlled_joints, fill_velocity_valu
     return trajectory_msg
 
 def make_filter_b_mask(H):
+    """
+    :param H: weight matrix or a vector of its diagonal
+    :type H: np.ndarray
+    """
+    if H.ndim == 1:
+        return H != 0
     return H.sum(axis=1) != 0
 
 def make_filter_masks(H, num_joint_constraints, num_hard_constraints):
@@ -1,11 +1,13 @@
+import numpy as np
 from geometry_msgs.msg import PoseStamped
 from giskard_msgs.msg import CollisionEntry
 
-from giskardpy import logging
+from giskardpy import logging, capsule_collision as cc
 from giskardpy.exceptions import RobotExistsException, DuplicateNameException, PhysicsWorldException, \
     UnknownBodyException, UnsupportedOptionException
 from giskardpy.robot import Robot
-from giskardpy.tfwrapper import msg_to_kdl, kdl_to_pose
+from giskardpy.signed_distance_field import get_signed_distance_field, get_state_key
+from giskardpy.tfwrapper import msg_to_kdl, kdl_to_pose, kdl_to_np
 from giskardpy.urdf_object import URDFObject
 from giskardpy.world_object import WorldObject
 
@@ -17,6 +19,8 @@ class World(object):
         if path_to_data_folder is None:
             path_to_data_folder = u''
         self._path_to_data_folder = path_to_data_folder
+        self._signed_distance_field_settings = None
+        self._signed_distance_fields = {}  # object name -> (state key, SignedDistanceField)
 
     # General ----------------------------------------------------------------------------------------------------------
 
@@ -38,6 +42,95 @@ class World(object):
     def check_collisions(self, cut_off_distances, collision_list_size=20):
         pass
 
+    # Signed distance fields -------------------------------------------------------------------------------------------
+
+    def enable_signed_distance_fields(self, resolution, padding, cache_folder):
+        """
+        Objects are baked into signed distance fields, when they are added, and external collisions with them are
+        looked up in the fields instead of being computed by check_collisions.
+        Fields are in the frame of their object, moving an object doesn't require a new field, changing its joint state
+        does.
+        :param resolution: edge length of a voxel
+        :type resolution: float
+        :param padding: how far the fields extend beyond their objects, entries whose cut off distance * 1.1 is larger
+                        are still checked by check_collisions
+        :type padding: float
+        :param cache_folder: fields are saved here and reused for objects with the same urdf and joint state
+        :type cache_folder: str
+        """
+        self._signed_distance_field_settings = resolution, padding, cache_folder
+        for name in self.get_object_names():
+            self.get_signed_distance_field(name)
+
+    def get_signed_distance_field(self, name):
+        """
+        :return: the signed distance field of object name for its current joint state
+        :rtype: giskardpy.signed_distance_field.SignedDistanceField
+        """
+        world_object = self.get_object(name)
+        state_key = get_state_key(world_object)
+        if name not in self._signed_distance_fields or self._signed_distance_fields[name][0] != state_key:
+            resolution, padding, cache_folder = self._signed_distance_field_settings
+            self._signed_distance_fields[name] = state_key, get_signed_distance_field(world_object, resolution,
+                                                                                      padding, cache_folder)
+        return self._signed_distance_fields[name][1]
+
+    def check_signed_distance_field_collisions(self, collisions, cut_off_distances, distance_lower_bounds=None):
+        """
+        Adds the contacts of all entries of cut_off_distances, that can be answered by signed distance fields, to
+        collisions. The robot links are represented by the capsules of capsule_collision.
+        Fields only reach padding beyond their objects, entries with larger cut off distances can't be answered.
+        :type collisions: giskardpy.data_types.Collisions
+        :param cut_off_distances: (robot_link, body_b, link_b) -> cut off distance
+        :type cut_off_distances: dict
+        :type distance_lower_bounds: dict
+        :return: the entries of cut_off_distances that still have to be checked
+        :rtype: dict
+        """
+        if self._signed_distance_field_settings is None:
+            return cut_off_distances
+        robot_name = self.robot.get_name()
+        padding = self._signed_distance_field_settings[1]
+        rest = {}
+        entries = {}  # body b -> robot link -> cut off distance
+        for (robot_link, body_b, link_b), distance in cut_off_distances.items():
+            if body_b == robot_name or link_b != CollisionEntry.ALL or distance * 1.1 > padding:
+                rest[robot_link, body_b, link_b] = distance
+            else:
+                entries.setdefault(body_b, {})[robot_link] = distance
+        if not entries:
+            return rest
+
+        map_T_root = np.linalg.inv(kdl_to_np(self.robot.root_T_map))
+        root_T_links = self.robot.get_root_T_links()
+        robot_links = sorted({robot_link for robot_link_distances in entries.values()
+                              for robot_link in robot_link_distances})
+        capsules = []
+        capsule_groups = []
+        for i, robot_link in enumerate(robot_links):
+            link_capsules = self.robot.get_link_capsules(robot_link)
+            capsules.append(cc.transform_capsules(np.dot(map_T_root, root_T_links[robot_link]), link_capsules))
+            capsule_groups.append(np.full(len(link_capsules), i, dtype=int))
+        capsules = np.concatenate(capsules)
+        capsule_groups = np.concatenate(capsule_groups)
+
+        for body_b, robot_link_distances in entries.items():
+            sdf = self.get_signed_distance_field(body_b)
+            map_T_object = np.linalg.inv(kdl_to_np(self.get_object(body_b).root_T_map))
+            groups = [robot_links.index(robot_link) for robot_link in robot_link_distances]
+            mask = np.in1d(capsule_groups, groups)
+            contacts, lower_bounds = sdf.get_contacts(map_T_object, capsules[mask], capsule_groups[mask],
+                                                      len(robot_links))
+            for group, link_index, position_on_a, position_on_b, contact_normal, contact_distance in zip(*contacts):
+                robot_link = robot_links[group]
+                if contact_distance < robot_link_distances[robot_link] * 1.1:
+                    collisions.add_contact(robot_link, body_b, sdf.link_names[link_index], position_on_a,
+                                           position_on_b, contact_normal, contact_distance)
+            if distance_lower_bounds is not None:
+                for group in groups:
+                    distance_lower_bounds[robot_links[group], body_b, CollisionEntry.ALL] = lower_bounds[group]
+        return rest
+
     # Objects ----------------------------------------------------------------------------------------------------------
 
     def add_object(self, object_):
@@ -49,8 +142,15 @@ class World(object):
             raise DuplicateNameException(u'object and robot have the same name')
         if self.has_object(object_.get_name()):
             raise DuplicateNameException(u'object with that name already exists')
+        if self.has_robot() and isinstance(object_, WorldObject):
+            # the meshes of objects are covered by the same spheres as those of the robot
+            object_.set_collision_geometry(object_.collision_geometry_fidelity,
+                                           self.robot.collision_geometry_folder,
+                                           self.robot.number_of_spheres)
         self._objects[object_.get_name()] = object_
         logging.loginfo(u'--> added {} to world'.format(object_.get_name()))
+        if self._signed_distance_field_settings is not None and object_.get_name() in self.get_object_names():
+            self.get_signed_distance_field(object_.get_name())
 
     def set_object_pose(self, name, pose):
         """
@@ -96,6 +196,7 @@ class World(object):
             self._objects[name].suicide()
             logging.loginfo(u'<-- removed object {} from world'.format(name))
             del (self._objects[name])
+            self._signed_distance_fields.pop(name, None)
         else:
             raise UnknownBodyException(u'can\'t remove object \'{}\', because it doesn\' exist'.format(name))
 
@@ -105,6 +206,7 @@ class World(object):
             self._objects[object_name].suicide()
             logging.loginfo(u'<-- removed object {} from world'.format(object_name))
         self._objects = {}
+        self._signed_distance_fields = {}
 
     # Robot ------------------------------------------------------------------------------------------------------------
 
@@ -1,5 +1,4 @@
 import errno
-import hashlib
 import numpy as np
 import os
 import pickle
@@ -7,17 +6,24 @@ from itertools import product, combinations
 from time import time
 
 from geometry_msgs.msg import Pose, Quaternion
-from tf.transformations import euler_from_quaternion, rotation_from_matrix, quaternion_matrix
+from tf.transformations import euler_from_quaternion, rotation_from_matrix, quaternion_matrix, euler_matrix, \
+    rotation_matrix
 
-from giskardpy import logging
+from giskardpy import logging, capsule_collision as cc
+from giskardpy.collision_geometry import ORIGINAL
 from giskardpy.data_types import SingleJointState
 from giskardpy.tfwrapper import msg_to_kdl
 from giskardpy.urdf_object import URDFObject
+from giskardpy.utils import memoize
 
 
 class WorldObject(URDFObject):
     def __init__(self, urdf, base_pose=None, controlled_joints=None, path_to_data_folder=u'',
                  calc_self_collision_matrix=True, ignored_pairs=None, added_pairs=None, *args, **kwargs):
+        self._link_capsules = None
+        self.collision_geometry_fidelity = ORIGINAL
+        self.collision_geometry_folder = path_to_data_folder + u'collision_geometry/'
+        self.number_of_spheres = 8
         super(WorldObject, self).__init__(urdf, *args, **kwargs)
         self.path_to_data_folder = path_to_data_folder + u'collision_matrix/'
         self.controlled_joints = controlled_joints
@@ -88,8 +94,20 @@ class WorldObject(URDFObject):
 
     def reinitialize(self):
         self._controlled_links = None
+        self._link_capsules = None
         super(WorldObject, self).reinitialize()
 
+    def update_after_attach(self, urdf_object, parent_link):
+        super(WorldObject, self).update_after_attach(urdf_object, parent_link)
+        self._controlled_links = None
+
+    def update_after_detach(self, sub_tree, joint_name):
+        super(WorldObject, self).update_after_detach(sub_tree, joint_name)
+        self._controlled_links = None
+        if self._link_capsules is not None:
+            for link_name in sub_tree.get_link_names():
+                self._link_capsules.pop(link_name, None)
+
     def get_controlled_links(self):
         # FIXME expensive
         if not self._controlled_links:
@@ -98,13 +116,110 @@ class WorldObject(URDFObject):
                 self._controlled_links.update(self.get_sub_tree_link_names_with_collision(joint_name))
         return self._controlled_links
 
+    @memoize
+    def get_joint_origin_np(self, joint_name):
+        """
+        :rtype: np.ndarray
+        """
+        origin = self.get_urdf_joint(joint_name).origin
+        if origin is None:
+            return np.eye(4)
+        parent_T_joint = euler_matrix(*(origin.rpy if origin.rpy is not None else [0, 0, 0]))
+        if origin.xyz is not None:
+            parent_T_joint[:3, 3] = origin.xyz
+        return parent_T_joint
+
+    def get_joint_position(self, joint_name):
+        """
+        :rtype: float
+        """
+        if self.is_joint_mimic(joint_name):
+            return self.get_joint_position(self.get_mimiced_joint_name(joint_name)) * \
+                   self.get_mimic_multiplier(joint_name) + self.get_mimic_offset(joint_name)
+        if joint_name in self.joint_state:
+            return self.joint_state[joint_name].position
+        return 0
+
+    def get_joint_transform(self, joint_name):
+        """
+        :return: parent_link_T_child_link for the current joint state
+        :rtype: np.ndarray
+        """
+        parent_T_child = self.get_joint_origin_np(joint_name)
+        if self.is_joint_movable(joint_name) or self.is_joint_mimic(joint_name):
+            axis = self.get_joint_axis(joint_name)
+            if axis is None:
+                axis = [1, 0, 0]
+            position = self.get_joint_position(joint_name)
+            if self.is_joint_rotational(joint_name):
+                parent_T_child = np.dot(parent_T_child, rotation_matrix(position, axis))
+            elif self.is_joint_prismatic(joint_name):
+                joint_T_child = np.eye(4)
+                joint_T_child[:3, 3] = np.array(axis) * position
+                parent_T_child = np.dot(parent_T_child, joint_T_child)
+        return parent_T_child
+
+    def get_root_T_links(self):
+        """
+        Computes the poses of all links for the current joint state in one pass over the kinematic tree.
+        :return: link name -> root_T_link
+        :rtype: dict
+        """
+        root = self.get_root()
+        root_T_links = {root: np.eye(4)}
+        links = [root]
+        while links:
+            link_name = links.pop()
+            for joint_name in self.get_child_joints_of_link(link_name) or []:
+                child_link = self.get_child_link_of_joint(joint_name)
+                root_T_links[child_link] = np.dot(root_T_links[link_name], self.get_joint_transform(joint_name))
+                links.append(child_link)
+        return root_T_links
+
+    def set_collision_geometry(self, fidelity, cache_folder, number_of_spheres=8):
+        """
+        :param fidelity: original, convex_hull or spheres, see collision_geometry
+        :type fidelity: str
+        :param cache_folder: where the simplified meshes and the spheres of the capsules are saved
+        :type cache_folder: str
+        :param number_of_spheres: maximum number of spheres per mesh, used for fidelity spheres and for the capsules
+        :type number_of_spheres: int
+        """
+        self.collision_geometry_fidelity = fidelity
+        self.collision_geometry_folder = cache_folder
+        self.number_of_spheres = number_of_spheres
+        self._link_capsules = None
+
+    def get_link_capsules(self, link_name):
+        """
+        :return: capsules of the collision geometry of the link in its own frame, see capsule_collision
+        :rtype: np.ndarray
+        """
+        if self._link_capsules is None:
+            self._link_capsules = {}
+        if link_name not in self._link_capsules:
+            capsules = []
+            if link_name in self._urdf_robot.link_map and self.has_link_collision(link_name):
+                link = self.get_urdf_link(link_name)
+                collisions = getattr(link, u'collisions', None)
+                if collisions is None:
+                    collisions = [link.collision] if link.collision is not None else []
+                capsules = [cc.collision_to_capsules(collision, self.number_of_spheres, self.collision_geometry_folder)
+                            for collision in collisions]
+            if capsules:
+                self._link_capsules[link_name] = np.concatenate(capsules)
+            else:
+                self._link_capsules[link_name] = np.zeros((0, cc.CAPSULE_WIDTH))
+        return self._link_capsules[link_name]
+
     def get_self_collision_matrix(self):
         """
         :return: A list of link pairs for which we have to calculate self collisions
         """
         return self._self_collision_matrix
 
-    def calc_collision_matrix(self, link_combinations=None, d=0.05, d2=0.0, num_rnd_tries=2000):
+    def calc_collision_matrix(self, link_combinations=None, d=0.05, d2=0.0, num_rnd_tries=2000,
+                              num_rnd_tries_without_change=500, batch_size=100):
         """
         :param link_combinations: set with link name tuples
         :type link_combinations: set
@@ -114,10 +229,13 @@ class WorldObject(URDFObject):
         :type d2: float
         :param num_rnd_tries:
         :type num_rnd_tries: int
+        :param num_rnd_tries_without_change: stop sampling once that many random joint states found no new pairs
+        :type num_rnd_tries_without_change: int
+        :param batch_size: number of random joint states that are checked at once
+        :type batch_size: int
         :return: set of link name tuples which are sometimes in collision.
         :rtype: set
         """
-        # TODO computational expansive because of too many collision checks
         logging.loginfo(u'calculating self collision matrix')
         t = time()
         np.random.seed(1337)
@@ -141,12 +259,18 @@ class WorldObject(URDFObject):
         sometimes2 = self.check_collisions(rest, d2)
         rest = rest.difference(sometimes2)
         sometimes = sometimes.union(sometimes2)
-        for i in range(num_rnd_tries):
-            self.joint_state = self.get_rnd_joint_state()
-            sometimes2 = self.check_collisions(rest, d2)
+        tries_without_change = 0
+        for i in range(0, num_rnd_tries, batch_size):
+            if not rest or tries_without_change >= num_rnd_tries_without_change:
+                break
+            joint_states = [self.get_rnd_joint_state() for _ in range(min(batch_size, num_rnd_tries - i))]
+            sometimes2 = self.check_collisions_in_joint_states(rest, d2, joint_states)
             if len(sometimes2) > 0:
                 rest = rest.difference(sometimes2)
                 sometimes = sometimes.union(sometimes2)
+                tries_without_change = 0
+            else:
+                tries_without_change += len(joint_states)
         sometimes = sometimes.union(self.added_pairs)
         logging.loginfo(u'calculated self collision matrix in {:.3f}s'.format(time() - t))
         return sometimes
@@ -168,6 +292,23 @@ class WorldObject(URDFObject):
                 in_collision.add((link_a, link_b))
         return in_collision
 
+    def check_collisions_in_joint_states(self, link_combinations, distance, joint_states):
+        """
+        :type link_combinations: set
+        :type distance: float
+        :type joint_states: list
+        :return: link name tuples that are in collision in at least one of the joint states
+        :rtype: set
+        """
+        rest = set(link_combinations)
+        in_collision = set()
+        for joint_state in joint_states:
+            self.joint_state = joint_state
+            found = self.check_collisions(rest, distance)
+            rest.difference_update(found)
+            in_collision.update(found)
+        return in_collision
+
     def in_collision(self, link_a, link_b, distance):
         return self.are_linked(link_a, link_b)
 
@@ -245,7 +386,7 @@ class WorldObject(URDFObject):
         """
         :rtype: bool
         """
-        urdf_hash = hashlib.md5(self.get_urdf_str()).hexdigest()
+        urdf_hash = self.get_urdf_hash()
         path = u'{}/{}/{}'.format(path, self.get_name(), urdf_hash)
         if os.path.isfile(path):
             with open(path) as f:
@@ -255,7 +396,7 @@ class WorldObject(URDFObject):
         return False
 
     def safe_self_collision_matrix(self, path):
-        urdf_hash = hashlib.md5(self.get_urdf_str()).hexdigest()
+        urdf_hash = self.get_urdf_hash()
         path = u'{}/{}/{}'.format(path, self.get_name(), urdf_hash)
         if not os.path.exists(os.path.dirname(path)):
             try:
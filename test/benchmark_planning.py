@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+Runs the plugins of 'planning III' for random joint goals without a ros master and reports how long each plugin took
+per tick, how long the controller needed to compile, the size of the qp and how many ticks it took until planning
+stopped. The results are written as json and can be compared with the results of a previous run to find regressions:
+
+    python benchmark_planning.py -o new.json -c old.json --threshold 0.2
+
+The exit code is 1, if a regression was found.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict, defaultdict
+from time import time
+
+import numpy as np
+import yaml
+from giskard_msgs.msg import MoveCmd, Constraint
+from py_trees import Blackboard, Status
+
+import giskardpy.identifier as identifier
+import giskardpy.pybullet_wrapper as pbw
+from giskardpy import logging
+from giskardpy.data_types import SingleJointState, Trajectory
+from giskardpy.garden import load_params, initialize_world
+from giskardpy.god_map import GodMap
+from giskardpy.plugin_collision_checker import CollisionChecker
+from giskardpy.plugin_goal_reached import GoalReachedPlugin
+from giskardpy.plugin_instantaneous_controller import ControllerPlugin
+from giskardpy.plugin_interrupts import WiggleCancel
+from giskardpy.plugin_kinematic_sim import KinSimPlugin
+from giskardpy.plugin_log_trajectory import LogTrajPlugin
+from giskardpy.plugin_loop_detector import LoopDetector
+from giskardpy.plugin_time import TimePlugin
+from giskardpy.plugin_update_constraints import GoalToConstraints
+from giskardpy.urdf_object import URDFObject
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+PATH_TO_CONFIG = os.path.join(PATH, u'..', u'config')
+PATH_TO_URDFS = os.path.join(PATH, u'urdfs')
+
+# robot name -> (config file, urdf file)
+ROBOTS = OrderedDict([(u'pr2', (os.path.join(PATH_TO_CONFIG, u'pr2.yaml'),
+                                os.path.join(PATH_TO_URDFS, u'pr2_with_base.urdf'))),
+                      (u'donbot', (os.path.join(PATH_TO_CONFIG, u'donbot.yaml'),
+                                   os.path.join(PATH_TO_URDFS, u'iai_donbot.urdf'))),
+                      (u'boxy', (os.path.join(PATH_TO_CONFIG, u'boxy.yaml'),
+                                 os.path.join(PATH_TO_URDFS, u'boxy.urdf')))])
+
+CONTROLLER = u'controller'
+GOAL_REACHED = u'goal reached'
+
+# bigger is worse for all of them
+SUMMARY_METRICS = [u'compile_time', u'us_per_tick', u'ticks_to_convergence']
+
+
+def load_robot(config_file, urdf_file, path_to_data_folder, function_cache=False):
+    """
+    Fills a new god map with what giskard usually gets from the parameter server and the controller state topic.
+    Every movable joint of the urdf is controlled. Pybullet has to be running.
+    :type config_file: str
+    :type urdf_file: str
+    :type path_to_data_folder: str
+    :param function_cache: if False, the controller is compiled for every goal
+    :type function_cache: bool
+    :rtype: GodMap
+    """
+    with open(config_file) as f:
+        params = yaml.load(f)
+    with open(urdf_file) as f:
+        urdf = f.read()
+    params[u'path_to_data_folder'] = path_to_data_folder
+    params[u'enable_gui'] = False
+    params[u'function_cache'][u'enabled'] = function_cache
+    god_map = GodMap()
+    Blackboard.god_map = god_map
+    load_params(god_map, params, urdf)
+    initialize_world(god_map, URDFObject(urdf).get_movable_joints())
+    return god_map
+
+
+def make_planning_plugins():
+    """
+    Same plugins and order as 'planning III' in garden.grow_tree.
+    :rtype: OrderedDict
+    """
+    plugins = OrderedDict()
+    for plugin in [CollisionChecker(u'coll'),
+                   ControllerPlugin(CONTROLLER),
+                   KinSimPlugin(u'kin sim'),
+                   LogTrajPlugin(u'log'),
+                   WiggleCancel(u'wiggle'),
+                   LoopDetector(u'loop detector'),
+                   GoalReachedPlugin(GOAL_REACHED),
+                   TimePlugin(u'time')]:
+        plugins[plugin.name] = plugin
+    return plugins
+
+
+def start_joint_state(robot):
+    """
+    :return: zero joint state, clipped to the joint limits
+    :rtype: OrderedDict
+    """
+    js = OrderedDict()
+    for joint_name in robot.controlled_joints:
+        lower, upper = robot.get_joint_limits(joint_name)
+        position = 0.
+        if lower is not None:
+            position = max(position, lower)
+        if upper is not None:
+            position = min(position, upper)
+        js[joint_name] = SingleJointState(joint_name, position)
+    return js
+
+
+def random_joint_goal(robot, rng):
+    """
+    Samples a joint goal for every controlled joint, that stays 10% away from the joint limits.
+    :type rng: np.random.RandomState
+    :return: JointState as dict
+    :rtype: dict
+    """
+    names = []
+    positions = []
+    for joint_name in robot.controlled_joints:
+        lower, upper = robot.get_joint_limits(joint_name)
+        if lower is None:
+            lower = -1.
+        if upper is None:
+            upper = 1.
+        names.append(joint_name)
+        positions.append(lower + (upper - lower) * rng.uniform(0.1, 0.9))
+    return {u'name': names,
+            u'position': positions}
+
+
+def set_goal(god_map, goal):
+    """
+    Does what CleanUp and GoalToConstraints do, when a new goal arrives.
+    :type god_map: GodMap
+    :param goal: JointState as dict
+    :type goal: dict
+    """
+    god_map.clear_cache()
+    god_map.set_data(identifier.closest_point, {})
+    god_map.set_data(identifier.time, 1)
+    trajectory = Trajectory()
+    trajectory.set(0, god_map.get_data(identifier.joint_states))
+    god_map.set_data(identifier.trajectory, trajectory)
+    god_map.set_data(identifier.check_reachability, False)
+
+    constraint = Constraint()
+    constraint.type = u'JointPositionList'
+    constraint.parameter_value_pair = json.dumps({u'goal_state': goal})
+    move_cmd = MoveCmd()
+    move_cmd.constraints.append(constraint)
+    god_map.set_data(identifier.next_move_goal, move_cmd)
+
+    for _ in GoalToConstraints(u'update constraints', u'~command').tick():
+        pass
+    exception = Blackboard().get(u'exception')
+    if exception is not None:
+        raise exception
+
+
+def run_goal(god_map, plugins, max_ticks):
+    """
+    Ticks the plugins like PluginBehavior.loop_over_plugins, until one of them does not return RUNNING anymore.
+    The first tick of each plugin includes its initialise and is therefore reported separately.
+    :type god_map: GodMap
+    :type plugins: OrderedDict
+    :type max_ticks: int
+    :rtype: dict
+    """
+    timings = defaultdict(list)
+    status = Status.RUNNING
+    stopped_by = None
+    ticks = 0
+    while status == Status.RUNNING and ticks < max_ticks:
+        for plugin_name, plugin in plugins.items():
+            t = time()
+            for node in plugin.tick():
+                status = node.status
+            timings[plugin_name].append(time() - t)
+            if status != Status.RUNNING:
+                stopped_by = plugin_name
+                break
+        ticks += 1
+    for plugin in plugins.values():
+        plugin.stop()
+
+    exception = Blackboard().get(u'exception')
+    Blackboard().set(u'exception', None)
+    qp_problem_builder = plugins[CONTROLLER].controller.qp_problem_builder
+    us_per_tick = OrderedDict()
+    first_tick = OrderedDict()
+    for plugin_name, plugin_timings in timings.items():
+        first_tick[plugin_name] = plugin_timings[0]
+        if len(plugin_timings) > 1:
+            us_per_tick[plugin_name] = np.mean(plugin_timings[1:]) * 1e6
+    return OrderedDict([(u'compile_time', timings[CONTROLLER][0]),
+                        (u'us_per_tick', sum(us_per_tick.values())),
+                        (u'ticks_to_convergence', ticks),
+                        (u'converged', stopped_by == GOAL_REACHED and exception is None),
+                        (u'stopped_by', stopped_by),
+                        (u'exception', None if exception is None else u'{}: {}'.format(exception.__class__.__name__,
+                                                                                       exception)),
+                        (u'qp_size', OrderedDict([(u'joint_constraints', qp_problem_builder.j),
+                                                  (u'hard_constraints', qp_problem_builder.h),
+                                                  (u'soft_constraints', qp_problem_builder.s)])),
+                        (u'plugins', us_per_tick),
+                        (u'first_tick', first_tick)])
+
+
+def summarize(goal_results):
+    """
+    :return: the mean of every metric over all goals
+    :rtype: dict
+    """
+    summary = OrderedDict()
+    for metric in SUMMARY_METRICS:
+        summary[metric] = np.mean([result[metric] for result in goal_results])
+    plugins = OrderedDict()
+    for plugin_name in goal_results[0][u'plugins']:
+        plugins[plugin_name] = np.mean([result[u'plugins'][plugin_name] for result in goal_results
+                                        if plugin_name in result[u'plugins']])
+    summary[u'plugins'] = plugins
+    summary[u'converged'] = sum(result[u'converged'] for result in goal_results)
+    return summary
+
+
+def benchmark_robot(config_file, urdf_file, path_to_data_folder, number_of_goals, seed, max_ticks,
+                    function_cache=False):
+    """
+    :rtype: dict
+    """
+    pbw.start_pybullet(False)
+    try:
+        god_map = load_robot(config_file, urdf_file, path_to_data_folder, function_cache)
+        robot = god_map.get_data(identifier.robot)
+        js = start_joint_state(robot)
+        rng = np.random.RandomState(seed)
+        plugins = make_planning_plugins()
+        for plugin in plugins.values():
+            plugin.setup(10.0)
+        goal_results = []
+        for i in range(number_of_goals):
+            god_map.set_data(identifier.joint_states, js)
+            set_goal(god_map, random_joint_goal(robot, rng))
+            result = run_goal(god_map, plugins, max_ticks)
+            logging.loginfo(u'goal {}/{} took {} ticks, {:.1f}us/tick, stopped by {}'.format(
+                i + 1, number_of_goals, result[u'ticks_to_convergence'], result[u'us_per_tick'],
+                result[u'stopped_by']))
+            goal_results.append(result)
+    finally:
+        pbw.stop_pybullet()
+    return OrderedDict([(u'config', config_file),
+                        (u'urdf', urdf_file),
+                        (u'summary', summarize(goal_results)),
+                        (u'goals', goal_results)])
+
+
+def find_regressions(old, new, threshold):
+    """
+    Compares the summaries of robots that are in both results.
+    :param threshold: relative increase, e.g. 0.2 = 20% slower
+    :type threshold: float
+    :return: descriptions of all metrics that got worse than threshold
+    :rtype: list
+    """
+    regressions = []
+    for robot_name, new_result in new[u'robots'].items():
+        if robot_name not in old[u'robots']:
+            continue
+        old_summary = old[u'robots'][robot_name][u'summary']
+        new_summary = new_result[u'summary']
+        metrics = [(metric, old_summary[metric], new_summary[metric]) for metric in SUMMARY_METRICS]
+        metrics.extend((u'{} us_per_tick'.format(plugin_name), old_summary[u'plugins'][plugin_name], value)
+                       for plugin_name, value in new_summary[u'plugins'].items()
+                       if plugin_name in old_summary[u'plugins'])
+        for metric, old_value, new_value in metrics:
+            if old_value > 0 and new_value > old_value * (1 + threshold):
+                regressions.append(u'{} {}: {:.3f} -> {:.3f} (+{:.0f}%)'.format(robot_name, metric,
+                                                                               old_value, new_value,
+                                                                               (new_value / old_value - 1) * 100))
+    return regressions
+
+
+def get_commit():
+    try:
+        return subprocess.check_output([u'git', u'rev-parse', u'HEAD'], cwd=PATH).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(u'-r', u'--robots', nargs=u'+', default=list(ROBOTS.keys()),
+                        help=u'any of {} and names added with --robot'.format(u', '.join(ROBOTS.keys())))
+    parser.add_argument(u'--robot', nargs=3, action=u'append', default=[], metavar=(u'NAME', u'CONFIG', u'URDF'),
+                        help=u'add a robot that is not bundled, e.g. --robot hsr config/hsr.yaml hsr.urdf')
+    parser.add_argument(u'-g', u'--goals', type=int, default=3, help=u'number of random joint goals per robot')
+    parser.add_argument(u'-s', u'--seed', type=int, default=1337)
+    parser.add_argument(u'--max-ticks', type=int, default=1000)
+    parser.add_argument(u'--function-cache', action=u'store_true',
+                        help=u'reuse compiled controllers, compile_time then only measures loading them')
+    parser.add_argument(u'--data-folder', default=None, help=u'default is a temporary folder')
+    parser.add_argument(u'-o', u'--output', default=None, help=u'results are saved as json here')
+    parser.add_argument(u'-c', u'--compare', default=None, help=u'json of a previous run')
+    parser.add_argument(u'-t', u'--threshold', type=float, default=0.2,
+                        help=u'relative increase of a metric, that counts as regression')
+    args = parser.parse_args()
+
+    robots = OrderedDict(ROBOTS)
+    for name, config_file, urdf_file in args.robot:
+        robots[name] = (config_file, urdf_file)
+        if name not in args.robots:
+            args.robots.append(name)
+
+    if args.data_folder is None:
+        path_to_data_folder = tempfile.mkdtemp()
+    else:
+        path_to_data_folder = args.data_folder
+    results = OrderedDict([(u'commit', get_commit()),
+                           (u'goals', args.goals),
+                           (u'seed', args.seed),
+                           (u'max_ticks', args.max_ticks),
+                           (u'function_cache', args.function_cache),
+                           (u'robots', OrderedDict())])
+    try:
+        for robot_name in args.robots:
+            config_file, urdf_file = robots[robot_name]
+            logging.loginfo(u'benchmarking {}'.format(robot_name))
+            results[u'robots'][robot_name] = benchmark_robot(config_file, urdf_file,
+                                                             os.path.join(path_to_data_folder, robot_name),
+                                                             args.goals, args.seed, args.max_ticks,
+                                                             args.function_cache)
+    finally:
+        if args.data_folder is None:
+            shutil.rmtree(path_to_data_folder, ignore_errors=True)
+
+    for robot_name, result in results[u'robots'].items():
+        summary = result[u'summary']
+        print(u'{}: compile {:.3f}s, {:.1f}us/tick, {:.1f} ticks, {}/{} converged'.format(
+            robot_name, summary[u'compile_time'], summary[u'us_per_tick'], summary[u'ticks_to_convergence'],
+            summary[u'converged'], args.goals))
+        for plugin_name, us in summary[u'plugins'].items():
+            print(u'    {}: {:.1f}us/tick'.format(plugin_name, us))
+
+    if args.output is not None:
+        with open(args.output, u'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old_results = json.load(f)
+        regressions = find_regressions(old_results, results, args.threshold)
+        for regression in regressions:
+            logging.logwarn(u'regression: {}'.format(regression))
+        if regressions:
+            exit(1)
+        print(u'no regressions above {:.0f}% compared to {}'.format(args.threshold * 100, args.compare))
+
+
+if __name__ == u'__main__':
+    main()
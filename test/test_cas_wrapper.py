@@ -1,4 +1,7 @@
+import os
+import shutil
 import unittest
+from time import time
 
 import PyKDL
 import hypothesis.strategies as st
@@ -613,4 +616,96 @@ class TestCASWrapper(unittest.TestCase):
         end = np.array([0,0,1])
         distance = w.compile_and_execute(lambda a, b, c: w.distance_point_to_line_segment(a, b, c)[0], [p, start, end])
         nearest = w.compile_and_execute(lambda a, b, c: w.distance_point_to_line_segment(a, b, c)[1], [p, start, end])
-        assert distance == 1.4142135623730951
\ No newline at end of file
+        assert distance == 1.4142135623730951
+
+    def test_safe_load_compiled_function(self):
+        a = w.Symbol('a')
+        b = w.Symbol('b')
+        f = w.speed_up(w.Matrix([a + b, a * b]), [a, b])
+        file_name = u'tmp_data/functions/test_function'
+        try:
+            w.safe_compiled_function(f, file_name)
+            f2 = w.load_compiled_function(file_name)
+            self.assertEqual(f.str_params, f2.str_params)
+            np.testing.assert_array_almost_equal(f.call2([2, 3]), f2.call2([2, 3]))
+            w.evict_compiled_functions(u'tmp_data/functions/', max_size=1e-9)
+            self.assertIsNone(w.load_compiled_function(file_name))
+        finally:
+            shutil.rmtree(u'tmp_data/functions/', ignore_errors=True)
+
+    def test_speed_up_compiler(self):
+        a = w.Symbol('a')
+        b = w.Symbol('b')
+        file_name = u'tmp_data/functions/test_function'
+        try:
+            for sparse in [False, True]:
+                expr = w.Matrix([[a + b, 0], [a * b, w.sin(b)]])
+                f = w.speed_up(expr, [a, b], sparse=sparse)
+                f2 = w.speed_up(expr, [a, b], backend=u'gcc', sparse=sparse, build_folder=u'tmp_data/functions/')
+                self.assertIsNotNone(f2.library)
+                np.testing.assert_array_almost_equal(f.call2([2, 3]), f2.call2([2, 3]))
+                w.safe_compiled_function(f2, file_name)
+                f3 = w.load_compiled_function(file_name)
+                np.testing.assert_array_almost_equal(f.call2([2, 3]), f3.call2([2, 3]))
+        finally:
+            shutil.rmtree(u'tmp_data/functions/', ignore_errors=True)
+
+    def test_evict_compiled_functions(self):
+        a = w.Symbol('a')
+        b = w.Symbol('b')
+        folder = u'tmp_data/functions/'
+        try:
+            f = w.speed_up(w.Matrix([a + b, a * b]), [a, b], backend=u'gcc', build_folder=folder)
+            w.safe_compiled_function(f, folder + u'old')
+            w.safe_compiled_function(f, folder + u'new')
+            # written by another process right now
+            with open(folder + u'in_progress.123.tmp', u'w') as tmp_file:
+                tmp_file.write(u'x')
+            one_week_ago = time() - 7 * 24 * 60 * 60
+            os.utime(folder + u'old', (one_week_ago, one_week_ago))
+            os.utime(f.library, (one_week_ago, one_week_ago))
+            # the library is still used by new
+            w.evict_compiled_functions(folder, max_age=1)
+            self.assertFalse(os.path.isfile(folder + u'old'))
+            self.assertTrue(os.path.isfile(f.library))
+            np.testing.assert_array_almost_equal(w.load_compiled_function(folder + u'new').call2([2, 3]), [[5], [6]])
+            w.evict_compiled_functions(folder, max_size=1e-9)
+            self.assertFalse(os.path.isfile(folder + u'new'))
+            self.assertFalse(os.path.isfile(f.library))
+            self.assertTrue(os.path.isfile(folder + u'in_progress.123.tmp'))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def test_stacked_compiled_function(self):
+        a = w.Symbol('a')
+        b = w.Symbol('b')
+        c = w.Symbol('c')
+        rows = [np.array([[0], [2]]), np.array([[1, 1, 1]])]
+        columns = [np.array([[0], [1]]), np.array([[0, 1, 2]])]
+        expected = np.array([[5, 0, 0],
+                             [3, 0, 4],
+                             [0, 6, 0]])
+        for sparse in [False, True]:
+            f1 = w.speed_up(w.Matrix([a + b, a * b]), [a, b], sparse=sparse)
+            f2 = w.speed_up(w.Matrix([[b, 0, c]]), [b, c], sparse=sparse)
+            f = w.StackedCompiledFunction([f1, f2], rows, columns, (3, 3), sparse=sparse)
+            self.assertEqual(f.str_params, [u'a', u'b', u'c'])
+            result = f(a=2, b=3, c=4)
+            if sparse:
+                dense_result = np.zeros((3, 3))
+                dense_result[f.get_sparsity()] = result
+                result = dense_result
+            np.testing.assert_array_almost_equal(result, expected)
+
+    def test_call_batch(self):
+        a = w.Symbol('a')
+        b = w.Symbol('b')
+        args = np.array([[1, 2],
+                         [3, 4],
+                         [5, 6]])
+        for sparse in [False, True]:
+            f = w.speed_up(w.Matrix([[a + b, 0], [a * b, b]]), [a, b], sparse=sparse)
+            batch = f.call_batch(args)
+            for i, (a_value, b_value) in enumerate(args):
+                result = f(a=a_value, b=b_value)
+                np.testing.assert_array_almost_equal(batch[i], result)
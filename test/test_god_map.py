@@ -305,6 +305,42 @@ class TestGodMap(unittest.TestCase):
             gm.to_symbol([key])
         self.assertEqual(len(gm.get_values(keys)), len(keys))
 
+    def test_input_layout(self):
+        gm = GodMap()
+
+        class C(object):
+            def __init__(self):
+                self.x = 1.
+
+            def f(self, a):
+                return {u'y': a}
+
+        gm.set_data([u'c'], C())
+        gm.set_data([u'd'], {u'a': [2., 3.]})
+        keys = [[u'c', u'x'], [u'c', u'f', (4.,), u'y'], [u'd', u'a', 0], [u'd', u'a', 1], [u'd', u'b']]
+        layout = gm.get_input_layout([gm.to_symbol(key) for key in keys])
+        np.testing.assert_array_almost_equal(layout.update(), [1, 4, 2, 3, 0])
+        gm.set_data([u'd', u'a', 1], 5.)
+        gm.set_data([u'd', u'b'], 6.)
+        np.testing.assert_array_almost_equal(layout.update(), [1, 4, 2, 5, 6])
+        np.testing.assert_array_almost_equal(layout.update(), gm.get_values(layout.str_params))
+
+    def test_snapshot(self):
+        gm = GodMap()
+        gm.set_data([u'a'], {u'b': 1, u'c': 2})
+        gm.set_data([u'd'], 3)
+        self.assertEqual(gm.get_snapshot().get_data([u'a', u'b']), 0)
+        gm.publish_snapshot([[u'a', u'b'], [u'd']])
+        snapshot = gm.get_snapshot()
+        gm.set_data([u'a', u'b'], 4)
+        gm.set_data([u'd'], 5)
+        self.assertEqual(snapshot.get_data([u'a', u'b']), 1)
+        self.assertEqual(snapshot.get_data([u'a', u'c']), 0)
+        self.assertEqual(snapshot.get_data([u'd']), 3)
+        gm.publish_snapshot([[u'a', u'b'], [u'd']])
+        self.assertEqual(gm.get_snapshot().get_data([u'a', u'b']), 4)
+        self.assertEqual(gm.get_snapshot().version, snapshot.version + 1)
+
     def test_god_map_with_world(self):
         gm = GodMap()
         w = World()
@@ -0,0 +1,173 @@
+import os
+import shutil
+from collections import defaultdict
+from itertools import product
+
+import numpy as np
+import pytest
+from geometry_msgs.msg import Pose
+
+import giskardpy
+
+giskardpy.WORLD_IMPLEMENTATION = u'numpy'
+
+import giskardpy.capsule_collision as cc
+from giskardpy.data_types import Collisions
+from giskardpy.numpy_world import NumpyWorld
+from giskardpy.numpy_world_object import NumpyWorldObject
+from giskardpy.utils import make_world_body_box, make_world_body_sphere, create_path
+from giskardpy.world_object import WorldObject
+from utils_for_tests import pr2_urdf
+
+# this import has to come last
+import test_world
+
+folder_name = u'tmp_data/'
+
+
+@pytest.fixture(scope=u'module')
+def module_setup(request):
+    try:
+        shutil.rmtree(folder_name)
+    except:
+        pass
+
+
+@pytest.fixture()
+def function_setup(request, module_setup):
+    pass
+
+
+@pytest.fixture()
+def test_folder(request, function_setup):
+    """
+    :rtype: str
+    """
+    return folder_name
+
+
+def brute_force_segment_distance(p0, p1, q0, q1, samples=201):
+    s = np.linspace(0, 1, samples)[:, None]
+    points_p = p0 + (p1 - p0) * s
+    points_q = q0 + (q1 - q0) * s
+    return np.min(np.linalg.norm(points_p[:, None] - points_q[None], axis=2))
+
+
+class TestCapsuleCollision(object):
+    def test_closest_points_on_segments(self):
+        np.random.seed(23)
+        p0, p1, q0, q1 = [np.random.random((50, 3)) for _ in range(4)]
+        # degenerate and parallel segments
+        p1[0] = p0[0]
+        q1[1] = q0[1]
+        p1[2], q1[2] = p0[2], q0[2]
+        q0[3], q1[3] = p0[3] + [0, 0, 1], p1[3] + [0, 0, 1]
+        on_p, on_q = cc.closest_points_on_segments(p0, p1, q0, q1)
+        distances = np.linalg.norm(on_p - on_q, axis=1)
+        for i in range(len(p0)):
+            assert distances[i] <= brute_force_segment_distance(p0[i], p1[i], q0[i], q1[i]) + 1e-9
+            assert distances[i] >= brute_force_segment_distance(p0[i], p1[i], q0[i], q1[i]) - 1e-2
+
+    def test_capsule_distances(self):
+        a = np.array([[0, 0, 0, 0, 0, 1, 0.1]], dtype=float)
+        b = np.array([[1, -1, 0.5, 1, 1, 0.5, 0.2]], dtype=float)
+        position_on_a, position_on_b, normal, distance = cc.capsule_distances(a, b)
+        np.testing.assert_array_almost_equal(distance, [0.7])
+        np.testing.assert_array_almost_equal(position_on_a, [[0.1, 0, 0.5]])
+        np.testing.assert_array_almost_equal(position_on_b, [[0.8, 0, 0.5]])
+        np.testing.assert_array_almost_equal(normal, [[-1, 0, 0]])
+
+    def test_box_to_capsules(self):
+        size = [1, 0.4, 0.1]
+        capsules = cc.box_to_capsules(size)
+        assert len(capsules) == 4
+        for corner in product(*[[-x / 2., x / 2.] for x in size]):
+            corner = np.array(corner)
+            on_segments = cc.closest_points_on_segments(np.tile(corner, (len(capsules), 1)),
+                                                        np.tile(corner, (len(capsules), 1)),
+                                                        capsules[:, :3], capsules[:, 3:6])[1]
+            assert np.any(np.linalg.norm(on_segments - corner, axis=1) <= capsules[:, 6] + 1e-9)
+
+    def test_mesh_to_capsules(self, test_folder):
+        vertices = np.array(list(product([-0.1, 0.1], [-0.05, 0.05], [-0.3, 0.3])))
+        # two triangles per side of the cuboid
+        faces = [[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                 [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]]
+        mesh_path = os.path.abspath(u'{}triangulated_cuboid.obj'.format(test_folder))
+        create_path(mesh_path)
+        with open(mesh_path, u'w') as f:
+            for vertex in vertices:
+                f.write(u'v {} {} {}\n'.format(*vertex))
+            for face in faces:
+                f.write(u'f {} {} {}\n'.format(*[i + 1 for i in face]))
+        capsules = cc.mesh_to_capsules(mesh_path, [1, 1, 2], 4, test_folder)
+        assert 0 < len(capsules) <= 4
+        # the capsules have to contain the whole surface of the scaled mesh
+        np.random.seed(23)
+        for face in faces:
+            weights = np.random.dirichlet([1, 1, 1], 50)
+            points = np.dot(weights, vertices[face] * [1, 1, 2])
+            for point in points:
+                on_segments = cc.closest_points_on_segments(np.tile(point, (len(capsules), 1)),
+                                                            np.tile(point, (len(capsules), 1)),
+                                                            capsules[:, :3], capsules[:, 3:6])[1]
+                assert np.any(np.linalg.norm(on_segments - point, axis=1) <= capsules[:, 6] + 1e-9)
+
+
+class TestNumpyWorldObject(test_world.TestWorldObj):
+    cls = NumpyWorldObject
+
+    def test_get_map_T_links(self, function_setup):
+        r = self.cls(pr2_urdf())
+        js = r.get_zero_joint_state()
+        js[u'torso_lift_joint'].position = 0.2
+        r.joint_state = js
+        map_T_links = r.get_map_T_links()
+        assert set(map_T_links.keys()) == set(r.get_link_names())
+        torso_before = map_T_links[u'torso_lift_link'][2, 3]
+        js[u'torso_lift_joint'].position = 0.1
+        r.joint_state = js
+        assert np.isclose(r.get_map_T_links()[u'torso_lift_link'][2, 3], torso_before - 0.1)
+
+
+class TestNumpyWorld(test_world.TestWorld):
+    cls = WorldObject
+    world_cls = NumpyWorld
+
+    def test_check_collisions_box(self, test_folder):
+        w = self.make_world_with_pr2()
+        box = WorldObject.from_world_body(make_world_body_box(u'box', 0.1, 0.1, 0.1))
+        w.add_object(box)
+        base_pose = Pose()
+        base_pose.position.x = 0.5
+        base_pose.position.z = 0.5
+        base_pose.orientation.w = 1
+        w.set_object_pose(u'box', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        distance_lower_bounds = {}
+        collisions = w.check_collisions(cut_off_distances, distance_lower_bounds=distance_lower_bounds)
+        assert set(distance_lower_bounds.keys()) == set(cut_off_distances.keys())
+        for collision in collisions.all_collisions:
+            key = collision.get_original_link_a(), collision.get_body_b(), collision.get_original_link_b()
+            if key in distance_lower_bounds:
+                assert distance_lower_bounds[key] <= collision.get_contact_distance() + 1e-9
+            assert collision.get_contact_distance() < cut_off_distances[key] * 1.1
+
+    def test_check_collisions_sphere(self, test_folder):
+        w = self.make_world_with_pr2()
+        sphere = WorldObject.from_world_body(make_world_body_sphere(u'sphere', 0.1))
+        w.add_object(sphere)
+        base_pose = Pose()
+        base_pose.position.x = 10
+        base_pose.orientation.w = 1
+        w.set_object_pose(u'sphere', base_pose)
+        cut_off_distances = {(link, u'sphere', u'sphere'): 0.1 for link in w.robot.get_link_names_with_collision()}
+        assert len(w.check_collisions(cut_off_distances).all_collisions) == 0
+        base_pose.position.x = 0
+        base_pose.position.z = 2
+        w.set_object_pose(u'sphere', base_pose)
+        collisions = w.check_collisions(cut_off_distances)
+        assert len(collisions.all_collisions) > 0
+        for contacts in collisions.external_collisions.values():
+            assert contacts.shape[1] == Collisions.WIDTH
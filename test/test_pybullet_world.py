@@ -1,17 +1,25 @@
+import os
 import shutil
 from collections import defaultdict
-from itertools import product
+from itertools import product, combinations
 
+import numpy as np
 import pybullet as p
 import pytest
+import urdf_parser_py.urdf as up
 from geometry_msgs.msg import Pose, Point, Quaternion
+from giskard_msgs.msg import CollisionEntry
 
+import giskardpy.collision_geometry as cg
 import giskardpy.pybullet_wrapper as pbw
 from giskardpy import logging
+from giskardpy.data_types import Collisions
+from giskardpy.pybullet_collision_workers import CollisionWorkers
 from giskardpy.pybullet_world import PyBulletWorld
 from giskardpy.pybullet_world_object import PyBulletWorldObject
 from giskardpy.robot import Robot
-from giskardpy.utils import make_world_body_box, make_world_body_sphere, make_world_body_cylinder
+from giskardpy.tfwrapper import kdl_to_np
+from giskardpy.utils import create_path, make_world_body_box, make_world_body_sphere, make_world_body_cylinder
 from giskardpy.world_object import WorldObject
 from utils_for_tests import pr2_urdf, base_bot_urdf, donbot_urdf
 
@@ -95,6 +103,39 @@ class TestPyBulletWorldObject(test_world.TestWorldObj):
         assert_num_pybullet_objects(1)
         assert u'pointy' in pbw.get_body_names()
 
+    def make_mesh_urdf(self, test_folder):
+        vertices = np.array(list(product([-0.1, 0.1], [-0.05, 0.05], [-0.3, 0.3])))
+        mesh_path = os.path.abspath(u'{}cuboid.obj'.format(test_folder))
+        create_path(mesh_path)
+        with open(mesh_path, u'w') as f:
+            for vertex in vertices:
+                f.write(u'v {} {} {}\n'.format(*vertex))
+        urdf = u'<robot name="cuboid"><link name="cuboid"><collision><origin xyz="1 0 0" rpy="0 0 0"/>' \
+               u'<geometry><mesh filename="{}"/></geometry></collision></link></robot>'.format(mesh_path)
+        return urdf, vertices
+
+    def test_simplify_collision_geometry_spheres(self, test_folder):
+        urdf, vertices = self.make_mesh_urdf(test_folder)
+        simplified = cg.simplify_collision_geometry(urdf, cg.SPHERES, test_folder, number_of_spheres=4)
+        collisions = up.URDF.from_xml_string(simplified).link_map[u'cuboid'].collisions
+        assert 0 < len(collisions) <= 4
+        # the spheres have to contain the whole surface, not only the vertices
+        face_centers = [[0.1, 0, 0], [-0.1, 0, 0], [0, 0.05, 0], [0, -0.05, 0], [0, 0, 0.3], [0, 0, -0.3]]
+        face_points = [[0.1, 0.05, 0.1], [-0.1, 0.03, -0.2], [0.05, -0.05, 0.15], [0.07, 0.02, 0.29]]
+        for point in np.concatenate([vertices, face_centers, face_points]) + np.array([1, 0, 0]):
+            assert any(np.linalg.norm(point - np.array(c.origin.xyz)) <= c.geometry.radius + 1e-9
+                       for c in collisions)
+        # the second call uses the cached spheres
+        assert cg.simplify_collision_geometry(urdf, cg.SPHERES, test_folder, number_of_spheres=4) == simplified
+
+    def test_set_collision_geometry(self, function_setup, test_folder):
+        urdf, vertices = self.make_mesh_urdf(test_folder)
+        o = self.cls(urdf)
+        o.set_collision_geometry(cg.SPHERES, test_folder, 4)
+        assert o.get_collision_urdf_str() != o.get_urdf_str()
+        assert u'sphere' in o.get_collision_urdf_str()
+        assert u'cuboid' in pbw.get_body_names()
+
 
 class TestPyBulletRobot(test_world.TestRobot):
     cls = Robot
@@ -126,6 +167,17 @@ class TestPyBulletRobot(test_world.TestRobot):
         actual = r.get_self_collision_matrix()
         assert expected == actual
 
+    def test_calc_collision_matrix_with_workers(self, test_folder):
+        r = self.cls(donbot_urdf(), path_to_data_folder=test_folder)
+        link_combinations = set(combinations(r.get_link_names_with_collision(), 2))
+        expected = r.calc_collision_matrix(link_combinations)
+        r.set_number_of_self_collision_workers(3)
+        try:
+            actual = r.calc_collision_matrix(link_combinations)
+        finally:
+            r.set_number_of_self_collision_workers(0)
+        assert expected == actual
+
     def test_attach_urdf_object1_2(self, test_folder):
         parsed_pr2 = self.cls(donbot_urdf(), path_to_data_folder=test_folder)
         parsed_pr2.init_self_collision_matrix()
@@ -180,46 +232,73 @@ class TestPyBulletWorld(test_world.TestWorld):
 
     def test_add_robot(self, function_setup):
         w = super(TestPyBulletWorld, self).test_add_robot(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_add_object(self, function_setup):
         w = super(TestPyBulletWorld, self).test_add_object(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_add_object_twice(self, function_setup):
         w = super(TestPyBulletWorld, self).test_add_object_twice(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_add_object_with_robot_name(self, function_setup):
         w = super(TestPyBulletWorld, self).test_add_object_with_robot_name(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_hard_reset1(self, function_setup):
         w = super(TestPyBulletWorld, self).test_hard_reset1(function_setup)
-        assert_num_pybullet_objects(2)
+        assert_num_pybullet_objects(1)
 
     def test_hard_reset2(self, function_setup):
         w = super(TestPyBulletWorld, self).test_hard_reset2(function_setup)
-        assert_num_pybullet_objects(2)
+        assert_num_pybullet_objects(1)
 
     def test_soft_reset1(self, function_setup):
         w = super(TestPyBulletWorld, self).test_soft_reset1(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_soft_reset2(self, function_setup):
         w = super(TestPyBulletWorld, self).test_soft_reset2(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_remove_object1(self, function_setup):
         w = super(TestPyBulletWorld, self).test_remove_object1(function_setup)
-        assert_num_pybullet_objects(3)
+        assert_num_pybullet_objects(2)
 
     def test_remove_object2(self, function_setup):
         w = super(TestPyBulletWorld, self).test_remove_object2(function_setup)
-        assert_num_pybullet_objects(4)
+        assert_num_pybullet_objects(3)
 
     def test_attach_existing_obj_to_robot(self, function_setup):
         w = super(TestPyBulletWorld, self).test_attach_existing_obj_to_robot1(function_setup)
+        # the box keeps its own body
+        assert_num_pybullet_objects(3)
+
+    def test_attach_existing_obj_to_robot_without_reload(self, function_setup):
+        w = self.make_world_with_pr2()
+        robot_id = w.robot.get_pybullet_id()
+        box = self.cls.from_world_body(make_world_body_box())
+        w.add_object(box)
+        box_id = w.get_object(u'box').get_pybullet_id()
+        pose = Pose()
+        pose.position.x = 0.1
+        pose.orientation.w = 1
+        w.attach_existing_obj_to_robot(u'box', u'l_gripper_tool_frame', pose)
+        assert w.robot.get_pybullet_id() == robot_id
+        assert w.robot.get_pybullet_body_id(u'box') == box_id
+        assert w.robot.get_pybullet_link_id(u'box') == -1
+        js = w.robot.get_zero_joint_state()
+        js[u'l_shoulder_pan_joint'].position = 0.5
+        js[u'l_elbow_flex_joint'].position = -1
+        w.robot.joint_state = js
+        map_T_gripper = w.robot.get_map_T_link_in_pybullet(u'l_gripper_tool_frame')
+        map_T_box = w.robot.get_map_T_link_in_pybullet(u'box')
+        np.testing.assert_array_almost_equal(map_T_box[:3, :3], map_T_gripper[:3, :3])
+        np.testing.assert_array_almost_equal(map_T_box[:3, 3], map_T_gripper[:3, 3] + map_T_gripper[:3, 0] * 0.1)
+        w.detach(u'box')
+        assert w.robot.get_pybullet_id() == robot_id
+        assert u'box' in w.get_object_names()
         assert_num_pybullet_objects(3)
 
     def test_collision_goals_to_collision_matrix1(self, test_folder):
@@ -344,7 +423,7 @@ class TestPyBulletWorld(test_world.TestWorld):
 
     def test_attach_detach_existing_obj_to_robot1(self, function_setup):
         w = super(TestPyBulletWorld, self).test_attach_detach_existing_obj_to_robot1(function_setup)
-        assert_num_pybullet_objects(4)
+        assert_num_pybullet_objects(3)
 
     def test_verify_collision_entries_empty(self, test_folder):
         super(TestPyBulletWorld, self).test_verify_collision_entries_empty(test_folder)
@@ -449,6 +528,242 @@ class TestPyBulletWorld(test_world.TestWorld):
         for i in range(160):
             assert len(w.check_collisions(cut_off_distances).all_collisions) == 60
 
+    def test_check_collisions_distance_lower_bounds(self, test_folder):
+        w = self.make_world_with_pr2()
+        pr22 = self.cls(pr2_urdf())
+        pr22.set_name('pr22')
+        w.add_object(pr22)
+        base_pose = Pose()
+        base_pose.position.x = 1.5
+        base_pose.orientation.w = 1
+        w.set_object_pose('pr22', base_pose)
+        robot_links = pr22.get_link_names()
+        cut_off_distances = {(link1, 'pr22', link2): 0.1 for link1, link2 in product(robot_links, repeat=2)}
+        distance_lower_bounds = {}
+        collisions = w.check_collisions(cut_off_distances, distance_lower_bounds=distance_lower_bounds)
+        assert set(distance_lower_bounds.keys()) == set(cut_off_distances.keys())
+        for collision in collisions.all_collisions:
+            key = collision.get_original_link_a(), collision.get_body_b(), collision.get_original_link_b()
+            assert distance_lower_bounds[key] <= collision.get_contact_distance()
+        contact_keys = {(x.get_original_link_a(), x.get_body_b(), x.get_original_link_b())
+                        for x in collisions.all_collisions}
+        for key, distance_lower_bound in distance_lower_bounds.items():
+            if key not in contact_keys:
+                assert distance_lower_bound >= 0.11
+
+    def test_check_collisions_sorted_arrays(self, test_folder):
+        w = self.make_world_with_pr2()
+        pr22 = self.cls(pr2_urdf())
+        pr22.set_name('pr22')
+        w.add_object(pr22)
+        base_pose = Pose()
+        base_pose.position.x = 0.05
+        base_pose.orientation.w = 1
+        w.set_object_pose('pr22', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        collisions = w.check_collisions(cut_off_distances, collision_list_size=5)
+        assert len(collisions.external_collisions) > 0
+        for link_name, contacts in collisions.external_collisions.items():
+            assert contacts.shape == (5, Collisions.WIDTH)
+            distances = contacts[:, Collisions.CONTACT_DISTANCE]
+            assert np.all(distances[:-1] <= distances[1:])
+            number_of_collisions = collisions.get_number_of_external_collisions(link_name)
+            assert np.all(distances[number_of_collisions:] == 100)
+        assert collisions.get_external_collisions(u'muh')[0, Collisions.CONTACT_DISTANCE] == 100
+
+    def test_check_collisions_transforms(self, test_folder):
+        w = self.make_world_with_pr2()
+        pr22 = self.cls(pr2_urdf())
+        pr22.set_name('pr22')
+        w.add_object(pr22)
+        base_pose = Pose()
+        base_pose.position.x = 0.05
+        base_pose.orientation.w = 1
+        w.set_object_pose('pr22', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        collisions = w.check_collisions(cut_off_distances)
+        robot = w.robot
+        root = robot.get_root()
+        root_T_map = kdl_to_np(robot.root_T_map)
+        for link_name, contacts in collisions.external_collisions.items():
+            a_T_map = np.dot(robot.get_fk_np(link_name, root), root_T_map)
+            for contact in contacts[:collisions.get_number_of_external_collisions(link_name)]:
+                position_on_a = np.append(contact[Collisions.POSITION_ON_A_IN_MAP:Collisions.POSITION_ON_A_IN_MAP + 3], 1)
+                position_on_b = np.append(contact[Collisions.POSITION_ON_B_IN_MAP:Collisions.POSITION_ON_B_IN_MAP + 3], 1)
+                normal = np.append(contact[Collisions.CONTACT_NORMAL_IN_MAP:Collisions.CONTACT_NORMAL_IN_MAP + 3], 0)
+                np.testing.assert_array_almost_equal(
+                    contact[Collisions.POSITION_ON_A_IN_A:Collisions.POSITION_ON_A_IN_A + 3],
+                    np.dot(a_T_map, position_on_a)[:3])
+                np.testing.assert_array_almost_equal(
+                    contact[Collisions.POSITION_ON_B_IN_ROOT:Collisions.POSITION_ON_B_IN_ROOT + 3],
+                    np.dot(root_T_map, position_on_b)[:3])
+                np.testing.assert_array_almost_equal(
+                    contact[Collisions.CONTACT_NORMAL_IN_ROOT:Collisions.CONTACT_NORMAL_IN_ROOT + 3],
+                    np.dot(root_T_map, normal)[:3])
+
+    def test_check_collisions_with_workers(self, test_folder):
+        w = self.make_world_with_pr2()
+        pr22 = self.cls(pr2_urdf())
+        pr22.set_name('pr22')
+        w.add_object(pr22)
+        base_pose = Pose()
+        base_pose.position.x = 0.05
+        base_pose.orientation.w = 1
+        w.set_object_pose('pr22', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        workers = CollisionWorkers(w, 3)
+        try:
+            for x in [0.05, 0.3]:
+                base_pose.position.x = x
+                w.set_object_pose('pr22', base_pose)
+                expected = w.check_collisions(cut_off_distances)
+                actual = workers.check_collisions(cut_off_distances)
+                assert len(actual.all_collisions) == len(expected.all_collisions)
+                for key in expected.external_collisions:
+                    assert actual.external_collisions[key][0, Collisions.CONTACT_DISTANCE] == \
+                           expected.external_collisions[key][0, Collisions.CONTACT_DISTANCE]
+        finally:
+            workers.stop()
+
+    def test_check_collisions_signed_distance_field(self, test_folder):
+        w = self.make_world_with_pr2()
+        box = WorldObject.from_world_body(make_world_body_box(u'box', 0.5, 2, 0.8))
+        w.add_object(box)
+        base_pose = Pose()
+        base_pose.position.x = 0.7
+        base_pose.position.z = 0.4
+        base_pose.orientation.w = 1
+        w.set_object_pose(u'box', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        expected = w.check_collisions(cut_off_distances)
+
+        w.enable_signed_distance_fields(0.02, 0.3, u'{}signed_distance_fields/'.format(test_folder))
+        distance_lower_bounds = {}
+        actual = w.check_collisions(cut_off_distances, distance_lower_bounds=distance_lower_bounds)
+        assert set(distance_lower_bounds.keys()) == set(cut_off_distances.keys())
+        assert len(actual.external_collisions) > 0
+        for link_name, contacts in expected.external_collisions.items():
+            if contacts[0, Collisions.CONTACT_DISTANCE] > 0.08:
+                continue
+            # robot links are covered by capsules, they are never further away than the original geometry
+            assert actual.external_collisions[link_name][0, Collisions.CONTACT_DISTANCE] <= \
+                   contacts[0, Collisions.CONTACT_DISTANCE] + 0.02
+        for collision in actual.all_collisions:
+            if collision.get_body_b() == u'box':
+                key = collision.get_original_link_a(), u'box', CollisionEntry.ALL
+                assert distance_lower_bounds[key] <= collision.get_contact_distance()
+
+        # moving the object doesn't require a new field
+        sdf = w.get_signed_distance_field(u'box')
+        base_pose.position.x = 10
+        w.set_object_pose(u'box', base_pose)
+        assert w.get_signed_distance_field(u'box') is sdf
+        assert len([x for x in w.check_collisions(cut_off_distances).all_collisions if x.get_body_b() == u'box']) == 0
+
+    def test_check_collisions_signed_distance_field_cut_off_larger_than_padding(self, test_folder):
+        w = self.make_world_with_pr2()
+        box = WorldObject.from_world_body(make_world_body_box(u'box', 0.5, 2, 0.8))
+        w.add_object(box)
+        base_pose = Pose()
+        base_pose.position.x = 1
+        base_pose.position.z = 0.4
+        base_pose.orientation.w = 1
+        w.set_object_pose(u'box', base_pose)
+        cut_off_distances = {(link, u'box', CollisionEntry.ALL): 0.5
+                             for link in w.robot.get_link_names_with_collision()}
+        expected = w.check_collisions(cut_off_distances)
+        assert len(expected.all_collisions) > 0
+
+        w.enable_signed_distance_fields(0.05, 0.1, u'{}signed_distance_fields/'.format(test_folder))
+        # the field ends 0.1 behind the box, these entries have to be checked without it
+        rest = w.check_signed_distance_field_collisions(Collisions(w.robot, 15), cut_off_distances)
+        assert rest == cut_off_distances
+        actual = w.check_collisions(cut_off_distances)
+        assert len(actual.all_collisions) == len(expected.all_collisions)
+
+    def test_check_collisions_signed_distance_field_mesh(self, test_folder):
+        # a triangulated cuboid, pybullet computes distances to the mesh itself
+        vertices = np.array(list(product([-0.25, 0.25], [-1, 1], [-0.4, 0.4])))
+        faces = [[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                 [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]]
+        mesh_path = os.path.abspath(u'{}mesh_cuboid.obj'.format(test_folder))
+        create_path(mesh_path)
+        with open(mesh_path, u'w') as f:
+            for vertex in vertices:
+                f.write(u'v {} {} {}\n'.format(*vertex))
+            for face in faces:
+                f.write(u'f {} {} {}\n'.format(*[i + 1 for i in face]))
+        urdf = u'<robot name="mesh"><link name="mesh"><collision><geometry><mesh filename="{}"/></geometry>' \
+               u'</collision></link></robot>'.format(mesh_path)
+        w = self.make_world_with_pr2()
+        w.add_object(WorldObject(urdf))
+        base_pose = Pose()
+        base_pose.position.x = 0.7
+        base_pose.position.z = 0.4
+        base_pose.orientation.w = 1
+        w.set_object_pose(u'mesh', base_pose)
+        min_dist = defaultdict(lambda: {u'zero_weight_distance': 0.1})
+        cut_off_distances = w.collision_goals_to_collision_matrix([], min_dist)
+        expected = [x for x in w.check_collisions(cut_off_distances).all_collisions if x.get_body_b() == u'mesh']
+        assert len(expected) > 0
+
+        w.enable_signed_distance_fields(0.02, 0.3, u'{}signed_distance_fields/'.format(test_folder))
+        distance_lower_bounds = {}
+        actual = {}
+        collisions = w.check_collisions(cut_off_distances, distance_lower_bounds=distance_lower_bounds)
+        for collision in collisions.all_collisions:
+            if collision.get_body_b() == u'mesh':
+                actual[collision.get_original_link_a()] = collision.get_contact_distance()
+        for collision in expected:
+            link_a = collision.get_original_link_a()
+            # the spheres of the mesh and the capsules of the robot contain the original geometry
+            assert distance_lower_bounds[link_a, u'mesh', CollisionEntry.ALL] <= collision.get_contact_distance() + 1e-3
+            if collision.get_contact_distance() <= 0.08:
+                assert actual[link_a] <= collision.get_contact_distance() + 0.02
+
+    def test_aabb_distance(self, function_setup):
+        aabb = (np.array([0, 0, 0]), np.array([1, 1, 1]))
+        assert pbw.aabb_distance(aabb, (np.array([0.5, 0.5, 0.5]), np.array([2, 2, 2]))) == 0
+        assert pbw.aabb_distance(aabb, (np.array([3, 0, 0]), np.array([4, 1, 1]))) == 2
+        np.testing.assert_almost_equal(pbw.aabb_distance(aabb, (np.array([2, 2, 0]), np.array([3, 3, 1]))),
+                                       np.sqrt(2))
+
+    def test_point_to_aabb_distance(self, function_setup):
+        aabb = (np.array([0, 0, 0]), np.array([1, 1, 1]))
+        assert pbw.point_to_aabb_distance([0.5, 1, 0], aabb) == 0
+        assert pbw.point_to_aabb_distance([0.5, 0.5, -2], aabb) == 2
+        np.testing.assert_almost_equal(pbw.point_to_aabb_distance([2, 2, 0.5], aabb), np.sqrt(2))
+
+    def test_get_closest_points_swapped_by_pybullet(self, function_setup):
+        # pybullet swaps a and b for self collisions, if link b has more than one collision element
+        urdf = u'<robot name="swap"><link name="a"><collision><geometry><box size="0.2 0.2 0.2"/></geometry>' \
+               u'</collision></link><joint name="joint" type="prismatic"><parent link="a"/><child link="b"/>' \
+               u'<origin xyz="{} 0 0"/><axis xyz="1 0 0"/><limit lower="-1" upper="1" effort="1" velocity="1"/>' \
+               u'</joint><link name="b"><collision><geometry><box size="0.2 0.2 0.2"/></geometry></collision>' \
+               u'<collision><origin xyz="0 0 0.3"/><geometry><sphere radius="0.05"/></geometry></collision></link>' \
+               u'</robot>'
+        # separated, touching and penetrating
+        for x in [0.4, 0.2, 0.19]:
+            body = pbw.load_urdf_string_into_bullet(urdf.format(x))
+            try:
+                raw_contacts = [pbw.ContactInfo(*c) for c in p.getClosestPoints(body, body, 0.5, -1, 0)]
+                assert len(raw_contacts) > 0
+                assert all(c.contact_normal_on_b[0] > 0 for c in raw_contacts)
+                contacts = pbw.get_closest_points(body, -1, body, 0, 0.5, {})
+                assert len(contacts) == len(raw_contacts)
+                for link_index_b, position_on_a, position_on_b, contact_normal, contact_distance in contacts:
+                    # the normal points from b towards a and position_on_a is on a
+                    assert contact_normal[0] < 0
+                    assert np.all(np.abs(position_on_a) <= 0.1 + 1e-3)
+                    np.testing.assert_array_almost_equal(np.array(position_on_b) + np.array(contact_normal) *
+                                                         contact_distance, position_on_a, decimal=3)
+            finally:
+                p.removeBody(body)
+
     # TODO test that has collision entries of robot links without collision geometry
 
     # TODO test that makes sure adding avoid specific self collisions works
@@ -1,6 +1,13 @@
+from collections import OrderedDict
+
 import numpy as np
+import pytest
+from scipy.sparse import csc_matrix
 
-from giskardpy.qp_solver import QPSolver
+from giskardpy import cas_wrapper as w
+from giskardpy.data_types import SoftConstraint, HardConstraint, JointConstraint
+from giskardpy.qp_problem_builder import QProblemBuilder
+from giskardpy.qp_solver import QPSolver, get_qp_solver_class, OSQP, BaseQPSolver
 
 
 def test_simple_problem():
@@ -101,3 +108,176 @@ def test_non_diagonal_H():
     print(x)
     print(qp.qpProblem.getObjVal())
     # np.testing.assert_array_almost_equal(x, np.array([5,5]), decimal=4)
+
+
+def test_simple_problem_sparse():
+    weights = np.ones(2) * 2
+    A = csc_matrix(np.ones((1, 2)))
+    g = np.zeros(2)
+    lba = np.array([10.])
+    lb = np.array([-10., -10.])
+    ub = np.array([10., 10.])
+
+    qp = QPSolver()
+    x = qp.solve_sparse(weights, g, A, lb, ub, lba, lba)
+    np.testing.assert_array_almost_equal(x, np.array([5, 5]), decimal=4)
+
+
+def test_simple_problem_osqp():
+    H = np.eye(2) * 2
+    A = np.ones((1, 2))
+    g = np.zeros(2)
+    lba = np.array([10.])
+    lb = np.array([-10., -10.])
+    ub = np.array([10., 10.])
+
+    qp = get_qp_solver_class(OSQP)()
+    x = qp.solve(H, g, A, lb, ub, lba, lba)
+    np.testing.assert_array_almost_equal(x, np.array([5, 5]), decimal=4)
+    # hot start
+    x = qp.solve(H, g, A, lb, ub, lba, lba)
+    np.testing.assert_array_almost_equal(x, np.array([5, 5]), decimal=4)
+
+
+def test_simple_problem_osqp_without_constraints():
+    H = np.eye(2) * 2
+    A = np.zeros((0, 2))
+    g = np.array([-2., 4.])
+    lba = np.zeros(0)
+    lb = np.array([-10., -10.])
+    ub = np.array([10., 10.])
+
+    x = get_qp_solver_class(OSQP)().solve(H, g, A, lb, ub, lba, lba)
+    np.testing.assert_array_almost_equal(x, np.array([1, -2]), decimal=4)
+
+
+def test_simple_problem_sparse_osqp():
+    weights = np.array([1., 1, 10, 1000])
+    A = csc_matrix(np.array([[1., 1, 1, 0],
+                             [1, 1, 0, 1]]))
+    g = np.zeros(4)
+    lba = np.array([10., 5.])
+    lb = np.array([-10., -10., -1e9, -1e9])
+    ub = np.array([10., 10., 1e9, 1e9])
+
+    x_osqp = get_qp_solver_class(OSQP)().solve_sparse(weights, g, A, lb, ub, lba, lba)
+    x_qpoases = QPSolver().solve_sparse(weights, g, A, lb, ub, lba, lba)
+    np.testing.assert_array_almost_equal(x_osqp, x_qpoases, decimal=3)
+
+
+def test_incomplete_qp_solver():
+    class IncompleteQPSolver(BaseQPSolver):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteQPSolver()
+
+
+def make_constraints(collision_offset=0):
+    """
+    A small problem with three joints, a hard constraint and soft constraints of two goal types.
+    :param collision_offset: changes the expression of the collision constraint
+    :return: joint constraints, hard constraints, soft constraints, controlled joint symbols
+    """
+    j = [w.Symbol(u'j{}'.format(i)) for i in range(3)]
+    goal = w.Symbol(u'goal')
+    collision_weight = w.Symbol(u'collision_weight')
+    joint_constraints = OrderedDict((u'j{}'.format(i), JointConstraint(lower=-1 - j[i],
+                                                                      upper=1 - j[i],
+                                                                      weight=0.01,
+                                                                      linear_weight=0))
+                                    for i in range(3))
+    hard_constraints = OrderedDict([(u'limit', HardConstraint(lower=-0.5 - j[0] - j[1],
+                                                              upper=0.5 - j[0] - j[1],
+                                                              expression=j[0] + j[1]))])
+    soft_constraints = OrderedDict()
+    for name, expression in [(u'Position/x', w.sin(j[0]) * j[1] + j[2]),
+                             (u'Position/y', w.cos(j[1]) * j[2])]:
+        soft_constraints[name] = SoftConstraint(lbA=goal - expression,
+                                                ubA=goal - expression,
+                                                weight=1,
+                                                expression=expression,
+                                                goal_constraint=True,
+                                                lower_slack_limit=-1e9,
+                                                upper_slack_limit=1e9,
+                                                linear_weight=0)
+    collision_expression = j[0] * j[2] + collision_offset
+    soft_constraints[u'Collision/a'] = SoftConstraint(lbA=0.1 - collision_expression,
+                                                      ubA=1e9,
+                                                      weight=collision_weight,
+                                                      expression=collision_expression,
+                                                      goal_constraint=False,
+                                                      lower_slack_limit=-1e9,
+                                                      upper_slack_limit=1e9,
+                                                      linear_weight=0)
+    return joint_constraints, hard_constraints, soft_constraints, j
+
+
+def get_substitutions(qp_problem_builder, values):
+    """
+    :param values: symbol name -> value
+    :type values: dict
+    :return: the values in the order of qp_problem_builder.get_expr()
+    :rtype: np.ndarray
+    """
+    return np.array([values[x] for x in qp_problem_builder.get_expr()], dtype=float)
+
+
+def test_qp_problem_builder_reuses_compiled_groups():
+    values = {u'j0': 0.1, u'j1': -0.2, u'j2': 0.3, u'goal': 0.4, u'collision_weight': 1}
+    qpb = QProblemBuilder(*make_constraints())
+    # the hashes don't depend on the identity of the expressions
+    assert list(QProblemBuilder(*make_constraints()).compiled_groups.keys()) == list(qpb.compiled_groups.keys())
+
+    changed_qpb = QProblemBuilder(*make_constraints(collision_offset=0.2), compiled_groups=qpb.compiled_groups)
+    new_groups = [x for x in changed_qpb.compiled_groups if x not in qpb.compiled_groups]
+    assert len(new_groups) == 1
+    for group_hash, compiled_group in changed_qpb.compiled_groups.items():
+        if group_hash not in new_groups:
+            assert compiled_group is qpb.compiled_groups[group_hash]
+
+    fresh_qpb = QProblemBuilder(*make_constraints(collision_offset=0.2))
+    np.testing.assert_array_almost_equal(
+        changed_qpb.compiled_big_ass_M.call2(get_substitutions(changed_qpb, values)),
+        fresh_qpb.compiled_big_ass_M.call2(get_substitutions(fresh_qpb, values)))
+
+
+def test_qp_problem_builder_sparse():
+    dense_qpb = QProblemBuilder(*make_constraints())
+    sparse_qpb = QProblemBuilder(*make_constraints(), sparse=True)
+    for collision_weight in [1, 0]:
+        values = {u'j0': 0.1, u'j1': -0.2, u'j2': 0.3, u'goal': 0.4, u'collision_weight': collision_weight}
+        _, H, A, lb, ub, lbA, ubA, x = dense_qpb.get_cmd(get_substitutions(dense_qpb, values))
+        _, sparse_H, sparse_A, sparse_lb, sparse_ub, sparse_lbA, sparse_ubA, sparse_x = \
+            sparse_qpb.get_cmd(get_substitutions(sparse_qpb, values))
+        np.testing.assert_array_almost_equal(np.diag(np.diag(H)), H)
+        np.testing.assert_array_almost_equal(np.diag(H), sparse_H)
+        np.testing.assert_array_almost_equal(A, sparse_A.toarray())
+        for dense_vector, sparse_vector in zip([lb, ub, lbA, ubA], [sparse_lb, sparse_ub, sparse_lbA, sparse_ubA]):
+            np.testing.assert_array_almost_equal(dense_vector, sparse_vector)
+
+        g = np.zeros(len(lb))
+        filtered = dense_qpb.filter_zero_weight_constraints(H, A, lb, ub, lbA, ubA, g)
+        sparse_filtered = sparse_qpb.filter_zero_weight_constraints(sparse_H, sparse_A, sparse_lb, sparse_ub,
+                                                                    sparse_lbA, sparse_ubA, g)
+        np.testing.assert_array_almost_equal(np.diag(filtered[0]), sparse_filtered[0])
+        np.testing.assert_array_almost_equal(filtered[1], sparse_filtered[1].toarray())
+        for dense_vector, sparse_vector in zip(filtered[2:], sparse_filtered[2:]):
+            np.testing.assert_array_almost_equal(dense_vector, sparse_vector)
+        # the collision constraint is removed, if its weight is 0
+        assert len(x) == len(sparse_x) == 3 + 3 - (collision_weight == 0)
+        np.testing.assert_array_almost_equal(x, sparse_x, decimal=4)
+
+
+def test_qp_problem_builder_batch():
+    np.random.seed(23)
+    dense_qpb = QProblemBuilder(*make_constraints())
+    values = [dict(zip([u'j0', u'j1', u'j2', u'goal', u'collision_weight'], np.random.uniform(-1, 1, 5)))
+              for _ in range(4)]
+    for sparse in [False, True]:
+        qpb = QProblemBuilder(*make_constraints(), sparse=sparse)
+        batch = qpb.get_big_ass_M_batch(np.array([get_substitutions(qpb, x) for x in values]))
+        assert batch.shape == (len(values),) + dense_qpb.compiled_big_ass_M.shape
+        for x, big_ass_M in zip(values, batch):
+            np.testing.assert_array_almost_equal(big_ass_M,
+                                                 dense_qpb.compiled_big_ass_M.call2(get_substitutions(dense_qpb, x)))
@@ -13,6 +13,7 @@ import pytest
 from urdf_parser_py.urdf import URDF
 
 from giskardpy.robot import Robot
+from giskardpy.world_object import WorldObject
 from utils_for_tests import rnd_joint_state, pr2_urdf, donbot_urdf, boxy_urdf, base_bot_urdf, compare_poses
 from giskardpy.urdf_object import hacky_urdf_parser_fix
 from kdl_parser import kdl_tree_from_urdf_model
@@ -184,6 +185,96 @@ class TestSymengineController(object):
             symengine_fk = parsed_pr2.get_fk_pose(root, tip).pose
             compare_poses(kdl_fk, symengine_fk)
 
+    @given(rnd_joint_state(pr2_joint_limits))
+    def test_pr2_fk2(self, parsed_pr2, js):
+        """
+        fk between links on different branches, the expressions share their common chain
+        :type parsed_pr2: Robot
+        """
+        root = u'odom_combined'
+        mjs = {}
+        for joint_name, position in js.items():
+            mjs[joint_name] = SingleJointState(joint_name, position)
+        parsed_pr2.joint_state = mjs
+        for link_a, link_b in [(u'l_gripper_tool_frame', u'r_gripper_tool_frame'),
+                               (u'head_mount_kinect_rgb_optical_frame', u'l_forearm_link'),
+                               (u'r_gripper_tool_frame', u'torso_lift_link')]:
+            root_T_a = parsed_pr2.get_fk_np(root, link_a)
+            root_T_b = parsed_pr2.get_fk_np(root, link_b)
+            np.testing.assert_array_almost_equal(parsed_pr2.get_fk_np(link_a, link_b),
+                                                 np.dot(np.linalg.inv(root_T_a), root_T_b))
+
+    @given(rnd_joint_state(pr2_joint_limits))
+    def test_pr2_fk_all_links(self, parsed_pr2, js):
+        """
+        the compiled fk of all links agrees with the numpy fk of WorldObject
+        :type parsed_pr2: Robot
+        """
+        mjs = {}
+        for joint_name, position in js.items():
+            mjs[joint_name] = SingleJointState(joint_name, position)
+        parsed_pr2.joint_state = mjs
+        root_T_links = parsed_pr2.get_root_T_links_np()
+        assert root_T_links.shape == (len(parsed_pr2.get_link_names()), 4, 4)
+        expected = WorldObject.get_root_T_links(parsed_pr2)
+        for link_name, root_T_link in expected.items():
+            np.testing.assert_array_almost_equal(root_T_links[parsed_pr2.get_link_index(link_name)], root_T_link)
+            np.testing.assert_array_almost_equal(parsed_pr2.get_fk_np(parsed_pr2.get_root(), link_name), root_T_link)
+
+    def test_pr2_fk_cache_invalidation(self, parsed_pr2):
+        """
+        :type parsed_pr2: Robot
+        """
+        root = parsed_pr2.get_root()
+        js = parsed_pr2.get_zero_joint_state()
+        parsed_pr2.joint_state = js
+        pairs = [(root, u'l_gripper_tool_frame'), (root, u'r_gripper_tool_frame'),
+                 (u'r_shoulder_pan_link', u'r_gripper_tool_frame'), (u'torso_lift_link', u'head_plate_frame')]
+        for root_link, tip_link in pairs:
+            parsed_pr2.get_fk_np(root_link, tip_link)
+        parsed_pr2.reset_fk_cache_statistics()
+
+        # setting the same joint state again keeps all fks
+        parsed_pr2.joint_state = js
+        for root_link, tip_link in pairs:
+            parsed_pr2.get_fk_np(root_link, tip_link)
+        assert parsed_pr2.fk_cache_hits == 4
+        assert parsed_pr2.fk_cache_misses == 0
+
+        # only the chains that contain r_shoulder_pan_joint change
+        js[u'r_shoulder_pan_joint'].position = 0.5
+        parsed_pr2.joint_state = js
+        parsed_pr2.reset_fk_cache_statistics()
+        for root_link, tip_link in pairs:
+            parsed_pr2.get_fk_np(root_link, tip_link)
+        assert parsed_pr2.fk_cache_hits == 3
+        assert parsed_pr2.fk_cache_misses == 1
+        expected = WorldObject.get_root_T_links(parsed_pr2)
+        np.testing.assert_array_almost_equal(parsed_pr2.get_fk_np(root, u'r_gripper_tool_frame'),
+                                             expected[u'r_gripper_tool_frame'])
+
+    def test_pr2_fk_np_batch(self, parsed_pr2):
+        """
+        :type parsed_pr2: Robot
+        """
+        root = u'odom_combined'
+        tip = u'r_gripper_tool_frame'
+        joint_names = [u'torso_lift_joint', u'r_shoulder_pan_joint', u'r_shoulder_lift_joint',
+                       u'r_upper_arm_roll_joint', u'r_elbow_flex_joint', u'r_forearm_roll_joint', u'r_wrist_flex_joint']
+        js = parsed_pr2.get_zero_joint_state()
+        # joints that are not in joint_names keep their current position
+        js[u'r_wrist_roll_joint'].position = 0.3
+        parsed_pr2.joint_state = js
+        positions = np.random.uniform(-0.5, 0.5, (5, len(joint_names)))
+        positions[:, 0] = np.random.uniform(0, 0.3, 5)
+        batch = parsed_pr2.get_fk_np_batch(root, tip, joint_names, positions)
+        assert batch.shape == (5, 4, 4)
+        for row, root_T_tip in zip(positions, batch):
+            for joint_name, position in zip(joint_names, row):
+                js[joint_name].position = position
+            parsed_pr2.joint_state = js
+            np.testing.assert_array_almost_equal(root_T_tip, parsed_pr2.get_fk_np(root, tip))
+
     @given(rnd_joint_state(donbot_joint_limits))
     def test_donbot_fk1(self, parsed_donbot, js):
         kdl = KDL(donbot_urdf())
@@ -215,6 +306,31 @@ class TestSymengineController(object):
             compare_poses(kdl_fk, symengine_fk)
 
 
+    def test_get_chain_reduced_to_controlled_joints_pr2(self, parsed_pr2):
+        def reduce_chain(link_a, link_b):
+            chain = parsed_pr2.get_chain(link_b, link_a)
+            joint_indices = [i for i, x in enumerate(chain) if i % 2 == 1 and x in parsed_pr2.controlled_joints]
+            if not joint_indices:
+                raise KeyError()
+            return chain[joint_indices[-1] + 1], chain[joint_indices[0] - 1]
+
+        links = [u'r_gripper_tool_frame', u'l_forearm_link', u'torso_lift_link', u'base_link', u'head_plate_frame',
+                 u'odom_combined', u'r_shoulder_pan_link']
+        parsed_pr2.controlled_joints = [u'torso_lift_joint', u'r_shoulder_pan_joint', u'r_wrist_flex_joint',
+                                        u'l_elbow_flex_joint', u'head_pan_joint']
+        for link_a in links:
+            for link_b in links:
+                try:
+                    expected = reduce_chain(link_a, link_b)
+                except KeyError:
+                    with pytest.raises(KeyError):
+                        parsed_pr2.get_chain_reduced_to_controlled_joints(link_a, link_b)
+                    continue
+                assert parsed_pr2.get_chain_reduced_to_controlled_joints(link_a, link_b) == expected
+        assert parsed_pr2.get_controlled_parent_joint(u'r_gripper_tool_frame') == u'r_wrist_flex_joint'
+        with pytest.raises(KeyError):
+            parsed_pr2.get_controlled_parent_joint(u'base_link')
+
     def test_get_controllable_joint_names_pr2(self, parsed_pr2):
         expected = {u'l_shoulder_pan_joint', u'br_caster_l_wheel_joint', u'r_gripper_l_finger_tip_joint',
                     u'r_elbow_flex_joint', u'torso_lift_joint', u'r_gripper_l_finger_joint', u'r_forearm_roll_joint',
@@ -1,6 +1,7 @@
 import pytest
 from geometry_msgs.msg import Pose, Point, Quaternion
 
+from giskardpy import urdf_object
 from giskardpy.exceptions import DuplicateNameException, UnknownBodyException
 from giskardpy.urdf_object import URDFObject
 from giskardpy.utils import make_world_body_box, make_world_body_sphere, make_world_body_cylinder, make_urdf_world_body
@@ -1040,6 +1041,70 @@ class TestUrdfObject(object):
         chain = parsed_donbot.get_chain('base_link', 'plate')
         assert chain == ['base_link', 'plate_joint', 'plate']
 
+    def test_get_split_chain_all_pairs(self, function_setup):
+        parsed_donbot = self.cls(donbot_urdf())
+        urdf_robot = parsed_donbot._urdf_robot
+        root = parsed_donbot.get_root()
+        for link_a in parsed_donbot.get_link_names():
+            for link_b in parsed_donbot.get_link_names():
+                if link_a == link_b:
+                    continue
+                chain_a = urdf_robot.get_chain(root, link_a, False, True, True)
+                chain_b = urdf_robot.get_chain(root, link_b, False, True, True)
+                connection = [x for x, y in zip(chain_a, chain_b) if x == y][-1]
+                assert parsed_donbot.get_connecting_link(link_a, link_b) == connection
+                assert parsed_donbot.are_linked(link_a, link_b) == \
+                       (urdf_robot.parent_map.get(link_a, (None, None))[1] == link_b or
+                        urdf_robot.parent_map.get(link_b, (None, None))[1] == link_a)
+                for joints, links, fixed in [(True, True, True), (True, False, False), (False, True, True)]:
+                    root_chain, connection_chain, tip_chain = parsed_donbot.get_split_chain(link_a, link_b, joints,
+                                                                                           links, fixed)
+                    expected_root_chain = urdf_robot.get_chain(connection, link_a, joints, links, fixed)
+                    expected_tip_chain = urdf_robot.get_chain(connection, link_b, joints, links, fixed)
+                    if links:
+                        expected_root_chain = expected_root_chain[1:]
+                        expected_tip_chain = expected_tip_chain[1:]
+                    assert root_chain == expected_root_chain[::-1]
+                    assert connection_chain == ([connection] if links else [])
+                    assert tip_chain == expected_tip_chain
+
+    def test_get_urdf_hash(self, function_setup):
+        parsed_pr2 = self.cls(pr2_urdf())
+        hash_before = parsed_pr2.get_urdf_hash()
+        urdf_before = parsed_pr2.get_urdf_str()
+        box = self.cls.from_world_body(make_world_body_box())
+        p = Pose()
+        p.orientation.w = 1
+        parsed_pr2.attach_urdf_object(box, u'l_gripper_tool_frame', p)
+        assert parsed_pr2.get_urdf_hash() != hash_before
+        assert parsed_pr2.get_urdf_str() != urdf_before
+        assert parsed_pr2.get_urdf_hash() == self.cls(parsed_pr2.get_urdf_str()).get_urdf_hash()
+        parsed_pr2.detach_sub_tree(box.get_name())
+        assert parsed_pr2.get_urdf_hash() == hash_before
+        assert parsed_pr2.get_urdf_str() == urdf_before
+        parsed_pr2.set_name(u'pr3')
+        assert parsed_pr2.get_urdf_hash() != hash_before
+
+    def test_parse_urdf_cache(self, function_setup):
+        parsed_pr2 = self.cls(pr2_urdf())
+        parsed_pr2_2 = self.cls(pr2_urdf())
+        assert parsed_pr2 == parsed_pr2_2
+        box = self.cls.from_world_body(make_world_body_box())
+        p = Pose()
+        p.orientation.w = 1
+        parsed_pr2.attach_urdf_object(box, u'l_gripper_tool_frame', p)
+        assert box.get_name() not in parsed_pr2_2.get_link_names()
+        assert box.get_name() not in self.cls(pr2_urdf()).get_link_names()
+
+    def test_parse_urdf_cache_keeps_recently_used_urdfs(self, function_setup):
+        pr2 = pr2_urdf()
+        self.cls(pr2)
+        for i in range(urdf_object.PARSED_URDF_CACHE_SIZE):
+            self.cls.from_world_body(make_world_body_box(u'box{}'.format(i)))
+            self.cls(pr2)
+        assert pr2 in urdf_object._parsed_urdfs
+        assert u'box0' not in [x.name for _, x in urdf_object._parsed_urdfs.values()]
+
     def test_get_leaves(self, function_setup):
         parsed_pr2 = self.cls(pr2_urdf())
         leaves = parsed_pr2.get_leaves()
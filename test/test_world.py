@@ -1,3 +1,4 @@
+import os
 import shutil
 from collections import defaultdict
 
@@ -12,6 +13,8 @@ from giskard_msgs.msg import CollisionEntry
 import test_urdf_object
 from giskardpy.exceptions import DuplicateNameException, PhysicsWorldException, UnknownBodyException
 from utils_for_tests import pr2_urdf, donbot_urdf, compare_poses, pr2_without_base_urdf
+from giskardpy.signed_distance_field import SignedDistanceField, box_distances, get_signed_distance_field, \
+    get_signed_distance_field_hash
 from giskardpy.utils import make_world_body_box
 from giskardpy.world import World
 from giskardpy.world_object import WorldObject
@@ -1085,3 +1088,48 @@ class TestWorld(object):
         assert collision_matrix == {(u'base_link', u'pr2', u'r_wrist_flex_link'): 0.05}
 
         return world_with_pr2
+
+
+class TestSignedDistanceField(object):
+    def test_box(self, function_setup):
+        box = WorldObject.from_world_body(make_world_body_box(u'box', 1, 0.5, 0.2))
+        sdf = SignedDistanceField.from_world_object(box, 0.02, 0.3)
+        np.random.seed(23)
+        points = np.random.uniform(-0.9, 0.9, (1000, 3))
+        distances, gradients, link_indices, in_grid = sdf.lookup(points)
+        expected = box_distances(points, [1, 0.5, 0.2])
+        assert in_grid.any() and not in_grid.all()
+        np.testing.assert_allclose(distances[in_grid], expected[in_grid], atol=0.02)
+        assert np.all(distances[~in_grid] <= expected[~in_grid] + 1e-9)
+        assert np.all(distances[~in_grid] >= 0.3)
+        assert set(link_indices) == {0}
+        # the gradient points away from the box
+        outside = in_grid & (expected > 0.05)
+        assert np.all(np.einsum(u'ij,ij->i', gradients[outside], points[outside]) > 0)
+
+    def test_get_contacts(self, function_setup):
+        box = WorldObject.from_world_body(make_world_body_box(u'box', 1, 1, 1))
+        sdf = SignedDistanceField.from_world_object(box, 0.02, 0.3)
+        map_T_box = np.eye(4)
+        map_T_box[:3, 3] = [1, 0, 0]
+        # a capsule along z, 0.15m away from the -x side of the box
+        capsules = np.array([[0.25, 0, -0.2, 0.25, 0, 0.2, 0.1]])
+        (groups, link_indices, position_on_a, position_on_b, contact_normal, contact_distance), lower_bounds = \
+            sdf.get_contacts(map_T_box, capsules, np.array([0]), 1)
+        assert len(groups) == 1
+        assert sdf.link_names[link_indices[0]] == u'box'
+        np.testing.assert_allclose(contact_distance, [0.15], atol=0.02)
+        np.testing.assert_allclose(position_on_a[0, 0], 0.35, atol=0.02)
+        np.testing.assert_allclose(position_on_b[0, 0], 0.5, atol=0.02)
+        np.testing.assert_allclose(contact_normal[0], [-1, 0, 0], atol=0.05)
+        assert lower_bounds[0] <= contact_distance[0]
+
+    def test_cache(self, test_folder):
+        box = WorldObject.from_world_body(make_world_body_box(u'box', 1, 0.5, 0.2))
+        cache_folder = u'{}signed_distance_fields/'.format(test_folder)
+        sdf = get_signed_distance_field(box, 0.05, 0.2, cache_folder)
+        path = u'{}{}.sdf'.format(cache_folder, get_signed_distance_field_hash(box, 0.05, 0.2))
+        assert os.path.isfile(path)
+        sdf2 = get_signed_distance_field(box, 0.05, 0.2, cache_folder)
+        np.testing.assert_array_equal(sdf.distances, sdf2.distances)
+        assert get_signed_distance_field_hash(box, 0.05, 0.2) != get_signed_distance_field_hash(box, 0.02, 0.2)
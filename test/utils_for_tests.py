@@ -25,6 +25,7 @@ from tf.transformations import rotation_from_matrix, quaternion_matrix
 from giskardpy import logging, identifier
 from giskardpy.garden import grow_tree
 from giskardpy.identifier import robot, world
+from giskardpy.data_types import Collisions
 from giskardpy.pybullet_world import PyBulletWorld
 from giskardpy.python_interface import GiskardWrapper
 from giskardpy.robot import Robot
@@ -736,7 +737,8 @@ class GiskardTestWrapper(object):
     def get_external_collisions(self, link, distance_threshold):
         """
         :param distance_threshold:
-        :rtype: list
+        :return: contacts of the link sorted by contact distance, see the column constants of Collisions
+        :rtype: np.ndarray
         """
         collision_goals = [CollisionEntry(type=CollisionEntry.AVOID_ALL_COLLISIONS, min_dist=distance_threshold)]
         collision_matrix = self.get_world().collision_goals_to_collision_matrix(collision_goals,
@@ -744,26 +746,27 @@ class GiskardTestWrapper(object):
         collisions = self.get_world().check_collisions(collision_matrix)
         controlled_parent_joint = self.get_robot().get_controlled_parent_joint(link)
         controlled_parent_link = self.get_robot().get_child_link_of_joint(controlled_parent_joint)
-        collision_list = collisions.get_external_collisions(controlled_parent_link)
+        collision_list = [collisions.get_external_collisions(controlled_parent_link)]
         for key, self_collisions in collisions.self_collisions.items():
             if controlled_parent_link in key:
-                collision_list.update(self_collisions)
-        return collision_list
+                collision_list.append(self_collisions)
+        collision_list = np.concatenate(collision_list)
+        return collision_list[collision_list[:, Collisions.CONTACT_DISTANCE].argsort()]
 
     def check_cpi_geq(self, links, distance_threshold):
         for link in links:
             collisions = self.get_external_collisions(link, distance_threshold)
-            assert collisions[0].get_contact_distance() >= distance_threshold, \
+            assert collisions[0, Collisions.CONTACT_DISTANCE] >= distance_threshold, \
                 u'distance for {}: {} >= {}'.format(link,
-                                                    collisions[0].get_contact_distance(),
+                                                    collisions[0, Collisions.CONTACT_DISTANCE],
                                                     distance_threshold)
 
     def check_cpi_leq(self, links, distance_threshold):
         for link in links:
             collisions = self.get_external_collisions(link, distance_threshold)
-            assert collisions[0].get_contact_distance() <= distance_threshold, \
+            assert collisions[0, Collisions.CONTACT_DISTANCE] <= distance_threshold, \
                 u'distance for {}: {} <= {}'.format(link,
-                                                    collisions[0].get_contact_distance(),
+                                                    collisions[0, Collisions.CONTACT_DISTANCE],
                                                     distance_threshold)
 
     def move_base(self, goal_pose):